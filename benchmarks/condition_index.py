@@ -0,0 +1,79 @@
+"""
+    This file measures finding conditions of test cases in generated ptu files with thousands of IF-scopes,
+    using the condition index of LineNum (see build_condition_index in extract_data), compared with the linear scan
+    of all IF-scopes which was used by classify_data before it.
+"""
+from os import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import argparse
+import sys
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import extract_data
+from generate_ptu import generate_ptu
+
+
+def generate_if_ptu(service_count):
+    """
+    Generates a ptu file (see generate_ptu function) where every VAR line of elements is inside its own IF-scope.
+    :returns: content of the file as a single string
+    """
+    lines = []
+    for line in generate_ptu(service_count).splitlines():
+        if line.startswith("VAR x"):
+            lines += ["IF VALUE_%d" % len(lines), line, "END IF"]
+        else:
+            lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def legacy_check_for_conditions(line_numbers, start_line_num, end_line_num):
+    """
+    Finds conditions of a scope by checking all of IF-scopes from the start, as classify_data did before the index.
+    """
+    condition_list = []
+    for if_scope in line_numbers.IF_SCOPE_LIST:
+        if if_scope.START_IF > end_line_num:  # If there is no IF-scope that includes the input scope
+            break
+        if start_line_num > if_scope.START_IF and end_line_num < if_scope.END_IF:
+            condition_list.append(if_scope.condition)
+    return condition_list
+
+
+def measure(function, line_numbers, line_num_list):
+    """
+    :returns: time in seconds of finding conditions of all of lines in line_num_list
+    """
+    start_time = perf_counter()
+    for line_num in line_num_list:
+        function(line_numbers, line_num, line_num)
+    return perf_counter() - start_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure finding conditions of test cases in ptu files with "
+                                                 "thousands of IF-scopes")
+    parser.add_argument("-s", "--sizes", default="25,50,100,200",
+                        help="numbers of services in generated files, separated by comma")
+    args = parser.parse_args()
+
+    print("%10s %10s %12s %12s %12s %14s" % ("services", "IF-scopes", "test cases", "scan (s)", "index (s)",
+                                             "open_ptu (s)"))
+    with TemporaryDirectory() as temp_dir:
+        for service_count in [int(size) for size in args.sizes.split(",")]:
+            file_path = path.join(temp_dir, "generated_%d.ptu" % service_count)
+            with open(file_path, "wt") as ptu_file:
+                ptu_file.write(generate_if_ptu(service_count))
+
+            with open(file_path, "rt") as ptu_file:
+                lines, line_numbers = extract_data.pre_process(ptu_file)
+            test_case_lines = [line_num for line_num, line in enumerate(lines) if line.startswith("VAR")]
+            scan_time = measure(legacy_check_for_conditions, line_numbers, test_case_lines)
+            index_time = measure(extract_data.LineNum.get_conditions, line_numbers, test_case_lines)
+
+            start_time = perf_counter()
+            extract_data.open_ptu(file_path, path.basename(file_path))
+            open_time = perf_counter() - start_time
+            print("%10d %10d %12d %12.3f %12.3f %14.3f" % (service_count, len(line_numbers.IF_SCOPE_LIST),
+                                                           len(test_case_lines), scan_time, index_time, open_time))
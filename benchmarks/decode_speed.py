@@ -0,0 +1,75 @@
+"""
+    This file measures the cost per file of refining and extracting a ptu file with decoding its lines (text mode)
+    and without decoding them (binary mode of rewrite_ptu_file in refine_data and open_ptu in extract_data).
+"""
+from os import path, makedirs
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import argparse
+import shutil
+import sys
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import refine_data
+import extract_data
+from generate_ptu import write_ptu
+
+
+def measure(function, repeat_count, *args, **kwargs):
+    """
+    :returns: best time of repeat_count calls of the function in seconds
+    """
+    best_time = None
+    for _ in range(repeat_count):
+        start_time = perf_counter()
+        function(*args, **kwargs)
+        elapsed = perf_counter() - start_time
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+    return best_time
+
+
+def read_lines(file_path, encoding, binary):
+    """
+    Reads all of lines of the file the same as rewrite_ptu_file does, without refining them.
+    """
+    with refine_data.open_text_file(file_path, "rt", encoding, binary) as ptu_file:
+        for _ in ptu_file:
+            pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cost per file of reading ptu files with and without "
+                                                 "decoding their lines")
+    parser.add_argument("file_path", nargs="?", default=None,
+                        help="ptu file which is measured (default: a generated file)")
+    parser.add_argument("-s", "--services", type=int, default=2000, help="number of services in generated file")
+    parser.add_argument("-e", "--encoding", default=None, help="encoding of ptu file (default: platform default)")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="number of runs, best of them is reported")
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as temp_dir:
+        old_path = path.join(temp_dir, "old")
+        new_path = path.join(temp_dir, "new")
+        makedirs(old_path)
+        # Files are joined to their folder the same as refine_data module does
+        file_name = "measured.ptu"
+        old_file_path = old_path + "\\" + file_name
+        if args.file_path is None:
+            file_size = write_ptu(old_file_path, args.services)
+        else:
+            shutil.copyfile(args.file_path, old_file_path)
+            file_size = path.getsize(old_file_path)
+
+        print("%.1f MB, encoding %s" % (file_size / 1e6, args.encoding))
+        print("%-20s %12s %12s" % ("", "text (ms)", "binary (ms)"))
+        rows = [
+            ("read lines", lambda binary: measure(read_lines, args.repeat, old_file_path, args.encoding, binary)),
+            ("rewrite_ptu_file", lambda binary: measure(refine_data.rewrite_ptu_file, args.repeat, file_name,
+                                                        old_path, new_path, encoding=args.encoding, binary=binary)),
+            ("open_ptu", lambda binary: measure(extract_data.open_ptu, args.repeat, old_file_path, file_name,
+                                                args.encoding, binary=binary)),
+            ("open_ptu use_mmap", lambda binary: measure(extract_data.open_ptu, args.repeat, old_file_path,
+                                                         file_name, args.encoding, use_mmap=True, binary=binary)),
+        ]
+        for name, measure_row in rows:
+            print("%-20s %12.1f %12.1f" % (name, measure_row(False) * 1000, measure_row(True) * 1000))
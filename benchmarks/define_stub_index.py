@@ -0,0 +1,84 @@
+"""
+    This file measures pre_process (in extract_data) of generated ptu files with hundreds of DEFINE STUB blocks,
+    where every user-code line is checked by LineNum.valid_data using bisection, compared with the loop over all of
+    DEFINE STUB blocks which was used before it.
+"""
+from os import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import argparse
+import sys
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import extract_data
+
+
+def generate_stub_ptu(stub_count, user_code_count=10):
+    """
+    Generates a ptu file with many DEFINE STUB blocks, each of them followed by user-code lines.
+    :param stub_count: number of DEFINE STUB blocks
+    :param user_code_count: number of user-code lines after every block
+    :returns: content of the file as a single string
+    """
+    lines = ["-- Filename : stubs.ptu", "-- Purpose: generated", "HEADER module, 1.0, 2.0"]
+    for stub in range(stub_count):
+        lines += ["DEFINE STUB stubs_%d" % stub, "#int f_%d(int a);" % stub, "#int g_%d(int b);" % stub, "END DEFINE"]
+        lines += ["#int global_%d_%d;" % (stub, counter) for counter in range(user_code_count)]
+    lines += ["-- Test Cases", "SERVICE service", "TEST 1", "ELEMENT", "VAR x, init = 0, ev = init", "END ELEMENT",
+              "END TEST", "END SERVICE"]
+    return "\n".join(lines) + "\n"
+
+
+def legacy_valid_data(line_numbers, line_num):
+    """
+    Checks whether the line is user-code by checking all of DEFINE STUB blocks, as valid_data did before bisection.
+    """
+    if line_numbers.TEST_CASES_START_FLAG:
+        return False
+    if len(line_numbers.DEFINE_STUB_START_LIST) > len(line_numbers.DEFINE_STUB_END_LIST):
+        return False
+    for counter in range(line_numbers.get_define_stub_count()):
+        if line_numbers.DEFINE_STUB_START_LIST[counter] < line_num < line_numbers.DEFINE_STUB_END_LIST[counter]:
+            return False
+    return True
+
+
+def measure_pre_process(file_path, valid_data):
+    """
+    Runs pre_process of extract_data, which checks every user-code line while DEFINE STUB blocks are being found.
+    :param valid_data: function which is used as valid_data method of LineNum class
+    :returns: time in seconds
+    """
+    original_valid_data = extract_data.LineNum.valid_data
+    extract_data.LineNum.valid_data = valid_data
+    try:
+        with open(file_path, "rt") as ptu_file:
+            start_time = perf_counter()
+            extract_data.pre_process(ptu_file)
+            return perf_counter() - start_time
+    finally:
+        extract_data.LineNum.valid_data = original_valid_data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure checking user-code lines of ptu files with many DEFINE "
+                                                 "STUB blocks")
+    parser.add_argument("-s", "--sizes", default="250,500,1000,2000",
+                        help="numbers of DEFINE STUB blocks in generated files, separated by comma")
+    args = parser.parse_args()
+
+    print("%10s %12s %16s %16s %14s" % ("blocks", "size (MB)", "loop (s)", "bisect (s)", "open_ptu (s)"))
+    with TemporaryDirectory() as temp_dir:
+        for stub_count in [int(size) for size in args.sizes.split(",")]:
+            file_path = path.join(temp_dir, "stubs_%d.ptu" % stub_count)
+            content = generate_stub_ptu(stub_count)
+            with open(file_path, "wt") as ptu_file:
+                ptu_file.write(content)
+
+            loop_time = measure_pre_process(file_path, legacy_valid_data)
+            bisect_time = measure_pre_process(file_path, extract_data.LineNum.valid_data)
+            start_time = perf_counter()
+            extract_data.open_ptu(file_path, path.basename(file_path))
+            open_time = perf_counter() - start_time
+            print("%10d %12.2f %16.3f %16.3f %14.3f" % (stub_count, len(content) / 1e6, loop_time, bisect_time,
+                                                        open_time))
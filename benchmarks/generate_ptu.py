@@ -0,0 +1,61 @@
+"""
+    This file generates well-formed ptu files of any size, used in benchmarks
+"""
+import argparse
+
+
+def generate_ptu(service_count, test_count=5, value_count=10):
+    """
+    Generates content of a ptu file with all kinds of scopes, IFs, comments and test cases.
+    Size of the file grows linearly with number of services.
+    :param service_count: number of services in the file
+    :param test_count: number of tests in every service
+    :param value_count: number of input test cases in every element
+    :returns: content of the file as a single string
+    """
+    lines = ["-- Filename : template.ptu", "-- Purpose: generated", "-- Processor: PPC", "-- Tool chain: GCC",
+             "--~T", "HEADER module, 1.0, 2.0", "##include \"a.h\"", "--~+:generated file"]
+    for counter in range(50):
+        lines.append("#int global_%d;" % counter)
+        if counter % 5 == 0:
+            lines += ["IF TARGET_%d" % counter, "#int only_%d;" % counter, "ELSE", "#int not_%d;" % counter, "END IF"]
+    lines += ["DEFINE STUB stubs", "#int f(int a);", "END DEFINE", "--~T", "##define const const",
+              "INITIALISATION", "#a = 1;", "END INITIALISATION",
+              "ENVIRONMENT env", "VAR a, init = 0, ev = init", "END ENVIRONMENT", "-- Test Cases"]
+    for service in range(service_count):
+        if service % 3 == 0:
+            lines.append("IF SERVICE_%d" % service)
+        lines += ["SERVICE service_%d" % service, "#int local;", "USE env"]
+        for test in range(test_count):
+            lines += ["TEST %d" % test, "FAMILY nominal", "COMMENT test %d" % test, "ELEMENT", "-- input"]
+            for value in range(value_count):
+                if value == 5:
+                    lines.append("IF VALUE_%d" % value)
+                lines.append("VAR x%d, init = %d, ev = init" % (value, value))
+                if value == 7:
+                    lines.append("END IF")
+            lines += ["-- output", "VAR y, init = 0, ev = 2", "ARRAY table, init = {1,2,", "&3,4}, ev = init",
+                      "--~T", "STUB f(1)1", "#y = 1;", "END ELEMENT", "END TEST"]
+        lines.append("END SERVICE")
+        if service % 3 == 0:
+            lines.append("END IF")
+    return "\n".join(lines) + "\n"
+
+
+def write_ptu(file_path, service_count):
+    """
+    Writes a generated ptu file (see generate_ptu function).
+    :returns: size of the file in bytes
+    """
+    content = generate_ptu(service_count)
+    with open(file_path, "wt") as ptu_file:
+        ptu_file.write(content)
+    return len(content)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a well-formed ptu file")
+    parser.add_argument("file_path", help="path of ptu file to be written")
+    parser.add_argument("service_count", type=int, help="number of services in the file")
+    args = parser.parse_args()
+    print("%d bytes" % write_ptu(args.file_path, args.service_count))
@@ -0,0 +1,92 @@
+"""
+    This file measures extracting several generated ptu files on several processes with open_ptu_many (in
+    extract_data), where workbooks are handed off through mapped files (see WorkBookView in parse_cache), compared
+    with the naive way of sending every workbook back from its process as a pickled object.
+"""
+from os import path
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import argparse
+import pickle
+import sys
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import constants as const
+import extract_data
+import parse_cache
+from generate_ptu import write_ptu
+
+
+def open_one(file_path):
+    return extract_data.open_ptu(file_path, path.basename(file_path))
+
+
+def open_pickled(file_paths, jobs):
+    """
+    Extracts files on several processes, every workbook is pickled and sent back (by ProcessPoolExecutor).
+    """
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(open_one, file_paths))
+
+
+def open_views(file_paths, jobs, read_services):
+    """
+    Extracts files with open_ptu_many, services are only read if read_services is True.
+    """
+    workbooks = extract_data.open_ptu_many(file_paths, jobs=jobs)
+    for workbook in workbooks:
+        if read_services:
+            for _ in workbook.services:
+                pass
+        workbook.close()
+
+
+def open_view(file_path):
+    parse_cache.WorkBookView(file_path).close()
+
+
+def measure(function, repeat_count, *args):
+    """
+    :returns: best time of repeat_count calls of the function in seconds
+    """
+    best_time = None
+    for _ in range(repeat_count):
+        start_time = perf_counter()
+        function(*args)
+        elapsed = perf_counter() - start_time
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+    return best_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure handing off workbooks of ptu files from other processes")
+    parser.add_argument("-f", "--files", type=int, default=8, help="number of generated files")
+    parser.add_argument("-s", "--services", type=int, default=500, help="number of services in every file")
+    parser.add_argument("-j", "--jobs", type=int, default=2, help="number of processes")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="number of runs, best of them is reported")
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as temp_dir:
+        file_paths = [path.join(temp_dir, "generated_%d.ptu" % counter) for counter in range(args.files)]
+        file_size = sum(write_ptu(file_path, args.services) for file_path in file_paths)
+        print("%d files, %.1f MB, %d processes" % (args.files, file_size / 1e6, args.jobs))
+
+        print("%-36s %10s" % ("", "time (s)"))
+        print("%-36s %10.3f" % ("pickle", measure(open_pickled, args.repeat, file_paths, args.jobs)))
+        print("%-36s %10.3f" % ("views", measure(open_views, args.repeat, file_paths, args.jobs, False)))
+        print("%-36s %10.3f" % ("views, reading all services", measure(open_views, args.repeat, file_paths,
+                                                                        args.jobs, True)))
+
+        # Cost of handing off a single workbook, without extracting it
+        workbook = open_one(file_paths[0])
+        pickled = pickle.dumps(workbook, pickle.HIGHEST_PROTOCOL)
+        view_path = path.join(temp_dir, "view" + const.PARSE_CACHE_EXTENSION)
+        with open(view_path, "wb") as view_file:
+            view_file.write(parse_cache.dump_workbook(workbook))
+        print("%-36s %10.3f" % ("one workbook: pickle.dumps", measure(pickle.dumps, args.repeat, workbook,
+                                                                       pickle.HIGHEST_PROTOCOL)))
+        print("%-36s %10.3f" % ("one workbook: pickle.loads", measure(pickle.loads, args.repeat, pickled)))
+        print("%-36s %10.3f" % ("one workbook: dump_workbook", measure(parse_cache.dump_workbook, args.repeat,
+                                                                        workbook)))
+        print("%-36s %10.3f" % ("one workbook: open view", measure(open_view, args.repeat, view_path)))
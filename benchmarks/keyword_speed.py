@@ -0,0 +1,51 @@
+"""
+    This file measures lines per second of finding keywords of lines (see classify_keyword in keywords),
+    compared with the chains of startswith which were used in refine_data and extract_data before it.
+"""
+from os import path
+from time import perf_counter
+import argparse
+import sys
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from keywords import classify_keyword
+from tests.test_keywords import legacy_check_for_errors, legacy_pre_process, refine_keyword
+from generate_ptu import generate_ptu
+
+
+def measure(classify, lines, repeat_count):
+    """
+    :param classify: function which finds keyword of a line
+    :returns: lines per second, best of repeat_count runs
+    """
+    best_time = None
+    for _ in range(repeat_count):
+        start_time = perf_counter()
+        for line in lines:
+            classify(line)
+        elapsed = perf_counter() - start_time
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+    return len(lines) / best_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure lines per second of finding keywords of ptu lines")
+    parser.add_argument("file_path", nargs="?", default=None,
+                        help="ptu file whose lines are classified (default: a generated file)")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="number of runs, best of them is reported")
+    args = parser.parse_args()
+
+    if args.file_path is None:
+        lines = generate_ptu(2000).splitlines(keepends=True)
+    else:
+        with open(args.file_path, "rt") as ptu_file:
+            lines = ptu_file.readlines()
+    stripped_lines = [line.strip() for line in lines]
+
+    print("%d lines" % len(lines))
+    print("%-20s %14s %14s" % ("", "before (l/s)", "after (l/s)"))
+    # extract_data strips every line before finding its keyword, refine_data strips it while finding it
+    print("%-20s %14.0f %14.0f" % ("pre_process", measure(legacy_pre_process, stripped_lines, args.repeat),
+                                   measure(classify_keyword, stripped_lines, args.repeat)))
+    print("%-20s %14.0f %14.0f" % ("check_for_errors", measure(legacy_check_for_errors, lines, args.repeat),
+                                   measure(refine_keyword, lines, args.repeat)))
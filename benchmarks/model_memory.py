@@ -0,0 +1,211 @@
+"""
+    This file measures memory of the data model of extracted ptu files (see PtuWorkBook in ptu_workbook) in bytes per
+    test case, compared with the model before it, where every object had a dictionary and every element and test
+    allocated all of its arrays. Strings are shared by both models, so only memory of objects and arrays is measured.
+"""
+from os import path
+from tempfile import TemporaryDirectory
+import argparse
+import sys
+import tracemalloc
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import extract_data
+from ptu_workbook import PtuWorkBook
+from generate_ptu import write_ptu
+
+
+class LegacyTestCase:
+    def __init__(self):
+        self.conditions = []
+        self.param_type = ""
+        self.param_name = ""
+        self.init = ""
+        self.ev = ""
+
+
+class LegacyStub:
+    def __init__(self):
+        self.conditions = []
+        self.stub_definition = ""
+
+
+class LegacyUserCode:
+    def __init__(self):
+        self.conditions = []
+        self.code = ""
+
+
+class LegacyElement:
+    def __init__(self):
+        self.use = []
+        self.input_data = []
+        self.calibrations = []
+        self.output_data = []
+        self.stub_calls = []
+        self.user_code = []
+
+
+class LegacyTest:
+    def __init__(self):
+        self.name = ""
+        self.family = ""
+        self.comment = []
+        self.use = []
+        self.element = LegacyElement()
+        self.conditions = []
+
+
+class LegacyService:
+    def __init__(self):
+        self.name = ""
+        self.test_list = []
+        self.conditions = []
+        self.user_code = []
+        self.use = []
+
+
+def copy_legacy_services(services):
+    """
+    :returns: Array of services in the model before slots, where conditions are arrays of every object and USEs of
+              test and service are copied into every element
+    """
+    def copy_test_cases(test_cases):
+        copies = []
+        for test_case in test_cases:
+            copy = LegacyTestCase()
+            copy.conditions = list(test_case.conditions)
+            copy.param_type, copy.param_name = test_case.param_type, test_case.param_name
+            copy.init, copy.ev = test_case.init, test_case.ev
+            copies.append(copy)
+        return copies
+
+    def copy_user_code(user_code_list):
+        copies = []
+        for user_code in user_code_list:
+            copy = LegacyUserCode()
+            copy.conditions = list(user_code.conditions)
+            copy.code = user_code.code
+            copies.append(copy)
+        return copies
+
+    legacy_services = []
+    for service in services:
+        legacy_service = LegacyService()
+        legacy_service.name = service.name
+        legacy_service.conditions = list(service.conditions)
+        legacy_service.user_code = copy_user_code(service._user_code or ())
+        legacy_service.use = list(service._use or ())
+        for test in service._test_list or ():
+            legacy_test = LegacyTest()
+            legacy_test.name, legacy_test.family = test.name, test.family
+            legacy_test.conditions = list(test.conditions)
+            legacy_test.comment = list(test._comment or ())
+            legacy_test.use = list(test._use or ())
+            element, legacy_element = test.element, legacy_test.element
+            legacy_element.use = list(element.get_all_use())
+            legacy_element.input_data = copy_test_cases(element._input_data or ())
+            legacy_element.calibrations = copy_test_cases(element._calibrations or ())
+            legacy_element.output_data = copy_test_cases(element._output_data or ())
+            for stub in element._stub_calls or ():
+                legacy_stub = LegacyStub()
+                legacy_stub.conditions = list(stub.conditions)
+                legacy_stub.stub_definition = stub.stub_definition
+                legacy_element.stub_calls.append(legacy_stub)
+            legacy_element.user_code = copy_user_code(element._user_code or ())
+            legacy_test.element = legacy_element
+            legacy_service.test_list.append(legacy_test)
+        legacy_services.append(legacy_service)
+    return legacy_services
+
+
+def copy_services(services):
+    """
+    :returns: Array of services in the model of PtuWorkBook, arrays which are empty are not allocated
+    """
+    def copy_test_cases(test_cases):
+        copies = []
+        for test_case in test_cases:
+            copy = PtuWorkBook.TestCase()
+            copy.conditions = test_case.conditions
+            copy.param_type, copy.param_name = test_case.param_type, test_case.param_name
+            copy.init, copy.ev = test_case.init, test_case.ev
+            copies.append(copy)
+        return copies or None
+
+    def copy_user_code(user_code_list):
+        copies = []
+        for user_code in user_code_list:
+            copy = PtuWorkBook.UserCode()
+            copy.conditions = user_code.conditions
+            copy.code = user_code.code
+            copies.append(copy)
+        return copies or None
+
+    copied_services = []
+    for service in services:
+        copied_service = PtuWorkBook.Service()
+        copied_service.name = service.name
+        copied_service.conditions = service.conditions
+        copied_service._user_code = copy_user_code(service._user_code or ())
+        copied_service._use = list(service._use) if service._use else None
+        for test in service._test_list or ():
+            copied_test = PtuWorkBook.Test()
+            copied_test.name, copied_test.family = test.name, test.family
+            copied_test.conditions = test.conditions
+            copied_test._comment = list(test._comment) if test._comment else None
+            copied_test._use = list(test._use) if test._use else None
+            element, copied_element = test.element, copied_test.element
+            copied_element._own_use = list(element._own_use) if element._own_use else None
+            copied_element._input_data = copy_test_cases(element._input_data or ())
+            copied_element._calibrations = copy_test_cases(element._calibrations or ())
+            copied_element._output_data = copy_test_cases(element._output_data or ())
+            stub_calls = []
+            for stub in element._stub_calls or ():
+                copied_stub = PtuWorkBook.Stub()
+                copied_stub.conditions = stub.conditions
+                copied_stub.stub_definition = stub.stub_definition
+                stub_calls.append(copied_stub)
+            copied_element._stub_calls = stub_calls or None
+            copied_element._user_code = copy_user_code(element._user_code or ())
+            copied_test.extend_use()
+            copied_service.test_list.append(copied_test)
+        copied_service.extend_use()
+        copied_services.append(copied_service)
+    return copied_services
+
+
+def measure_copy(copy_function, services):
+    """
+    :returns: Bytes allocated by python for copying the services, which are kept until it is measured
+    """
+    tracemalloc.start()
+    copies = copy_function(services)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del copies
+    return size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure bytes per test case of the data model of ptu files")
+    parser.add_argument("file_path", nargs="?", default=None,
+                        help="ptu file which is extracted (default: a generated file)")
+    parser.add_argument("-s", "--services", type=int, default=1000, help="number of services in generated file")
+    args = parser.parse_args()
+
+    if args.file_path is None:
+        with TemporaryDirectory() as temp_dir:
+            file_path = path.join(temp_dir, "generated.ptu")
+            write_ptu(file_path, args.services)
+            workbook = extract_data.open_ptu(file_path, "generated.ptu")
+    else:
+        workbook = extract_data.open_ptu(args.file_path, path.basename(args.file_path))
+    services = list(workbook.services)
+    test_case_count = sum(len(test.element._input_data or ()) + len(test.element._calibrations or ()) +
+                          len(test.element._output_data or ()) for service in services for test in service.test_list)
+
+    print("%d services, %d test cases" % (len(services), test_case_count))
+    print("%-20s %14s" % ("", "bytes/test case"))
+    print("%-20s %14.1f" % ("before (dict)", measure_copy(copy_legacy_services, services) / test_case_count))
+    print("%-20s %14.1f" % ("after (slots)", measure_copy(copy_services, services) / test_case_count))
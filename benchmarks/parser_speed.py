@@ -0,0 +1,64 @@
+"""
+    This file measures throughput and peak memory of extracting generated ptu files of growing size,
+    with two passes (pre_process and classify_data in extract_data) and with the single-pass PtuParser.
+"""
+from os import path
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import argparse
+import sys
+import tracemalloc
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import extract_data
+from generate_ptu import write_ptu
+
+
+def measure_open(file_path, single_pass, trace_memory):
+    """
+    Extracts a ptu file, called in a new process for every run so memory of one run does not hide another.
+    :param trace_memory: If True, peak of memory allocated by python is measured (extracting is slower)
+    :returns: time in seconds, or peak memory in bytes with trace_memory
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start_time = perf_counter()
+    extract_data.open_ptu(file_path, path.basename(file_path), single_pass=single_pass)
+    elapsed = perf_counter() - start_time
+
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+    return elapsed
+
+
+def run_in_new_process(function, *args):
+    """
+    Calls the function in a new process, started by spawn so no memory is inherited from this process.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(function, *args).result()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure throughput and peak memory of extracting ptu files with "
+                                                 "two passes and with the single-pass parser")
+    parser.add_argument("-s", "--sizes", default="500,1000,2000,4000",
+                        help="numbers of services in generated files, separated by comma")
+    args = parser.parse_args()
+
+    print("%10s %10s %15s %15s %15s %15s" % ("services", "size (MB)", "two-pass MB/s", "single MB/s",
+                                              "two-pass (MB)", "single (MB)"))
+    with TemporaryDirectory() as temp_dir:
+        for service_count in [int(size) for size in args.sizes.split(",")]:
+            file_path = path.join(temp_dir, "generated_%d.ptu" % service_count)
+            file_size = write_ptu(file_path, service_count)
+            results = [run_in_new_process(measure_open, file_path, single_pass, trace_memory)
+                       for trace_memory in (False, True) for single_pass in (False, True)]
+            print("%10d %10.1f %15.1f %15.1f %15.1f %15.1f" % (service_count, file_size / 1e6,
+                                                              file_size / 1e6 / results[0],
+                                                              file_size / 1e6 / results[1],
+                                                              results[2] / 1e6, results[3] / 1e6))
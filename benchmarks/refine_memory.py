@@ -0,0 +1,76 @@
+"""
+    This file measures time and peak memory of refining generated ptu files of growing size,
+    so it can be seen that memory of rewrite_ptu_file (in refine_data) does not grow with file size.
+"""
+from os import path, makedirs
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import argparse
+import sys
+import tracemalloc
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import refine_data
+from generate_ptu import write_ptu
+
+try:
+    import resource  # Not available on Windows, only memory allocated by python is measured there
+except ImportError:
+    resource = None
+
+
+def measure_refine(file_name, old_path, new_path, trace_memory):
+    """
+    Refines a ptu file, called in a new process for every file so peak memory of one file does not hide another.
+    :param trace_memory: If True, peak of memory allocated by python is measured (refining is slower)
+    :returns: Tuple of (time in seconds, peak memory in bytes). Peak memory is peak RSS of process, or None if it
+              can't be measured on this platform. With trace_memory, it is peak of memory allocated by python.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start_time = perf_counter()
+    refine_data.rewrite_ptu_file(file_name, old_path, new_path)
+    elapsed = perf_counter() - start_time
+
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    elif resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak *= 1 if sys.platform == "darwin" else 1024  # Kilobytes, except on macOS
+    else:
+        peak = None
+    return elapsed, peak
+
+
+def run_in_new_process(function, *args):
+    """
+    Calls the function in a new process, started by spawn so no memory is inherited from this process.
+    Files are generated in a new process too, otherwise peak RSS of this process would be seen in the next ones.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(function, *args).result()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure peak memory of refining ptu files of growing size")
+    parser.add_argument("-s", "--sizes", default="500,1000,2000,4000,8000",
+                        help="numbers of services in generated files, separated by comma")
+    args = parser.parse_args()
+
+    print("%10s %10s %10s %14s %14s" % ("services", "size (MB)", "time (s)", "peak RSS (MB)", "python (MB)"))
+    with TemporaryDirectory() as temp_dir:
+        old_path = path.join(temp_dir, "old")
+        new_path = path.join(temp_dir, "new")
+        makedirs(old_path)
+        for service_count in [int(size) for size in args.sizes.split(",")]:
+            file_name = "generated_%d.ptu" % service_count
+            file_size = run_in_new_process(write_ptu, old_path + "\\" + file_name, service_count)
+
+            elapsed, peak_rss = run_in_new_process(measure_refine, file_name, old_path, new_path, False)
+            traced_peak = run_in_new_process(measure_refine, file_name, old_path, new_path, True)[1]
+            print("%10d %10.1f %10.3f %14s %14.2f" % (service_count, file_size / 1e6, elapsed,
+                                                      "-" if peak_rss is None else "%.1f" % (peak_rss / 1e6),
+                                                      traced_peak / 1e6))
@@ -0,0 +1,61 @@
+"""
+    This file measures lines per second of extracting test case lines (VAR, ARRAY and STR) with the precompiled
+    tokenizer (see extract_test_case_line in extract_data), compared with extract_test_case_fields which splits and
+    replaces parts of every line and was used for all of lines before it.
+"""
+from os import path
+from time import perf_counter
+import argparse
+import sys
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import extract_data
+from generate_ptu import generate_ptu
+
+
+def read_test_case_lines(lines):
+    """
+    :returns: Array of stripped test case lines, joined with the lines which continue them
+    """
+    lines = lines + [""]
+    return [extract_data.join_test_case_lines(lines, line_num) for line_num in range(len(lines))
+            if lines[line_num].strip().upper().startswith(("VAR", "ARRAY", "STR"))]
+
+
+def measure(extract, lines, repeat_count):
+    """
+    :param extract: function which extracts a test case line into a TestCase object
+    :returns: lines per second, best of repeat_count runs
+    """
+    best_time = None
+    for _ in range(repeat_count):
+        start_time = perf_counter()
+        for line in lines:
+            extract(extract_data.PtuWorkBook.TestCase(), line)
+        elapsed = perf_counter() - start_time
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+    return len(lines) / best_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure lines per second of extracting test case lines")
+    parser.add_argument("file_path", nargs="?", default=None,
+                        help="ptu file whose test case lines are extracted (default: a generated file)")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="number of runs, best of them is reported")
+    args = parser.parse_args()
+
+    if args.file_path is None:
+        lines = generate_ptu(2000).splitlines(keepends=True)
+    else:
+        with open(args.file_path, "rt") as ptu_file:
+            lines = ptu_file.readlines()
+    test_case_lines = read_test_case_lines(lines)
+    tokenized_count = sum(extract_data.tokenize_test_case(line) is not None for line in test_case_lines)
+
+    print("%d test case lines, %.1f%% of them tokenized" % (len(test_case_lines),
+                                                            100 * tokenized_count / len(test_case_lines)))
+    print("%-30s %14s" % ("", "lines/s"))
+    print("%-30s %14.0f" % ("extract_test_case_fields", measure(extract_data.extract_test_case_fields,
+                                                                test_case_lines, args.repeat)))
+    print("%-30s %14.0f" % ("extract_test_case_line", measure(extract_data.extract_test_case_line,
+                                                              test_case_lines, args.repeat)))
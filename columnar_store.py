@@ -0,0 +1,196 @@
+"""
+    This file includes a columnar store of test cases for analysing many ptu files, used in other modules
+"""
+from array import array
+import constants as const
+from ptu_workbook import PtuWorkBook, ConditionTable
+
+try:
+    import numpy
+except ImportError:  # Filters are done without numpy (slower), if it is not installed
+    numpy = None
+
+
+class StringTable:
+    """
+    Every distinct string is saved once and is given an integer ID (in order of adding).
+    """
+
+    def __init__(self):
+        self.strings = []  # ID -> string
+        self.ids = {}  # String -> ID
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __getitem__(self, string_id):
+        return self.strings[string_id]
+
+    def add(self, string):
+        """
+        :returns: ID of the string, the string is added if it is not in the table
+        """
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.ids[string] = string_id
+            self.strings.append(string)
+        return string_id
+
+    def find(self, string):
+        """
+        :returns: ID of the string, or -1 if it is not in the table
+        """
+        return self.ids.get(string, -1)
+
+
+class TestCaseStore:
+    """
+    Test cases of many PtuWorkBook objects, saved in columns instead of TestCase objects.
+    Every test case is a row. Strings (type, name, init, ev) are saved as IDs of string tables,
+    conditions as ID of a condition table, and owners (file, service, test) as indexes of owner tables.
+    Every column is an array of integers, which is used as a numpy array (without copying) when numpy is installed,
+    so finding test cases (see find method) is done for all of rows at once.
+    TestCase objects are only made when a row is asked (see get_test_case method).
+    """
+
+    def __init__(self):
+        self.strings = StringTable()  # Types, names, initial and expected values of test cases
+        self.condition_sets = ConditionTable()  # Conditions of all of workbooks
+        self.files = []  # Name of workbooks
+        self.services = []  # Tuples of (file index, name of service)
+        self.tests = []  # Tuples of (service index, name of test)
+
+        # Columns, a value for every test case
+        self.param_type = array("i")
+        self.param_name = array("i")
+        self.init = array("i")
+        self.ev = array("i")
+        self.conditions = array("i")
+        self.file = array("i")
+        self.service = array("i")  # -1 for test cases of environments
+        self.test = array("i")  # -1 for test cases of environments
+        self.role = array("b")  # One of TEST_CASE_... constants
+
+        self.numpy_columns = None  # Name of column -> numpy array, made when it is used once
+
+    def __len__(self):
+        return len(self.role)
+
+    def add_workbook(self, workbook):
+        """
+        Adds all of test cases of the workbook (in its environments and elements of its services) to the store.
+        :param workbook: Object of PtuWorkBook class
+        :returns: Index of the workbook in files
+        """
+        file_index = len(self.files)
+        self.files.append(workbook.name)
+        for environment in workbook.environments:
+            for test_case in environment.test_case_list:
+                self.add_test_case(test_case, file_index, -1, -1, const.TEST_CASE_ENVIRONMENT)
+        for service in workbook.services:
+            service_index = len(self.services)
+            self.services.append((file_index, service.name))
+            for test in service.test_list:
+                test_index = len(self.tests)
+                self.tests.append((service_index, test.name))
+                element = test.element
+                for test_case in element._input_data or ():
+                    self.add_test_case(test_case, file_index, service_index, test_index, const.TEST_CASE_INPUT)
+                for test_case in element._calibrations or ():
+                    self.add_test_case(test_case, file_index, service_index, test_index, const.TEST_CASE_CALIBRATION)
+                for test_case in element._output_data or ():
+                    self.add_test_case(test_case, file_index, service_index, test_index, const.TEST_CASE_OUTPUT)
+        return file_index
+
+    def add_test_case(self, test_case, file_index, service_index, test_index, role):
+        """
+        Adds a row for the test case.
+        :param test_case: Object of TestCase class
+        :param role: One of TEST_CASE_... constants
+        """
+        self.numpy_columns = None  # Arrays can't grow while numpy arrays use their memory
+        add_string = self.strings.add
+        self.param_type.append(add_string(test_case.param_type))
+        self.param_name.append(add_string(test_case.param_name))
+        self.init.append(add_string(str(test_case.init)))  # Value may be a LazyValue object
+        self.ev.append(add_string(str(test_case.ev)))
+        self.conditions.append(self.condition_sets.get(test_case.conditions).id)
+        self.file.append(file_index)
+        self.service.append(service_index)
+        self.test.append(test_index)
+        self.role.append(role)
+
+    def get_test_case(self, index):
+        """
+        :param index: Index of row
+        :returns: A new object of TestCase class with data of the row
+        """
+        test_case = PtuWorkBook.TestCase()
+        test_case.param_type = self.strings[self.param_type[index]]
+        test_case.param_name = self.strings[self.param_name[index]]
+        test_case.init = self.strings[self.init[index]]
+        test_case.ev = self.strings[self.ev[index]]
+        test_case.conditions = self.condition_sets[self.conditions[index]]
+        return test_case
+
+    def get_owner(self, index):
+        """
+        :param index: Index of row
+        :returns: Tuple of (name of workbook, name of service, name of test), names of service and test are ""
+                  for test cases of environments
+        """
+        test_index = self.test[index]
+        if test_index == -1:
+            return self.files[self.file[index]], "", ""
+        service_index, test_name = self.tests[test_index]
+        file_index, service_name = self.services[service_index]
+        return self.files[file_index], service_name, test_name
+
+    def get_numpy_column(self, name):
+        """
+        :param name: Name of column (e.g. "param_name")
+        :returns: The column as a numpy array, which shares memory with the array of column
+                  (it must not be kept while test cases are added)
+        """
+        if self.numpy_columns is None:
+            self.numpy_columns = {}
+        column = self.numpy_columns.get(name)
+        if column is None:
+            values = getattr(self, name)
+            column = numpy.frombuffer(values, dtype=numpy.dtype(values.typecode)) if len(values) else \
+                numpy.zeros(0, dtype=numpy.dtype(values.typecode))
+            self.numpy_columns[name] = column
+        return column
+
+    def find(self, param_type=None, param_name=None, init=None, ev=None, role=None, conditions=None):
+        """
+        Finds test cases which have all of the given values (None means any value), e.g.
+        find(param_name="x", role=const.TEST_CASE_OUTPUT) finds all of output checks of parameter x.
+        :param conditions: Array of conditions (exactly the same as conditions of test case)
+        :returns: Indexes of rows in ascending order (a numpy array if numpy is installed, otherwise an array)
+        """
+        wanted = []  # Tuples of (name of column, wanted value)
+        for name, value in (("param_type", param_type), ("param_name", param_name), ("init", init), ("ev", ev)):
+            if value is not None:
+                wanted.append((name, self.strings.find(value)))
+        if role is not None:
+            wanted.append(("role", role))
+        if conditions is not None:
+            condition_set = self.condition_sets.find(conditions)
+            wanted.append(("conditions", -1 if condition_set is None else condition_set.id))
+
+        if any(value == -1 for name, value in wanted):  # A string which is not in any of test cases
+            return numpy.zeros(0, dtype=numpy.intp) if numpy is not None else array("q")
+
+        if numpy is not None:
+            mask = numpy.ones(len(self), dtype=bool)
+            for name, value in wanted:
+                mask &= self.get_numpy_column(name) == value
+            return numpy.flatnonzero(mask)
+
+        indexes = range(len(self))
+        for name, value in wanted:
+            column = getattr(self, name)
+            indexes = [index for index in indexes if column[index] == value]
+        return array("q", indexes)
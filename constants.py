@@ -13,6 +13,26 @@ TEST_ERROR = 5
 ELEMENT_ERROR = 6
 IF_ERROR = 7
 
+""" Kinds of errors in scopes, reported by ScopeDiagnostic class in refine_data """
+
+SCOPE_NOT_ENDED = "scope is not ended"
+SCOPE_NOT_STARTED = "ending has no start"
+
+""" Roles of test cases in columnar store (see TestCaseStore class in columnar_store) """
+
+TEST_CASE_INPUT = 0
+TEST_CASE_OUTPUT = 1
+TEST_CASE_CALIBRATION = 2
+TEST_CASE_ENVIRONMENT = 3
+
+""" Values of test cases which are at least this long are not copied when lazy values are asked (see open_ptu) """
+
+LAZY_VALUE_MIN_LENGTH = 64 * 1024
+
+""" Number of services which are kept after extracting them, when services are extracted lazily (see open_ptu) """
+
+LAZY_SERVICE_CACHE_SIZE = 32
+
 """ Number of columns in some sheets used for exporting data to excel format """
 
 ENVIRONMENT_WIDTH = 4
@@ -21,4 +41,41 @@ ELEMENT_WIDTH = 5
 
 """ Defining width for columns in test sheets for better reading and showing data """
 
-TEST_SHEET_COLUMNS_WIDTH = [50, 15, 80, 40, 40]
\ No newline at end of file
+TEST_SHEET_COLUMNS_WIDTH = [50, 15, 80, 40, 40]
+
+""" Status of refined files, reported by refine_directory function """
+
+REFINE_OK = "ok"
+REFINE_ERROR = "error"
+REFINE_SKIPPED = "skipped"  # Ptu file has not changed since last run
+REFINE_REMOVED = "removed"  # Ptu file has been deleted, so its new file is removed
+REFINE_REPAIRED = "repaired"  # Errors in scopes of ptu file have been found and repaired
+
+""" Manifest of refined files, saved in output directory of refine_directory function """
+
+REFINE_MANIFEST_NAME = "refine_manifest.json"
+REFINE_VERSION = 3  # Must be increased whenever output of rewrite_ptu_file changes
+
+""" Services of a ptu file are split into this many ranges for every process, when they are extracted in parallel """
+
+SERVICE_RANGES_PER_JOB = 4
+
+""" Cache of extracted ptu files (see ParseCache class in parse_cache) """
+
+EXTRACT_VERSION = 2  # Must be increased whenever output of open_ptu (or format of files of cache) changes
+PARSE_CACHE_MAGIC = b"PTUC"  # Start of every file of cache
+PARSE_CACHE_EXTENSION = ".wbc"
+PARSE_CACHE_MAX_SIZE = 1024 * 1024 * 1024  # Total size of files of cache in bytes
+
+""" Map of line numbers of a new file (see LineMap class in refine_data), saved next to it """
+
+LINE_MAP_EXTENSION = ".map"
+
+""" Encoding used for reading and writing ptu files without decoding them (see open_text_file in refine_data) """
+
+BINARY_ENCODING = "latin-1"  # Every byte is a single character and every character is a single byte
+
+""" Reading ptu files without decoding them for extracting data (see ValueDecoder class in extract_data) """
+
+BINARY_EXTRACT_ENCODING = "ascii"
+BINARY_EXTRACT_ERRORS = "surrogateescape"  # Every other byte is a single character, never changed by strip or upper
@@ -3,7 +3,7 @@ from os import path, makedirs
 import extract_data
 
 
-def convert(ptu_obj: extract_data.PtuWorkBook, output_path) -> None:
+def convert(ptu_obj: extract_data.PtuWorkBook, output_path, encoding=None) -> None:
     def write_data():
         def write_line(string=""):
             tst_file.write(string + "\n")
@@ -23,30 +23,32 @@ def convert(ptu_obj: extract_data.PtuWorkBook, output_path) -> None:
             write_line("\t" + param + " = " + service_name + "(" + ",".join(inputs) + ") ;")
 
         def write_test_data(element):
-            input_data = element.input_data
-            output_data = element.output_data
+            input_data = element._input_data or ()
+            output_data = element._output_data or ()
             input_params = []
             in_loop = False
             loop_var = ""
 
             for data in input_data:
-                if data.init.upper().startswith("INIT FROM"):
-                    write_loop(data.param_name, data.init)
+                init = str(data.init)  # Value may be a LazyValue object (see extract_data)
+                if init.upper().startswith("INIT FROM"):
+                    write_loop(data.param_name, init)
                     in_loop = True
                     loop_var = data.param_name
                 else:
-                    if in_loop and "[" + loop_var + "]" not in data.init:
+                    if in_loop and "[" + loop_var + "]" not in init:
                         write_line("}")
                         in_loop = False
-                    write_input_data(data.param_name, data.init)
+                    write_input_data(data.param_name, init)
                     input_params.append(data.param_name)
 
             for data in output_data:
-                if in_loop and "[" + loop_var + "]" not in data.ev:
+                ev = str(data.ev)
+                if in_loop and "[" + loop_var + "]" not in ev:
                     write_line("}")
                     in_loop = False
                 write_service_call(data.param_name, service.name, input_params)
-                write_output_data(data.param_name, data.ev)
+                write_output_data(data.param_name, ev)
 
             if in_loop:
                 write_line("}")
@@ -79,6 +81,6 @@ def convert(ptu_obj: extract_data.PtuWorkBook, output_path) -> None:
     file_name = ptu_obj.name
     if not path.exists(output_path):
         makedirs(output_path)  # If folder doesn't exist, create it
-    tst_file = open(output_path + "\\" + file_name + ".tst", "wt")
+    tst_file = open(output_path + "\\" + file_name + ".tst", "wt", encoding=encoding)
     write_data()
     tst_file.close()
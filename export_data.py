@@ -151,7 +151,7 @@ def export_info_to_excel_format(ptu_obj: extract_data.PtuWorkBook, ptu_workbook:
             for test in service.test_list:
                 services_sheet_row_num += 1
                 element = test.element
-                if not element.user_code:
+                if not element._user_code:
                     continue
 
                 cell = worksheet.cell(coord.row + counter, coord.column)
@@ -179,8 +179,7 @@ def export_info_to_excel_format(ptu_obj: extract_data.PtuWorkBook, ptu_workbook:
         """
         This function is used for writing conditions of any type of data in the given cell
         """
-        all_conditions = ",".join(conditions)  # Concatenate all conditions
-        write_cell_info(cell, value=all_conditions, style=style)
+        write_cell_info(cell, value=conditions.joined, style=style)  # All conditions are joined once (see ConditionSet)
 
     def write_stub_definitions_info():
         """
@@ -244,10 +243,10 @@ def export_info_to_excel_format(ptu_obj: extract_data.PtuWorkBook, ptu_workbook:
         write_cell_info(cell, value=test_case.param_name)
 
         cell = worksheet.cell(coord.row, coord.column + 2)
-        write_cell_info(cell, value=test_case.init)
+        write_cell_info(cell, value=str(test_case.init))  # May be a LazyValue object
 
         cell = worksheet.cell(coord.row, coord.column + 3)
-        write_cell_info(cell, value=test_case.ev)
+        write_cell_info(cell, value=str(test_case.ev))
 
     def write_environments_info():
         """
@@ -321,10 +320,9 @@ def export_info_to_excel_format(ptu_obj: extract_data.PtuWorkBook, ptu_workbook:
         comment_row_start = coord.row + row_counter
 
         # If there was no COMMENT, write an empty row
-        if not test.comment:
-            test.comment.append("")
+        comments = test._comment or [""]
         # Writing all comments
-        for comment in test.comment:
+        for comment in comments:
             cell = worksheet.cell(coord.row + row_counter, coord.column)
             write_cell_info(cell, value=comment)
             worksheet.merge_cells(start_row=cell.row, start_column=cell.column, end_row=cell.row,
@@ -349,10 +347,11 @@ def export_info_to_excel_format(ptu_obj: extract_data.PtuWorkBook, ptu_workbook:
         use_row_start = coord.row + row_counter  # !
 
         # If there was no USE, write an empty row
-        if not element.use:
-            element.use.append("")
+        all_use = element.get_all_use()
+        if not all_use:
+            all_use = [""]
         # Writing all uses
-        for use in element.use:
+        for use in all_use:
             cell = worksheet.cell(coord.row + row_counter, coord.column)
             write_cell_info(cell, value=use)
             worksheet.merge_cells(start_row=cell.row, start_column=cell.column, end_row=cell.row,
@@ -393,10 +392,9 @@ def export_info_to_excel_format(ptu_obj: extract_data.PtuWorkBook, ptu_workbook:
         input_data_row_start = coord.row + row_counter
 
         # If there was no input data, write an empty row
-        if not element.input_data:
-            element.input_data.append(extract_data.PtuWorkBook.TestCase())
+        input_data = element._input_data or [extract_data.PtuWorkBook.TestCase()]
         # Writing all input data
-        for test_case in element.input_data:
+        for test_case in input_data:
             cell = worksheet.cell(coord.row + row_counter, coord.column)
             write_conditions(cell, test_case.conditions)
 
@@ -419,10 +417,9 @@ def export_info_to_excel_format(ptu_obj: extract_data.PtuWorkBook, ptu_workbook:
         calibrations_row_start = coord.row + row_counter
 
         # If there was no calibrations, write an empty row
-        if not element.calibrations:
-            element.calibrations.append(extract_data.PtuWorkBook.TestCase())
+        calibrations = element._calibrations or [extract_data.PtuWorkBook.TestCase()]
         # Writing all calibrations
-        for test_case in element.calibrations:
+        for test_case in calibrations:
             cell = worksheet.cell(coord.row + row_counter, coord.column)
             write_conditions(cell, test_case.conditions)
 
@@ -445,10 +442,9 @@ def export_info_to_excel_format(ptu_obj: extract_data.PtuWorkBook, ptu_workbook:
         output_data_row_start = coord.row + row_counter
 
         # If there was no output data, write an empty row
-        if not element.output_data:
-            element.output_data.append(extract_data.PtuWorkBook.TestCase())
+        output_data = element._output_data or [extract_data.PtuWorkBook.TestCase()]
         # Writing all output data
-        for test_case in element.output_data:
+        for test_case in output_data:
             cell = worksheet.cell(coord.row + row_counter, coord.column)
             write_conditions(cell, test_case.conditions)
 
@@ -485,10 +481,9 @@ def export_info_to_excel_format(ptu_obj: extract_data.PtuWorkBook, ptu_workbook:
         """ Writing STUB part - STUBs """
 
         # If there was no stub call data, write an empty row
-        if not element.stub_calls:
-            element.stub_calls.append(extract_data.PtuWorkBook.Stub())
+        stub_calls = element._stub_calls or [extract_data.PtuWorkBook.Stub()]
         # Writing all STUB
-        for stub in element.stub_calls:
+        for stub in stub_calls:
             cell = worksheet.cell(coord.row + row_counter, coord.column)
             write_conditions(cell, stub.conditions)
 
@@ -1,195 +1,179 @@
-class PtuWorkBook:
+from os import path as os_path, makedirs, cpu_count, remove, replace, rmdir
+from array import array
+from bisect import bisect_left
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, repeat
+from locale import getpreferredencoding
+import re
+from shutil import rmtree
+from sys import intern
+from tempfile import mkdtemp, mkstemp
+import constants as const
+from keywords import Keyword, classify_keyword
+import refine_data
+from line_source import MappedLines
+import parse_cache
+from ptu_workbook import PtuWorkBook, ConditionTable, NO_CONDITIONS
+
+
+class LazyValue:
     """
-    This class contains all of data in a ptu file in form of subclasses
-    Attributes will be used to show in excel file, or convert to another format
+    A large value of a test case (initial or expected value), which is not copied into the TestCase object.
+    Only the lines of test case are kept, and the value is extracted again from them whenever it is used.
+    Objects of this class can be used instead of strings for init and ev of TestCase class:
+    str(value), len(value) and "..." in value are supported.
     """
 
-    def __init__(self):
-        self.name = ""
-        self.preface = self.Preface()
-        self.include = []
-        self.comment = []
-        self.user_code = []  # Array of UserCode objects
-        self.stub_definitions = []  # Array of DefineStub objects
-        self.initialisation = []  # Array of Initialisation objects
-        self.environments = []  # Array of Environment objects
-        self.services = []  # Array of Service objects
-
-    class Preface:
+    def __init__(self, lines, line_num, field):
         """
-        This subclass contains initial data about ptu file
+        :param lines: All lines of PTU file (array, or object of MappedLines class), must not be changed later
+        :param line_num: Line number of the test case
+        :param field: Name of the value in TestCase class ("init" or "ev")
         """
+        self.lines = lines
+        self.line_num = line_num
+        self.field = field
 
-        def __init__(self):
-            self.purpose = ""
-            self.processor = ""
-            self.tool_chain = ""
-            self.header = self.Header()
+    def __str__(self):
+        test_case = PtuWorkBook.TestCase()
+        extract_test_case_line(test_case, join_test_case_lines(self.lines, self.line_num))
+        return getattr(test_case, self.field)
 
-        class Header:
-            """
-            This subclass contains important datarmation mentioned in header file.
-            This datarmation is used in Preface(superclass) as an attribute.
-            """
+    def __len__(self):
+        return len(str(self))
 
-            def __init__(self):
-                self.module_name = ""
-                self.module_version = ""
-                self.test_plan_version = ""
+    def __contains__(self, text):
+        return text in str(self)
 
-    class UserCode:
-        """
-        UserCode can appear anywhere in ptu file
-        So this subclass is used in PtuWorkBook(superclass) , Service and Element class for better grouping
-        All UserCode lines start with '#'
-        """
 
-        def __init__(self):
-            self.conditions = []
-            self.code = ""
+class ValueDecoder:
+    """
+    Decodes data which is extracted without decoding lines of PTU file (see binary of open_ptu).
+    Lines are read as ascii, and every other byte is read as a single character (a surrogate), which is never
+    changed by extraction (e.g. strip and upper only change ascii characters then), nor taken for a keyword.
+    Strings of extracted data are encoded back into bytes and decoded with encoding of PTU file,
+    strings which are ascii (most of them) are kept as they are.
+    """
 
-    class Stub:
+    def __init__(self, encoding=None):
         """
-        STUB instruction describes all calls to a simulated function in a test script.
-        This class is used in ELEMENT and DefineStub classes.
+        :param encoding: encoding of PTU file, None means default encoding of platform
         """
+        self.encoding = encoding if encoding is not None else getpreferredencoding(False)
+        self.is_ascii = True  # False if any of lines given to check_lines is not ascii
 
-        def __init__(self):
-            self.conditions = []
-            self.stub_definition = ""
-
-    class DefineStub:
+    def check_lines(self, lines):
         """
-        DEFINE STUB instructions are optional and has a scope in format: "DEFINE STUB ... END DEFINE"
-        The DEFINE STUB and END DEFINE instructions delimit a simulation block
-        consisting of stub definition functions, methods, or procedure declarations.
+        Checks lines of PTU file while they are read, so a workbook of an ascii file is not decoded at all.
+        :returns: Generator of the lines
         """
+        for line in lines:
+            if not line.isascii():
+                self.is_ascii = False
+            yield line
 
-        def __init__(self):
-            self.name = ""
-            self.stub_list = []  # Array of Stub objects
-            self.conditions = []
-
-    class Initialisation:
+    def convert_refined_line(self, line):
         """
-        Initialisation in ptu files is optional.
-        Initialisation has a scope in format: "INITIALISATION ... END INITIALISATION"
-        Content of initialisation is saved in "description" attribute.
+        Converts a line which is refined in binary mode (see open_text_file function in refine_data) into a line
+        which is read as ascii (see constants), with its line ending changed into "\n" the same as text mode.
         """
-
-        def __init__(self):
-            self.conditions = []
-            self.description = ""
-
-    class TestCase:
+        if line.endswith("\r\n"):
+            line = line[:-2] + "\n"
+        elif line.endswith("\r"):
+            line = line[:-1] + "\n"
+        if line.isascii():
+            return line
+        self.is_ascii = False
+        return line.encode(const.BINARY_ENCODING).decode(const.BINARY_EXTRACT_ENCODING, const.BINARY_EXTRACT_ERRORS)
+
+    def decode(self, text):
         """
-        TestCases appear in ENVIRONMENT and ELEMENT classes.
-        In every test case, there is a parameter that is being tested.
-        This parameter has type, name, initial and expected value.
+        :returns: The string decoded with encoding of PTU file
         """
+        if text.isascii():
+            return text
+        return text.encode(const.BINARY_EXTRACT_ENCODING, const.BINARY_EXTRACT_ERRORS).decode(self.encoding)
 
-        def __init__(self):
-            self.conditions = []
-            self.param_type = ""
-            self.param_name = ""
-            self.init = ""
-            self.ev = ""
-
-    class Environment:
+    def decode_condition(self, condition):
         """
-        ENVIRONMENT instruction defines a test environment declaration in ptu files.
-        ENVIRONMENT has a scope in format: "ENVIRONMENT ... END ENVIRONMENT"
-        All of test cases are saved in an array of TestCase objects, named "test_case_list"
+        :returns: Condition of an IF-scope decoded, which is in upper case the same as save_if_scope function
         """
+        if condition.isascii():
+            return condition
+        return self.decode(condition).upper()
 
-        def __init__(self):
-            self.name = ""
-            self.test_case_list = []  # Array of TestCase objects
-            self.conditions = []
-
-    class Service:
+    def decode_list(self, values):
         """
-        Services are functions that are being tested.
-        Every Service consists of several tests and every test consist of an element.
-        These tests are saved in an array, named "test_list", in format of TEST objects.
-        Every service may use several environments, which are saved in "use" array.
+        Decodes an array of strings in place.
         """
+        for index, value in enumerate(values):
+            values[index] = self.decode(value)
 
-        def __init__(self):
-            self.name = ""
-            self.test_list = []  # Array of Test objects
-            self.conditions = []
-            self.user_code = []  # Array of UserCode objects
-            self.use = []  # Array of strings (USEs)
-
-        def has_user_code(self):
-            """
-            :return: True if Service has any user-code(itself or its tests), False if not
-            """
-            if self.user_code:
-                return True
-            for test in self.test_list:
-                if test.element.user_code:
-                    return True
-            return False
+    def decode_test_cases(self, test_cases):
+        for test_case in test_cases:
+            test_case.param_type = self.decode(test_case.param_type)
+            test_case.param_name = self.decode(test_case.param_name)
+            test_case.init = self.decode(test_case.init)
+            test_case.ev = self.decode(test_case.ev)
 
-        def extend_use(self):
-            """
-            Every USE in a service belongs to all of elements in its sub-tests.
-            This function adds USEs of service to all of the elements in its sub-tests.
-            """
-            for test in self.test_list:
-                element = test.element
-                element.use.extend(self.use)
+    def decode_user_code(self, user_code_list):
+        for user_code in user_code_list:
+            user_code.code = self.decode(user_code.code)
 
-        def get_all_user_code(self):
-            """
-            :return: All of the user-code of this service in form of one string.
-            """
-            all_user_code = [u.code for u in self.user_code]
-            return "\n".join(all_user_code)
+    def decode_stubs(self, stubs):
+        for stub in stubs:
+            stub.stub_definition = self.decode(stub.stub_definition)
 
-    class Element:
+    def decode_service(self, service):
         """
-        Every Test of every service, consists of one element.
-        All of parameters that are going to be tested in a particiular TEST, are in element in 3 formats:
-        Input-data, Output-data, Calibrations. All of these are objects of TestCase Class.
+        Decodes all of data of a service in place.
+        Arrays which are not allocated (see LazyAttribute) are read from their slots, so they are not allocated here.
         """
-
-        def __init__(self):
-            self.use = []
-            self.input_data = []  # Array of TestCase objects
-            self.calibrations = []  # Array of TestCase objects
-            self.output_data = []  # Array of TestCase objects
-            self.stub_calls = []
-            self.user_code = []  # Array of strings (USEs)
-
-        def get_all_data(self):
-            """
-            :return: All of test-cases including input-data, output-data, and calibrations.
-            """
-            return self.input_data + self.calibrations + self.output_data
-
-    class Test:
+        service.name = self.decode(service.name)
+        self.decode_user_code(service._user_code or ())
+        self.decode_list(service._use or [])  # Shared with elements of the service (see extend_use)
+        for test in service._test_list or ():
+            test.name = self.decode(test.name)
+            test.family = self.decode(test.family)
+            self.decode_list(test._comment or [])
+            self.decode_list(test._use or [])
+            element = test._element
+            if element is not None:
+                self.decode_list(element._own_use or [])
+                self.decode_test_cases(element._input_data or ())
+                self.decode_test_cases(element._calibrations or ())
+                self.decode_test_cases(element._output_data or ())
+                self.decode_stubs(element._stub_calls or ())
+                self.decode_user_code(element._user_code or ())
+
+    def decode_workbook(self, workbook, with_services=True):
         """
-        Every Service consists of several tests.
-        There is a single element in every test.
+        Decodes all of data of a workbook in place.
+        :param with_services: If False, services are not decoded (e.g. they are decoded when they are extracted)
         """
-
-        def __init__(self):
-            self.name = ""
-            self.family = ""
-            self.comment = []
-            self.use = []
-            self.element = PtuWorkBook.Element()
-            self.conditions = []
-
-        def extend_use(self):
-            """
-            Every USE in a test belongs to all of its sub-elements.
-            This function adds USEs of test to all of the elements in its sub-elements.
-            """
-            self.element.use.extend(self.use)
+        preface = workbook.preface
+        preface.purpose = self.decode(preface.purpose)
+        preface.processor = self.decode(preface.processor)
+        preface.tool_chain = self.decode(preface.tool_chain)
+        header = preface.header
+        header.module_name = self.decode(header.module_name)
+        header.module_version = self.decode(header.module_version)
+        header.test_plan_version = self.decode(header.test_plan_version)
+        self.decode_list(workbook.include)
+        self.decode_list(workbook.comment)
+        self.decode_user_code(workbook.user_code)
+        for define_stub in workbook.stub_definitions:
+            define_stub.name = self.decode(define_stub.name)
+            self.decode_stubs(define_stub._stub_list or ())
+        for initialisation in workbook.initialisation:
+            initialisation.description = self.decode(initialisation.description)
+        for environment in workbook.environments:
+            environment.name = self.decode(environment.name)
+            self.decode_test_cases(environment._test_case_list or ())
+        if with_services:
+            for service in workbook.services:
+                self.decode_service(service)
 
 
 class LineNum:
@@ -228,6 +212,7 @@ class LineNum:
             self.START_IF = 0
             self.END_IF = 0
             self.condition = ""
+            self.parent = None  # The smallest IF-scope which includes this scope, set by build_condition_index
 
     def __init__(self):
         self.PURPOSE = 0
@@ -247,6 +232,9 @@ class LineNum:
         self.ENVIRONMENT_END_LIST = []
         self.SERVICE_LIST = []  # Array of ServiceLineNum
         self.IF_SCOPE_LIST = []  # Array of IfScope
+        self.IF_SCOPE_OF_LINE = array("i")  # Index of the smallest IF-scope which includes each line (-1 if none)
+        self.conditions_of_scope = {}  # Index of IF-scope -> conditions of its lines, saved when used once
+        self.condition_sets = ConditionTable()  # All of conditions which are found, given to workbook (see classify_data)
 
     def service_start(self, line_num):
         """
@@ -303,6 +291,88 @@ class LineNum:
     def get_environment_count(self):
         return len(self.ENVIRONMENT_START_LIST)
 
+    def build_condition_index(self, line_count):
+        """
+        Finds the smallest IF-scope which includes each line, and the smallest IF-scope which includes each IF-scope.
+        IF-scopes never overlap (each one is either inside another one or outside of it),
+        so conditions of a line are conditions of its IF-scope and all of the scopes which include that one.
+        IF_SCOPE_LIST must be sorted by start line number.
+        :param line_count: Number of lines in PTU file
+        """
+        self.IF_SCOPE_OF_LINE = array("i", [-1]) * line_count
+        self.conditions_of_scope = {}
+        open_scopes = []
+        for index, if_scope in enumerate(self.IF_SCOPE_LIST):
+            while open_scopes and open_scopes[-1].END_IF <= if_scope.START_IF:
+                open_scopes.pop()
+            if_scope.parent = open_scopes[-1] if open_scopes else None
+            open_scopes.append(if_scope)
+            # Inner scopes come later in the list, so they overwrite their lines
+            scope_line_count = if_scope.END_IF - if_scope.START_IF - 1
+            if scope_line_count > 0:
+                self.IF_SCOPE_OF_LINE[if_scope.START_IF + 1:if_scope.END_IF] = array("i", [index]) * scope_line_count
+
+    def get_conditions(self, start_line_num, end_line_num):
+        """
+        Finds conditions of all IF-scopes which include the scope which starts at start_line_num
+        and ends at end_line_num, in order of their start line number (see build_condition_index).
+        Only IF-scopes which include start_line_num are checked, so it takes O(depth of IF-scopes).
+        :returns: Object of ConditionSet class, from condition_sets table
+        """
+        if start_line_num > end_line_num or start_line_num >= len(self.IF_SCOPE_OF_LINE):
+            # Index is not built for these lines, so all of IF-scopes are checked
+            condition_list = []
+            for if_scope in self.IF_SCOPE_LIST:
+                if if_scope.START_IF > end_line_num:  # If there is no IF-scope that includes the input scope
+                    break
+                if start_line_num > if_scope.START_IF and end_line_num < if_scope.END_IF:
+                    condition_list.append(if_scope.condition)
+            return self.condition_sets.get(condition_list)
+
+        scope_index = self.IF_SCOPE_OF_LINE[start_line_num]
+        if scope_index == -1:
+            return NO_CONDITIONS
+        if start_line_num == end_line_num:
+            conditions = self.conditions_of_scope.get(scope_index)
+            if conditions is None:
+                condition_list = []
+                if_scope = self.IF_SCOPE_LIST[scope_index]
+                while if_scope is not None:
+                    condition_list.append(if_scope.condition)
+                    if_scope = if_scope.parent
+                condition_list.reverse()
+                conditions = self.condition_sets.get(condition_list)
+                self.conditions_of_scope[scope_index] = conditions
+            return conditions
+
+        # Scopes which include start_line_num have bigger end line number when they are bigger
+        condition_list = []
+        if_scope = self.IF_SCOPE_LIST[scope_index]
+        while if_scope is not None:
+            if if_scope.END_IF > end_line_num:
+                condition_list.append(if_scope.condition)
+            if_scope = if_scope.parent
+        condition_list.reverse()
+        return self.condition_sets.get(condition_list)
+
+    def group_by_conditions(self, line_num_list):
+        """
+        Groups lines which have the same conditions and come after each other in line_num_list.
+        Lines inside the same IF-scope have the same conditions (see build_condition_index),
+        so conditions are only found and compared when IF-scope of lines changes.
+        :param line_num_list: Line numbers in ascending order (this array is not changed)
+        :returns: Array of groups, each group is a tuple of (ConditionSet, array of line numbers)
+        """
+        groups = []
+        for scope_index, same_scope_lines in groupby(line_num_list, key=self.IF_SCOPE_OF_LINE.__getitem__):
+            same_scope_lines = list(same_scope_lines)
+            conditions = self.get_conditions(same_scope_lines[0], same_scope_lines[0])
+            if groups and groups[-1][0] is conditions:  # Different IF-scopes may have the same conditions
+                groups[-1][1].extend(same_scope_lines)
+            else:
+                groups.append((conditions, same_scope_lines))
+        return groups
+
     def valid_data(self, line_num):
         """
         This function checks whether the line is user-code or not
@@ -313,85 +383,355 @@ class LineNum:
         # If we are in a DefineStub scope
         if len(self.DEFINE_STUB_START_LIST) > len(self.DEFINE_STUB_END_LIST):
             return False
-        for counter in range(self.get_define_stub_count()):
-            if self.DEFINE_STUB_START_LIST[counter] < line_num < self.DEFINE_STUB_END_LIST[counter]:
-                return False
+        # Start and end lists are both sorted, because they are saved in order of lines.
+        # So if any DefineStub scope includes the line, the last one which starts before the line includes it, too.
+        counter = bisect_left(self.DEFINE_STUB_START_LIST, line_num) - 1
+        if counter >= 0 and line_num < self.DEFINE_STUB_END_LIST[counter]:
+            return False
         return True
 
+    def get_service_range(self, first_service, end_service):
+        """
+        Makes line numbers of some services, so they can be extracted separately (e.g. in another process).
+        Line numbers are counted from start of the first service, so the lines must be given from there, too.
+        IF-scopes which include any of these lines are kept (even if they start before the first service),
+        so conditions of data are the same as extracting data from all of the lines.
+        :param first_service: Index of the first service in SERVICE_LIST
+        :param end_service: Index of the service after the last one in SERVICE_LIST
+        :returns: Tuple of (line number of the first line, line number after the last line, object of LineNum class)
+        """
+        start = self.SERVICE_LIST[first_service].START
+        end = self.SERVICE_LIST[end_service - 1].END + 1
+        range_line_numbers = LineNum()
+
+        for service_line_num in self.SERVICE_LIST[first_service:end_service]:
+            range_service = self.ServiceLineNum()
+            range_service.START = service_line_num.START - start
+            range_service.TEST_START = [line_num - start for line_num in service_line_num.TEST_START]
+            range_service.ELEMENT_START = [line_num - start for line_num in service_line_num.ELEMENT_START]
+            range_service.ELEMENT_END = [line_num - start for line_num in service_line_num.ELEMENT_END]
+            range_service.TEST_END = [line_num - start for line_num in service_line_num.TEST_END]
+            range_service.END = service_line_num.END - start
+            range_line_numbers.SERVICE_LIST.append(range_service)
+
+        # IF-scopes keep their indexes, so index of IF-scopes of lines is just copied (see build_condition_index).
+        # IF-scopes which don't include any of these lines are replaced by an empty scope, which includes no line.
+        unused_scope = self.IfScope()
+        unused_scope.START_IF = unused_scope.END_IF = -1
+        range_scopes = {}  # IfScope -> its copy, parents of scopes which are kept are kept too (they include them)
+        for if_scope in self.IF_SCOPE_LIST:
+            if if_scope.START_IF >= end:
+                break
+            if if_scope.END_IF <= start:
+                range_line_numbers.IF_SCOPE_LIST.append(unused_scope)
+                continue
+            range_scope = self.IfScope()
+            range_scope.START_IF = if_scope.START_IF - start  # Negative if it starts before the first service
+            range_scope.END_IF = if_scope.END_IF - start
+            range_scope.condition = if_scope.condition
+            range_scope.parent = range_scopes.get(if_scope.parent)
+            range_scopes[if_scope] = range_scope
+            range_line_numbers.IF_SCOPE_LIST.append(range_scope)
+        range_line_numbers.IF_SCOPE_OF_LINE = self.IF_SCOPE_OF_LINE[start:end]
+        return start, end, range_line_numbers
+
+
+def open_ptu_file(path, encoding=None, use_mmap=False, binary=False):
+    """
+    Opens PTU file for extracting data.
+    :param binary: If True, lines are not decoded (see ValueDecoder class), encoding is not used
+    :returns: Object of MappedLines class if use_mmap is True, otherwise file handler
+    """
+    errors = "strict"
+    if binary:
+        encoding = const.BINARY_EXTRACT_ENCODING
+        errors = const.BINARY_EXTRACT_ERRORS
+    if use_mmap:
+        return MappedLines(path, encoding, errors)
+    return open(path, "rt", encoding=encoding, errors=errors)
+
 
-def open_ptu(path, file_name):
+def open_ptu(path, file_name, encoding=None, use_mmap=False, single_pass=False, lazy_values=False,
+             lazy_services=False, cache=None, jobs=1, binary=False):
     """
     This function opens PTU file and calls other functions to extract data.
+    :param encoding: encoding of PTU file, None means default encoding of platform
+    :param use_mmap: If True, PTU file is mapped into memory instead of reading all of its lines (see line_source),
+                     which uses much less memory for very large files.
+    :param single_pass: If True, data is extracted while reading lines (see PtuParser class).
+                        If structure of PTU file is not as expected by PtuParser, it is extracted in two passes.
+    :param lazy_values: If True, very large initial and expected values of test cases (e.g. tables of calibrations)
+                        are not copied into the workbook, they are read again from the mapped file whenever they are
+                        used (see LazyValue class). It is only used with use_mmap (otherwise all of lines would be kept
+                        in memory for them) and without single_pass (lines are not kept while parsing).
+    :param lazy_services: If True, only line numbers of services are found, and a service is extracted when it is
+                          used for the first time (see LazyServiceList class), which is much faster if only a few
+                          services are used. All other data (e.g. environments and stubs) is extracted as usual.
+                          Lines of PTU file are kept (or mapped with use_mmap) as long as the workbook is used,
+                          and single_pass is not used.
+    :param cache: If given (object of ParseCache class in parse_cache), workbook is loaded from cache when content
+                  of PTU file has not changed since it was saved, otherwise it is extracted and saved in cache.
+                  Values of test cases in a loaded workbook are strings (not LazyValue objects).
+                  It is not used with lazy_services.
+    :param jobs: Number of processes for extracting services, split at start of services (None means number of
+                 CPUs). If it is more than 1, data is extracted in two passes (single_pass is not used) and
+                 lazy_values is not used. Result is exactly the same as extracting on a single process.
+    :param binary: If True, lines of PTU file are not decoded, only strings of extracted data are decoded with encoding
+                   (see ValueDecoder class). Keywords are ascii, so they are found the same as decoded lines.
+                   Result is the same as decoding lines, unless non-ascii characters are changed by extraction
+                   (e.g. non-ascii white spaces are not stripped). lazy_values is not used.
     :returns: Object of PtuWorkBook class with all of data saved in it.
     """
-    ptu_file = open(path, "rt")
+    if jobs is None:
+        jobs = cpu_count() or 1
+    if cache is not None and not lazy_services:
+        key = cache.get_key(path, encoding, binary)
+        ptu_workbook = cache.load(key)
+        if ptu_workbook is None:
+            ptu_workbook = open_ptu(path, file_name, encoding, use_mmap, single_pass, lazy_values, jobs=jobs,
+                                    binary=binary)
+            cache.save(key, ptu_workbook)
+        ptu_workbook.name = file_name.replace(".ptu", "")  # The same content may be saved with another name
+        return ptu_workbook
+
+    if jobs > 1 and not lazy_services:
+        single_pass = False
+        lazy_values = False  # Values are sent back from other processes, so they can't be read from the lines
+    decoder = None
+    if binary:
+        decoder = ValueDecoder(encoding)
+        lazy_values = False  # Values would be read from lines which are not decoded
+    if single_pass and not lazy_services:
+        ptu_workbook = PtuWorkBook()
+        ptu_workbook.name += file_name.replace(".ptu", "")
+        ptu_file = open_ptu_file(path, encoding, use_mmap, binary)
+        try:
+            PtuParser(ptu_workbook, ptu_file if decoder is None else decoder.check_lines(ptu_file), decoder).parse()
+            if decoder is not None and not decoder.is_ascii:
+                decoder.decode_workbook(ptu_workbook)
+            return ptu_workbook
+        except PtuStructureError:
+            pass  # Extracting data again in two passes
+        finally:
+            ptu_file.close()
+
     ptu_workbook = PtuWorkBook()
     ptu_workbook.name += file_name.replace(".ptu", "")
-    ptu_file_lines, line_numbers = pre_process(ptu_file)
+    if use_mmap:
+        ptu_file_lines = open_ptu_file(path, encoding, use_mmap, binary)
+        line_numbers = pre_process_lines(ptu_file_lines)
+    else:
+        ptu_file_lines, line_numbers = pre_process(open_ptu_file(path, encoding, use_mmap, binary))
+    if decoder is not None and (ptu_file_lines.is_ascii() if use_mmap else all(map(str.isascii, ptu_file_lines))):
+        decoder = None  # Nothing is decoded in files which are ascii
+    if decoder is not None:
+        for if_scope in line_numbers.IF_SCOPE_LIST:  # Conditions are decoded before condition sets are made
+            if_scope.condition = decoder.decode_condition(if_scope.condition)
+    lazy_values = lazy_values and use_mmap
+    classify_data(ptu_workbook, ptu_file_lines, line_numbers, lazy_values, lazy_services, jobs)
+    if use_mmap and not lazy_values and not lazy_services:  # Otherwise file is unmapped when the workbook is deleted
+        ptu_file_lines.close()
+    if decoder is not None:
+        decoder.decode_workbook(ptu_workbook, with_services=not lazy_services)
+        if lazy_services:
+            ptu_workbook.services.decoder = decoder
+
+    return ptu_workbook
+
+
+def extract_to_file(path, file_name, directory, encoding=None):
+    """
+    Extracting data of PTU file in a separate process (see open_ptu_many function), and saving the workbook into a
+    temporary file in the binary format of parse_cache module, instead of sending it back as a pickled object.
+    :param directory: Directory of the temporary file
+    :returns: Path of the temporary file
+    """
+
+    ptu_workbook = open_ptu(path, file_name, encoding)
+    file_handler, result_path = mkstemp(suffix=const.PARSE_CACHE_EXTENSION, dir=directory)
+    with open(file_handler, "wb") as result_file:
+        result_file.write(parse_cache.dump_workbook(ptu_workbook))
+    return result_path
+
+
+def open_ptu_many(paths, jobs=None, encoding=None):
+    """
+    Opens several PTU files on several processes.
+    Pickling a workbook and sending it back from another process may be slower than extracting it,
+    so each workbook is saved into a temporary file (see extract_to_file function), which is mapped into memory
+    and read in place (see WorkBookView class in parse_cache), services are read only when they are used.
+    :param paths: Paths of PTU files
+    :param jobs: Number of processes, None means number of CPUs
+    :param encoding: encoding of PTU files, None means default encoding of platform
+    :returns: Array of WorkBookView objects, in order of paths. They should be closed when they are not used (or
+              used in with statements), temporary files are removed then (or as soon as they are mapped, on
+              platforms which allow it), and the temporary directory is removed when the last of them is closed.
+    """
+
+    if jobs is None:
+        jobs = cpu_count() or 1
+    file_names = [os_path.basename(path) for path in paths]
+    directory = mkdtemp(prefix="ptu_")
+    workbooks = []
+    try:
+        if jobs <= 1 or len(paths) <= 1:
+            result_paths = [extract_to_file(path, file_name, directory, encoding)
+                            for path, file_name in zip(paths, file_names)]
+        else:
+            # Sending files in chunks, so processes don't wait for each other for every single file
+            chunk_size = max(1, len(paths) // (jobs * 4))
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                result_paths = list(executor.map(extract_to_file, paths, file_names, repeat(directory),
+                                                 repeat(encoding), chunksize=chunk_size))
+        for result_path in result_paths:
+            workbooks.append(parse_cache.WorkBookView(result_path, remove_file=True, directory=directory))
+    except BaseException:
+        for workbook in workbooks:
+            workbook.close()  # Files can't be removed while they are mapped on some platforms
+        rmtree(directory, ignore_errors=True)
+        raise
+    try:
+        rmdir(directory)
+    except OSError:
+        pass  # Files are still mapped, they and the directory are removed when workbooks are closed
+    return workbooks
+
+
+def refine_and_open_ptu(file_name, old_path, new_path=None, line_map=None, diagnostics=None, encoding=None,
+                        binary=False):
+    """
+    This function refines ptu file (see refine_data module) and extracts data from refined lines directly.
+    So new file is not written and then read again, which is slow on network storage.
+    :param file_name: name of ptu file
+    :param old_path: path of ptu file to be read
+    :param new_path: If given, new file is also written into this path, same as rewrite_ptu_file function.
+                     It is written into a temporary file first, so a ptu file which can't be refined does not leave
+                     a part of new file behind.
+    :param line_map: If given (object of LineMap class), line numbers of ptu file are saved in it,
+                     so line numbers of refined lines can be translated back to ptu file.
+    :param diagnostics: If given (array), errors in scopes are repaired and saved in it (see refine_lines function)
+    :param encoding: encoding of ptu file and new file, None means default encoding of platform
+    :param binary: If True, bytes of ptu file are copied into new file without decoding, the same as
+                   rewrite_ptu_file function, and data is extracted without decoding lines (see ValueDecoder class)
+    :returns: Object of PtuWorkBook class with all of data saved in it.
+    """
+    new_file_path = None
+    if new_path is not None:
+        if not os_path.exists(new_path):
+            makedirs(new_path)  # If folder doesn't exist, create it
+        new_file_path = new_path + "\\" + file_name
+
+    decoder = ValueDecoder(encoding) if binary else None
+    ptu_file_lines = []
+    missing_endifs = []
+    with refine_data.open_text_file(old_path + "\\" + file_name, "rt", encoding, binary) as old_file:
+        new_file = None
+        try:
+            if new_file_path is not None:
+                new_file = refine_data.open_text_file(new_file_path + ".tmp", "wt", encoding, binary)
+            for new_line in refine_data.refine_lines(old_file, file_name, line_map, diagnostics, missing_endifs):
+                ptu_file_lines.append(new_line)
+                if new_file is not None:
+                    new_file.write(new_line)
+
+            # Lines are kept in memory, so missing ENDIFs are inserted into them and new file is written again
+            if missing_endifs:
+                ptu_file_lines = list(refine_data.insert_missing_endifs(ptu_file_lines, missing_endifs))
+                if new_file is not None:
+                    new_file.seek(0)
+                    new_file.truncate()
+                    new_file.writelines(ptu_file_lines)
+            if new_file is not None:
+                new_file.close()
+        except BaseException:
+            if new_file is not None:
+                new_file.close()
+                remove(new_file_path + ".tmp")
+            raise
+    if new_file_path is not None:
+        replace(new_file_path + ".tmp", new_file_path)
+    if line_map is not None:
+        line_map.insert_lines(missing_endifs)
+
+    if decoder is not None:
+        ptu_file_lines = [decoder.convert_refined_line(line) for line in ptu_file_lines]
+        if decoder.is_ascii:
+            decoder = None  # Nothing is decoded in files which are ascii
+
+    ptu_workbook = PtuWorkBook()
+    ptu_workbook.name += file_name.replace(".ptu", "")
+    line_numbers = pre_process_lines(ptu_file_lines)
+    if decoder is not None:
+        for if_scope in line_numbers.IF_SCOPE_LIST:  # Conditions are decoded before condition sets are made
+            if_scope.condition = decoder.decode_condition(if_scope.condition)
     classify_data(ptu_workbook, ptu_file_lines, line_numbers)
+    if decoder is not None:
+        decoder.decode_workbook(ptu_workbook)
 
     return ptu_workbook
 
 
-def save_line_num_by_type(line, line_numbers, number):
+def save_line_num_by_type(keyword, line_numbers, number):
     """
     According to the type of keyword in the line, this function saves scopes of diffrent types of commands.
+    :param keyword: Keyword of the line, found by classify_keyword function
     """
-    if line.upper().startswith("SERVICE "):  # If the line starts a SERVICE scope
+    if keyword == Keyword.SERVICE:  # If the line starts a SERVICE scope
         line_numbers.service_start(number)
-    elif line.upper().startswith("END SERVICE"):  # If the line ends a SERVICE scope
+    elif keyword == Keyword.END_SERVICE:  # If the line ends a SERVICE scope
         line_numbers.service_end(number)
-    elif line.upper().startswith("TEST"):  # If the line starts a TEST scope
+    elif keyword == Keyword.TEST:  # If the line starts a TEST scope
         line_numbers.test_start(number)
-    elif line.upper().startswith("END TEST"):  # If the line ends a TEST scope
+    elif keyword == Keyword.END_TEST:  # If the line ends a TEST scope
         line_numbers.test_end(number)
-    elif line.upper().startswith("ELEMENT"):  # If the line starts a ELEMENT scope
+    elif keyword == Keyword.ELEMENT:  # If the line starts a ELEMENT scope
         line_numbers.element_start(number)
-    elif line.upper().startswith("END ELEMENT"):  # If the line ends a ELEMENT scope
+    elif keyword == Keyword.END_ELEMENT:  # If the line ends a ELEMENT scope
         line_numbers.element_end(number)
-    elif line.upper().startswith("INITIALISATION"):  # If the line starts a INITIALISATION scope
+    elif keyword == Keyword.INITIALISATION:  # If the line starts a INITIALISATION scope
         line_numbers.INITIALISATION_START = number
-    elif line.upper().startswith("END INITIALISATION"):  # If the line ends a INITIALISATION scope
+    elif keyword == Keyword.END_INITIALISATION:  # If the line ends a INITIALISATION scope
         line_numbers.INITIALISATION_END = number
-    elif line.upper().startswith("ENVIRONMENT"):  # If the line starts a ENVIRONMENT scope
+    elif keyword == Keyword.ENVIRONMENT:  # If the line starts a ENVIRONMENT scope
         line_numbers.ENVIRONMENT_START_LIST.append(number)
-    elif line.upper().startswith("END ENVIRONMENT"):  # If the line ends a ENVIRONMENT scope
+    elif keyword == Keyword.END_ENVIRONMENT:  # If the line ends a ENVIRONMENT scope
         line_numbers.ENVIRONMENT_END_LIST.append(number)
-    elif line.upper().startswith("DEFINE STUB"):  # If the line starts a DEFINE STUB scope
+    elif keyword == Keyword.DEFINE_STUB:  # If the line starts a DEFINE STUB scope
         line_numbers.DEFINE_STUB_START_LIST.append(number)
-    elif line.upper().startswith("END DEFINE"):  # If the line ends a DEFINE STUB scope
+    elif keyword == Keyword.END_DEFINE:  # If the line ends a DEFINE STUB scope
         line_numbers.DEFINE_STUB_END_LIST.append(number)
-    elif line.upper().startswith("COMMENT START"):  # If the line starts a COMMENT scope
+    elif keyword == Keyword.COMMENT_START:  # If the line starts a COMMENT scope
         line_numbers.COMMENT_START = number
-    elif line.upper().startswith("COMMENT END"):  # If the line ends a COMMENT scope
+    elif keyword == Keyword.COMMENT_END:  # If the line ends a COMMENT scope
         line_numbers.COMMENT_END = number
-    elif line.upper().startswith("HEADER"):
+    elif keyword == Keyword.HEADER:
         line_numbers.HEADER_START = number
-    elif line.startswith("##include"):
+    elif keyword == Keyword.INCLUDE:
         line_numbers.INCLUDE_LIST.append(number)
-    elif line.startswith("-- Purpose"):
+    elif keyword == Keyword.PURPOSE:
         line_numbers.PURPOSE = number
-    elif line.startswith("-- Processor"):
+    elif keyword == Keyword.PROCESSOR:
         line_numbers.PROCESSOR = number
-    elif line.startswith("-- Tool chain"):
+    elif keyword == Keyword.TOOL_CHAIN:
         line_numbers.TOOL_CHAIN = number
-    elif line.startswith("-- Test Cases"):  # If the line indicates beginning of SERVICE scopes
+    elif keyword == Keyword.TEST_CASES:  # If the line indicates beginning of SERVICE scopes
         line_numbers.TEST_CASES_START_FLAG = True
-    elif line.startswith("#") and line_numbers.valid_data(number):  # If the line includes user-code
+    elif keyword == Keyword.USER_CODE and line_numbers.valid_data(number):  # If the line includes user-code
         line_numbers.USER_CODE_LIST.append(number)
 
 
-def save_if_scope(if_stack, lines, line_numbers, number):
+def save_if_scope(if_stack, lines, line_numbers, number, keyword):
     """
     This functions particularly saves scopes of IF and ELSEs.
     :param if_stack: LIFO list for saving scopes of IF.
     :param lines: All lines of PTU file
     :param line_numbers: Object of LineNum class
     :param number: Line number of IF,ELSE, or ENDIF command
+    :param keyword: Keyword of the line (IF, ELSE or END_IF)
     """
     line = lines[number].upper().strip()
 
-    if line.startswith("IF"):
+    if keyword == Keyword.IF:
         """
         When we reach IF command, we save the line number as a start of an IF-scope.
         Then we save its condition and append it to the stack.
@@ -400,7 +740,7 @@ def save_if_scope(if_stack, lines, line_numbers, number):
         if_scope.START_IF = number
         if_scope.condition += line.replace("IF", "").strip()
         if_stack.append(if_scope)
-    elif line.startswith("ENDIF") or line.startswith("END IF"):
+    elif keyword == Keyword.END_IF:
         """
         When we reach ENDIF command, we save the line number as a end of an IF-scope.
         Then we append the last IF-scope that we created into the list of all IF-scopes.
@@ -408,7 +748,7 @@ def save_if_scope(if_stack, lines, line_numbers, number):
         last_if = if_stack.pop()
         last_if.END_IF = number
         line_numbers.IF_SCOPE_LIST.append(last_if)
-    elif line.startswith("ELSE"):
+    elif keyword == Keyword.ELSE:
         """
         When we reach ELSE command, we save the line number as a end of the last IF-scope.
         Then we create new IF-scope with the the negated condition of the last IF-scope.
@@ -431,64 +771,443 @@ def pre_process(file_handler):
     :return: ""lines"" as an array of strings, ""line_numbers as an object of LineNum class.
     """
     lines = file_handler.readlines()
-    lines[0] = ""  # Making an empty element in lines array as an initial value
     file_handler.close()
+    line_numbers = pre_process_lines(lines)
+
+    return lines, line_numbers
+
+
+def pre_process_lines(lines):
+    """
+    Same as pre_process function, for lines which are already read.
+    :param lines: All lines of PTU file (array, or object of MappedLines class),
+                  this array is changed (e.g. comments inside lines are removed)
+    :return: ""line_numbers"" as an object of LineNum class.
+    """
+    lines[0] = ""  # Making an empty element in lines array as an initial value
 
     line_numbers = LineNum()
     if_stack = []
 
     for num in range(len(lines)):
         line = lines[num].strip()
-        if line.find("--") > 0:  # If there is comment inside the line(not at the start of the line)
-            lines[num] = line[:line.find("--")].strip()  # Removing comment inside the line
-        if line.upper().startswith("IF") or line.upper().startswith("ELSE") or \
-                line.upper().startswith("ENDIF") or line.upper().startswith("END IF"):
-            save_if_scope(if_stack, lines, line_numbers, num)  # Saving IF-scope
+        comment_start = line.find("--")
+        if comment_start > 0:  # If there is comment inside the line(not at the start of the line)
+            lines[num] = line[:comment_start].strip()  # Removing comment inside the line
+        keyword = classify_keyword(line)  # Keyword is found once and used for all kind of scopes
+        if keyword == Keyword.NONE:  # Most of lines (e.g. test cases) don't start any scope
+            continue
+        if keyword == Keyword.IF or keyword == Keyword.ELSE or keyword == Keyword.END_IF:
+            save_if_scope(if_stack, lines, line_numbers, num, keyword)  # Saving IF-scope
         else:
-            save_line_num_by_type(line, line_numbers, num)  # Saving all scopes (except IF) according to their type
+            save_line_num_by_type(keyword, line_numbers, num)  # Saving all scopes (except IF) according to their type
 
     # Sorting all of IF-scopes by their start line number
     line_numbers.IF_SCOPE_LIST.sort(key=lambda i: i.START_IF, reverse=False)
+    line_numbers.build_condition_index(len(lines))
 
-    return lines, line_numbers
+    return line_numbers
+
+
+# Value of INIT or EV, until a part (between commas) which starts with INIT or EV, same as split_line function
+_TEST_CASE_VALUE = r"([^,=]*(?:,(?!\s*(?i:init|ev))[^,=]*)*)"
 
+""" A test case in its most common form: "VAR name, init = value, ev = value" (INIT or EV may be omitted) """
 
-def classify_data(workbook, lines, line_numbers):
+TEST_CASE_PATTERN = re.compile(r"(?!(?i:init|ev))([^\s,]+)\s+([^,]*?)\s*"
+                               r"(?:,\s*(init|INIT)\s*=" + _TEST_CASE_VALUE + r")?"
+                               r"(?:,\s*(ev|EV)\s*=" + _TEST_CASE_VALUE + r")?")
+
+
+def tokenize_test_case(line):
+    """
+    Finds type, name, initial and expected value of a test case in one pass, using TEST_CASE_PATTERN.
+    Only lines which give exactly the same result as extract_test_case_fields function are tokenized,
+    e.g. lines with DELTA, data type after name, or values which include INIT/EV are not.
+    :param line: A stripped test case line, joined with the lines which continue it
+    :returns: Tuple of (type, name, initial value, expected value), or None if the line is not tokenized
+    """
+    if not line.isascii():  # Matching of regex is not the same as upper() for some of non-ascii characters
+        return None
+    match = TEST_CASE_PATTERN.fullmatch(line)
+    if match is None:
+        return None
+    param_type, param_name, init_keyword, init, ev_keyword, ev = match.groups()
+    if init_keyword is None and ev_keyword is None or param_type in param_name:
+        return None
+
+    if init_keyword is None:
+        init = ""
+    else:
+        init = ",".join([part.strip() for part in init.split(",")]) if "," in init else init.strip()
+        if "init" in init or "INIT" in init:
+            return None
+    if ev_keyword is None:
+        ev = ""
+    else:
+        ev = ",".join([part.strip() for part in ev.split(",")]) if "," in ev else ev.strip()
+        if "ev" in ev or "EV" in ev:
+            return None
+    return param_type, param_name, init, ev
+
+
+def split_line(line):
+    """
+    Input of this function is a Test line, means it has VAR, INIT, and EV.
+    This function splits the line into these 3 parts.
+    :returns: Array with 3 elements: data[0]=Variable, data[1]=Initial-Value, data[2]=Expected-Value.
+    """
+    tmp_line = ""
+    data = []
+    for part in line.split(","):
+        part = part.strip()
+        if part.upper().startswith("INIT") or part.upper().startswith("EV"):
+            data.append(tmp_line[:-1])
+            tmp_line = ""
+        tmp_line += part + ","
+    data.append(tmp_line[:-1])
+
+    # In case that INIT or EV is omitted
+    if len(data) < 3:
+        if data[1].lstrip().lower().startswith("init"):
+            data.append("")
+        elif data[1].lstrip().lower().startswith("ev"):
+            ev = data[1]
+            data[1] = ""
+            data.append(ev)
+
+    return data
+
+
+def join_test_case_lines(lines, line_num):
+    """
+    Joins a test case line (VAR, ARRAY or STR) and the next lines which continue it (starting with '&').
+    Comment lines between them are skipped.
+    :param lines: All lines of PTU file (or any object which gives lines by their number, see PtuParser class)
+    :param line_num: Line number of the test case
+    :returns: The joined line, stripped
+    """
+    parts = [lines[line_num].strip()]
+
+    counter = line_num + 1
+    next_line = lines[counter].lstrip()
+    while next_line.startswith("--"):
+        counter += 1
+        next_line = lines[counter].lstrip()
+
+    # Parts are joined once at the end, because tables of calibrations may be continued in thousands of lines
+    while next_line.startswith("&"):
+        parts.append(next_line[1:].strip())
+        counter += 1
+        next_line = lines[counter].lstrip()
+        while next_line.startswith("--"):
+            counter += 1
+            next_line = lines[counter].lstrip()
+
+    return "".join(parts)
+
+
+def extract_test_case_line(test_case, line):
+    """
+    Extracts type, name, initial and expected value of a joined test case line and saves them in the test case.
+    """
+    tokens = tokenize_test_case(line)
+    if tokens is None:
+        extract_test_case_fields(test_case, line)
+    else:
+        test_case.param_type, test_case.param_name, test_case.init, test_case.ev = tokens
+    test_case.param_type = intern(test_case.param_type)  # There are only a few types, shared by all of test cases
+
+
+def extract_test_case_data(lines, line_numbers, line_num, lazy_values=False):
+    """
+    Extracts a test case (VAR, ARRAY or STR line) and the next lines which continue it (starting with '&').
+    :param lines: All lines of PTU file (or any object which gives lines by their number, see PtuParser class)
+    :param line_numbers: Object of LineNum class (or any object with get_conditions method)
+    :param line_num: Line number of the test case
+    :param lazy_values: If True, initial and expected values longer than LAZY_VALUE_MIN_LENGTH
+                        are saved as LazyValue objects, which keep the lines instead of the value
+    :returns: Object of TestCase class
+    """
+    line = join_test_case_lines(lines, line_num)
+
+    test_case = PtuWorkBook.TestCase()
+    extract_test_case_line(test_case, line)
+    if lazy_values and len(line) >= const.LAZY_VALUE_MIN_LENGTH:
+        if len(test_case.init) >= const.LAZY_VALUE_MIN_LENGTH:
+            test_case.init = LazyValue(lines, line_num, "init")
+        if len(test_case.ev) >= const.LAZY_VALUE_MIN_LENGTH:
+            test_case.ev = LazyValue(lines, line_num, "ev")
+    test_case.conditions = line_numbers.get_conditions(line_num, line_num)
+
+    return test_case
+
+
+def extract_test_case_fields(test_case, line):
+    """
+    Extracts type, name, initial and expected value of a test case in any form, and saves them in the test case.
+    :param test_case: Object of TestCase class
+    :param line: A stripped test case line, joined with the lines which continue it
+    """
+    data = split_line(line)
+
+    test_case.param_type = data[0].split()[0]
+    test_case.param_name = data[0].replace(test_case.param_type, "").lstrip()
+
+    if not test_case.param_name.split(",")[-1] == test_case.param_name:
+        data_type = test_case.param_name.split(",")[-1]
+        test_case.param_name = test_case.param_name.replace(data_type, "")
+        test_case.param_name = test_case.param_name[:-1]
+        if data_type.strip() != "":
+            test_case.param_type += "," + data_type
+
+    init = data[1]
+    if init.count("=") == 1:
+        init = init.replace("init", "")
+        init = init.replace("INIT", "")
+        init = init.replace("=", "")
+        init = init.strip()
+    test_case.init += init
+
+    ev = data[2]
+    if len(data) == 3:
+        if ev.count("=") == 1:
+            ev = ev.replace("ev", "")
+            ev = ev.replace("EV", "")
+            ev = ev.replace("=", "")
+            ev = ev.strip()
+    else:
+        if ev.startswith("ev") or ev.startswith("EV"):
+            delta = data[3].strip()
+            delta = delta.replace("DELTA", "")
+            delta = delta.replace("delta", "")
+            delta = delta.replace("=", "±")
+            delta = delta.strip()
+            ev = ev.replace("ev", "")
+            ev = ev.replace("EV", "")
+            ev = ev.replace("=", "")
+            ev = ev.strip()
+            ev += " " + delta
+        elif ev.startswith("MIN") or ev.startswith("min"):
+            ev += data[3].rstrip()
+    test_case.ev += ev
+
+
+def extract_element_data(lines, line_numbers, line_num, element, data_type_stack, lazy_values=False):
+    """
+    Extracts data of a line inside ELEMENT scope and saves it in the element.
+    :param lines: All lines of PTU file (or any object which gives lines by their number, see PtuParser class)
+    :param line_numbers: Object of LineNum class (or any object with get_conditions method)
+    :param data_type_stack: Types of data (input, output or calibrations) which are started in the element
+    :param lazy_values: See extract_test_case_data function
+    """
+    line = lines[line_num].strip()
+    if line.startswith("USE"):
+        line = line.replace("USE", "")
+        element.own_use.append(line.strip())
+    elif line.startswith("--"):
+        line = line.replace("--", "").strip().lower()
+        if line.startswith("input"):
+            data_type_stack.append("input")
+        elif line.startswith("output"):
+            data_type_stack.append("output")
+        elif line.startswith("calib"):
+            data_type_stack.append("calibrations")
+    elif line.upper().startswith("VAR") or line.upper().startswith("ARRAY") or line.upper().startswith("STR"):
+        test_case = extract_test_case_data(lines, line_numbers, line_num, lazy_values)
+        data_type = data_type_stack[-1]
+        if data_type == "input":
+            element.input_data.append(test_case)
+        elif data_type == "output":
+            element.output_data.append(test_case)
+        elif data_type == "calibrations":
+            element.calibrations.append(test_case)
+        elif data_type == "":
+            if "init" in test_case.ev or "INIT" in test_case.ev:
+                element.input_data.append(test_case)
+            else:
+                element.output_data.append(test_case)
+    elif line.startswith("STUB"):
+        line = line.replace("STUB", "")
+        stub = PtuWorkBook.Stub()
+        stub.stub_definition += line.strip()
+        stub.conditions = line_numbers.get_conditions(line_num, line_num)
+        element.stub_calls.append(stub)
+    elif line.startswith("#"):
+        user_code = PtuWorkBook.UserCode()
+        user_code.code += line[1:].strip()
+        user_code.conditions = line_numbers.get_conditions(line_num, line_num)
+        element.user_code.append(user_code)
+
+
+def save_preface_data(preface, purpose, processor, tool_chain, header):
+    """
+    Extracting Preface data such as Purpose, Processor, Toolchain, and header info.
+    :param preface: Object of Preface class, for saving data
+    :param purpose, processor, tool_chain, header: Lines of PTU file which include these data
+    """
+    purpose = purpose.replace("-- Purpose:", "")
+    preface.purpose += purpose.strip()
+
+    processor = processor.replace("-- Processor:", "")
+    preface.processor += processor.strip()
+
+    tool_chain = tool_chain.replace("-- Tool chain:", "")
+    preface.tool_chain += tool_chain.strip()
+
+    header = header.replace("HEADER ", "")
+    header = header.strip()
+    # Header includes module name, module version, and test plan version that are seprated using ','
+    try:
+        header_module_name, header_module_version, header_test_plan_version = header.split(",")
+        preface.header.module_name = header_module_name.strip()
+        preface.header.module_version = header_module_version.strip()
+        preface.header.test_plan_version = header_test_plan_version.strip()
+    except ValueError:
+        pass
+
+
+def extract_services_range(text, line_lengths, line_numbers):
+    """
+    Extracting data of services of a range of lines, in a separate process (see extract_services_in_parallel).
+    :param text: Lines of the services (starting from the first service) joined together,
+                 because a single string is sent to another process much faster than an array of strings
+    :param line_lengths: Array of lengths of lines in text
+    :param line_numbers: Object of LineNum class, made by get_service_range method
+    :returns: Services in the binary format of parse_cache module (much faster to send back than pickled objects),
+              condition sets are saved in order of finding them
+    """
+
+    lines = []
+    start = 0
+    for length in line_lengths:
+        lines.append(text[start:start + length])
+        start += length
+
+    workbook = PtuWorkBook()
+    workbook.condition_sets = line_numbers.condition_sets
+    for service_line_num in line_numbers.SERVICE_LIST:
+        workbook.services.append(extract_service_data(lines, line_numbers, service_line_num))
+    return parse_cache.dump_workbook(workbook)
+
+
+def extract_services_in_parallel(workbook, lines, line_numbers, jobs):
+    """
+    Extracting data of services on several processes. Services are split into ranges of lines with about the same
+    number of lines, and services of each range are extracted in a process (see extract_services_range).
+    Services are added to the workbook in order of lines, and condition sets are added to the workbook in the same
+    order as extracting the services one by one, so the workbook is exactly the same.
+    :param workbook: Object of PtuWorkBook class, services are added to it
+    :param lines: All lines of PTU file (array, or object of MappedLines class)
+    :param line_numbers: Object of LineNum class
+    :param jobs: Number of processes
+    """
+
+    service_list = line_numbers.SERVICE_LIST
+    range_size = (service_list[-1].END - service_list[0].START) // (jobs * const.SERVICE_RANGES_PER_JOB) + 1
+    ranges_text = []
+    ranges_line_lengths = []
+    ranges_line_numbers = []
+    first_service = 0
+    for counter, service_line_num in enumerate(service_list):
+        range_line_count = service_line_num.END + 1 - service_list[first_service].START
+        if range_line_count >= range_size or counter + 1 == len(service_list):
+            start, end, range_line_numbers = line_numbers.get_service_range(first_service, counter + 1)
+            range_lines = lines[start:end] if isinstance(lines, list) else [lines[num] for num in range(start, end)]
+            ranges_text.append("".join(range_lines))
+            ranges_line_lengths.append(array("I", map(len, range_lines)))
+            ranges_line_numbers.append(range_line_numbers)
+            first_service = counter + 1
+
+    # Services of a range are added while next ranges are being extracted
+    with ProcessPoolExecutor(max_workers=min(jobs, len(ranges_text))) as executor:
+        for content in executor.map(extract_services_range, ranges_text, ranges_line_lengths, ranges_line_numbers):
+            services = parse_cache.load_workbook(content, workbook.condition_sets).services
+            workbook.services.extend(services)
+
+
+def extract_service_data(lines, line_numbers, service_line_num, lazy_values=False):
+    """
+    Extracting data of a single service, by analyzing its scope (and scopes of its tests and elements).
+    :param lines: All lines of PTU file (array, or object of MappedLines class)
+    :param line_numbers: Object of LineNum class
+    :param service_line_num: Object of LineNum.ServiceLineNum class, line numbers of the service
+    :param lazy_values: If True, very large values of test cases are not copied (see LazyValue class)
+    :returns: Object of PtuWorkBook.Service class
+    """
+    service_name = lines[service_line_num.START]
+    service_name = service_name.replace("SERVICE ", "")
+    service = PtuWorkBook.Service()
+    service.name = service_name.strip()
+    service.conditions = line_numbers.get_conditions(service_line_num.START, service_line_num.END)
+
+    for within_service_line_num in range(service_line_num.START, service_line_num.TEST_START[0]):
+        line = lines[within_service_line_num]
+        if line.startswith("#"):
+            user_code = PtuWorkBook.UserCode()
+            user_code.code += line[1:].strip()
+            user_code.conditions = line_numbers.get_conditions(within_service_line_num, within_service_line_num)
+            service.user_code.append(user_code)
+        elif line.startswith("--"):
+            line = line.replace("--", "/* ") + " */"
+            user_code = PtuWorkBook.UserCode()
+            user_code.code += line.strip()
+            user_code.conditions = line_numbers.get_conditions(within_service_line_num, within_service_line_num)
+            service.user_code.append(user_code)
+        elif line.startswith("USE"):
+            line = line.replace("USE", "")
+            service.use.append(line.strip())
+
+    for counter in range(service_line_num.get_test_count()):
+        test = PtuWorkBook.Test()
+        for test_line_num in range(service_line_num.TEST_START[counter],
+                                   service_line_num.ELEMENT_START[counter]):
+            line = lines[test_line_num].strip()
+            if line.upper().startswith("TEST"):
+                test.name = line
+            elif line.upper().startswith("FAMILY"):
+                family = line.replace("FAMILY", "")
+                test.family = family.strip()
+            elif line.upper().startswith("COMMENT"):
+                comment = line.replace("COMMENT", "")
+                test.comment.append(comment.strip())
+            elif line.upper().startswith("USE"):
+                use = line.replace("USE", "")
+                test.use.append(use.strip())
+        element = PtuWorkBook.Element()
+        data_type_stack = [""]
+        for element_line_num in range(service_line_num.ELEMENT_START[counter],
+                                      service_line_num.ELEMENT_END[counter]):
+            extract_element_data(lines, line_numbers, element_line_num, element, data_type_stack, lazy_values)
+        test.element = element
+        test.conditions = line_numbers.get_conditions(service_line_num.TEST_START[counter],
+                                                      service_line_num.TEST_END[counter])
+        test.extend_use()
+        service.test_list.append(test)
+    service.extend_use()
+    return service
+
+
+def classify_data(workbook, lines, line_numbers, lazy_values=False, lazy_services=False, jobs=1):
     """
     This function is the main function for extracting data from PTU file.
     It consists of several functions that each one is used for extracting different type of data.
     :param workbook: Object of PtuWorkBook class, for saving all data
     :param lines: Array of all af the lines in PTU file.
     :param line_numbers: Object of LineNum class, which helps us to find and extract data easier.
+    :param lazy_values: If True, very large values of test cases are not copied (see LazyValue class)
+    :param lazy_services: If True, services are extracted when they are used (see LazyServiceList class),
+                          lines must not be changed later.
+    :param jobs: Number of processes for extracting services (see extract_services_in_parallel),
+                 services are extracted in this process if it is 1. lazy_values is not used if it is more than 1.
     """
 
     def extract_preface_data():
         """
         Extracting Preface data such as Purpose, Processor, Toolchain, and header info.
         """
-        purpose = lines[line_numbers.PURPOSE]
-        purpose = purpose.replace("-- Purpose:", "")
-        workbook.preface.purpose += purpose.strip()
-
-        processor = lines[line_numbers.PROCESSOR]
-        processor = processor.replace("-- Processor:", "")
-        workbook.preface.processor += processor.strip()
-
-        tool_chain = lines[line_numbers.TOOL_CHAIN]
-        tool_chain = tool_chain.replace("-- Tool chain:", "")
-        workbook.preface.tool_chain += tool_chain.strip()
-
-        header = lines[line_numbers.HEADER_START]
-        header = header.replace("HEADER ", "")
-        header = header.strip()
-        # Header includes module name, module version, and test plan version that are seprated using ','
-        try:
-            header_module_name, header_module_version, header_test_plan_version = header.split(",")
-            workbook.preface.header.module_name = header_module_name.strip()
-            workbook.preface.header.module_version = header_module_version.strip()
-            workbook.preface.header.test_plan_version = header_test_plan_version.strip()
-        except ValueError:
-            pass
+        save_preface_data(workbook.preface, lines[line_numbers.PURPOSE], lines[line_numbers.PROCESSOR],
+                          lines[line_numbers.TOOL_CHAIN], lines[line_numbers.HEADER_START])
 
     def extract_include_data():
         """
@@ -515,42 +1234,16 @@ def classify_data(workbook, lines, line_numbers):
         This function checks scope of which conditions(IF-scopes) includes the scope which starts at start_line_num and ends at end_line_num
         :returns list of all IF-scopes with terms that we said in previous sentence.
         """
-        condition_list = []
-        for if_scope in line_numbers.IF_SCOPE_LIST:
-            if if_scope.START_IF > end_line_num:  # If there is no IF-scope that includes the input scope
-                break
-            if start_line_num > if_scope.START_IF and end_line_num < if_scope.END_IF:
-                condition_list.append(if_scope.condition)
-        return condition_list
+        return line_numbers.get_conditions(start_line_num, end_line_num)
 
     def extract_user_code_data():
         """
         Extracting common user-code data in PTU file and grouping them by their conditions
         """
-        for line_num_counter in range(len(line_numbers.USER_CODE_LIST)):
-            line_num = line_numbers.USER_CODE_LIST[line_num_counter]
-            if line_num == 0: continue  # If the line is a merged user-code
-            line = lines[line_num].strip()
+        for conditions, group in line_numbers.group_by_conditions(line_numbers.USER_CODE_LIST):
             user_code = PtuWorkBook.UserCode()
-            user_code.code = line[1:]  # Remove '#'
-            user_code.conditions = check_for_conditions(line_num, line_num)
-
-            # Until the next user-code has same conditions as current line, we add it to current user-code
-            while True:
-                try:
-                    next_line_num = line_numbers.USER_CODE_LIST[line_num_counter + 1]
-                except IndexError:  # If the line was the last user-code line and has no next line
-                    break
-                if user_code.conditions != check_for_conditions(next_line_num, next_line_num):
-                    break  # If next user-code doesn't have same conditions, don't merge it with current line
-
-                # Merge next user-code with current user-code and check these terms for the following user-codes,too
-                line_numbers.USER_CODE_LIST[line_num_counter + 1] = 0
-                next_line = lines[next_line_num].strip()
-                user_code.code += "\n" + next_line[1:]
-
-                line_num_counter += 1
-
+            user_code.code = "\n".join([lines[line_num].strip()[1:] for line_num in group])  # Remove '#'
+            user_code.conditions = conditions
             workbook.user_code.append(user_code)
 
     def extract_stub_definitions_data():
@@ -597,129 +1290,18 @@ def classify_data(workbook, lines, line_numbers):
         """
         Extracting data in Initialisation scope (If exists) and grouping them by their condition
         """
-        for line_num in range(line_numbers.INITIALISATION_START + 1, line_numbers.INITIALISATION_END):
-            line = lines[line_num].strip()
-
-            # If line is empty or IF-scope (not in user-code format)
-            if not line.startswith("#"): continue
-
+        # Lines which are empty or IF-scope are not in user-code format
+        line_num_list = [line_num for line_num in range(line_numbers.INITIALISATION_START + 1,
+                                                        line_numbers.INITIALISATION_END)
+                         if lines[line_num].strip().startswith("#")]
+        for conditions, group in line_numbers.group_by_conditions(line_num_list):
+            descriptions = [lines[group[0]].strip()[1:]]
+            descriptions += [lines[line_num].replace("#", "").strip() for line_num in group[1:]]
             initialisation = PtuWorkBook.Initialisation()
-            initialisation.description += line[1:]
-            initialisation.conditions = check_for_conditions(line_num, line_num)
-
-            # Checking whether next lines have the same list of conditions(IF-scope) or not
-            while line_num < line_numbers.INITIALISATION_END:
-                next_line_num = line_num + 1
-                next_line = lines[next_line_num].strip()
-
-                # If line is empty or IF-scope (not in user-code format)
-                if not next_line.startswith("#"):
-                    line_num += 1
-                    continue
-
-                if initialisation.conditions != check_for_conditions(next_line_num, next_line_num):
-                    break
-
-                # Merge next lines with current line and check these terms for the following lines, too.
-                next_line = next_line.replace("#", "").strip()
-                initialisation.description += "\n" + next_line
-                lines[next_line_num] = ""
-
-                line_num += 1
-
+            initialisation.description += "\n".join(descriptions)
+            initialisation.conditions = conditions
             workbook.initialisation.append(initialisation)
 
-    def split_line(line):
-        """
-        Input of this function is a Test line, means it has VAR, INIT, and EV.
-        This function splits the line into these 3 parts.
-        :returns: Array with 3 elements: data[0]=Variable, data[1]=Initial-Value, data[2]=Expected-Value.
-        """
-        tmp_line = ""
-        data = []
-        for part in line.split(","):
-            part = part.strip()
-            if part.upper().startswith("INIT") or part.upper().startswith("EV"):
-                data.append(tmp_line[:-1])
-                tmp_line = ""
-            tmp_line += part + ","
-        data.append(tmp_line[:-1])
-
-        # In case that INIT or EV is omitted
-        if len(data) < 3:
-            if data[1].lstrip().lower().startswith("init"):
-                data.append("")
-            elif data[1].lstrip().lower().startswith("ev"):
-                ev = data[1]
-                data[1] = ""
-                data.append(ev)
-
-        return data
-
-    def extract_test_case_data(line_num):
-        line = lines[line_num].strip()
-
-        counter = line_num + 1
-        while lines[counter].lstrip().startswith("--"):
-            counter += 1
-
-        if lines[counter].lstrip().startswith("&"):
-            next_line = lines[counter].lstrip()
-            while next_line.startswith("&"):
-                line += next_line[1:].strip()
-                counter += 1
-                while lines[counter].lstrip().startswith("--"):
-                    counter += 1
-                next_line = lines[counter].lstrip()
-        data = split_line(line)
-
-        test_case = PtuWorkBook.TestCase()
-
-        test_case.param_type = data[0].split()[0]
-        test_case.param_name = data[0].replace(test_case.param_type, "").lstrip()
-
-        if not test_case.param_name.split(",")[-1] == test_case.param_name:
-            data_type = test_case.param_name.split(",")[-1]
-            test_case.param_name = test_case.param_name.replace(data_type, "")
-            test_case.param_name = test_case.param_name[:-1]
-            if data_type.strip() != "":
-                test_case.param_type += "," + data_type
-
-        init = data[1]
-        if init.count("=") == 1:
-            init = init.replace("init", "")
-            init = init.replace("INIT", "")
-            init = init.replace("=", "")
-            init = init.strip()
-        test_case.init += init
-
-        ev = data[2]
-        if len(data) == 3:
-            if ev.count("=") == 1:
-                ev = ev.replace("ev", "")
-                ev = ev.replace("EV", "")
-                ev = ev.replace("=", "")
-                ev = ev.strip()
-        else:
-            if ev.startswith("ev") or ev.startswith("EV"):
-                delta = data[3].strip()
-                delta = delta.replace("DELTA", "")
-                delta = delta.replace("delta", "")
-                delta = delta.replace("=", "±")
-                delta = delta.strip()
-                ev = ev.replace("ev", "")
-                ev = ev.replace("EV", "")
-                ev = ev.replace("=", "")
-                ev = ev.strip()
-                ev += " " + delta
-            elif ev.startswith("MIN") or ev.startswith("min"):
-                ev += data[3].rstrip()
-        test_case.ev += ev
-
-        test_case.conditions = check_for_conditions(line_num, line_num)
-
-        return test_case
-
     def extract_environments_data():
         """
          Extracting Environments' test data by analyzing environments scopes
@@ -741,103 +1323,22 @@ def classify_data(workbook, lines, line_numbers):
                 line = lines[line_num].strip()
 
                 if line.upper().startswith("VAR") or line.upper().startswith("ARRAY") or line.upper().startswith("STR"):
-                    environment.test_case_list.append(extract_test_case_data(line_num))
+                    environment.test_case_list.append(extract_test_case_data(lines, line_numbers, line_num,
+                                                                             lazy_values))
 
             workbook.environments.append(environment)
 
-    def extract_element_data(line_num, element, data_type_stack):
-        line = lines[line_num].strip()
-        if line.startswith("USE"):
-            line = line.replace("USE", "")
-            element.use.append(line.strip())
-        elif line.startswith("--"):
-            line = line.replace("--", "").strip().lower()
-            if line.startswith("input"):
-                data_type_stack.append("input")
-            elif line.startswith("output"):
-                data_type_stack.append("output")
-            elif line.startswith("calib"):
-                data_type_stack.append("calibrations")
-        elif line.upper().startswith("VAR") or line.upper().startswith("ARRAY") or line.upper().startswith("STR"):
-            test_case = extract_test_case_data(line_num)
-            data_type = data_type_stack[-1]
-            if data_type == "input":
-                element.input_data.append(test_case)
-            elif data_type == "output":
-                element.output_data.append(test_case)
-            elif data_type == "calibrations":
-                element.calibrations.append(test_case)
-            elif data_type == "":
-                if "init" in test_case.ev or "INIT" in test_case.ev:
-                    element.input_data.append(test_case)
-                else:
-                    element.output_data.append(test_case)
-        elif line.startswith("STUB"):
-            line = line.replace("STUB", "")
-            stub = PtuWorkBook.Stub()
-            stub.stub_definition += line.strip()
-            stub.conditions = check_for_conditions(line_num, line_num)
-            element.stub_calls.append(stub)
-        elif line.startswith("#"):
-            user_code = PtuWorkBook.UserCode()
-            user_code.code += line[1:].strip()
-            user_code.conditions = check_for_conditions(line_num, line_num)
-            element.user_code.append(user_code)
-
     def extract_services_data():
+        if lazy_services:
+            workbook.services = LazyServiceList(lines, line_numbers, lazy_values)
+            return
+        if jobs > 1 and len(line_numbers.SERVICE_LIST) > 1:
+            extract_services_in_parallel(workbook, lines, line_numbers, jobs)
+            return
         for service_line_num in line_numbers.SERVICE_LIST:
-            service_name = lines[service_line_num.START]
-            service_name = service_name.replace("SERVICE ", "")
-            service = PtuWorkBook.Service()
-            service.name = service_name.strip()
-            service.conditions = check_for_conditions(service_line_num.START, service_line_num.END)
-
-            for within_service_line_num in range(service_line_num.START, service_line_num.TEST_START[0]):
-                line = lines[within_service_line_num]
-                if line.startswith("#"):
-                    user_code = PtuWorkBook.UserCode()
-                    user_code.code += line[1:].strip()
-                    user_code.conditions = check_for_conditions(within_service_line_num, within_service_line_num)
-                    service.user_code.append(user_code)
-                elif line.startswith("--"):
-                    line = line.replace("--", "/* ") + " */"
-                    user_code = PtuWorkBook.UserCode()
-                    user_code.code += line.strip()
-                    user_code.conditions = check_for_conditions(within_service_line_num, within_service_line_num)
-                    service.user_code.append(user_code)
-                elif line.startswith("USE"):
-                    line = line.replace("USE", "")
-                    service.use.append(line.strip())
-
-            for counter in range(service_line_num.get_test_count()):
-                test = PtuWorkBook.Test()
-                for test_line_num in range(service_line_num.TEST_START[counter],
-                                           service_line_num.ELEMENT_START[counter]):
-                    line = lines[test_line_num].strip()
-                    if line.upper().startswith("TEST"):
-                        test.name = line
-                    elif line.upper().startswith("FAMILY"):
-                        family = line.replace("FAMILY", "")
-                        test.family = family.strip()
-                    elif line.upper().startswith("COMMENT"):
-                        comment = line.replace("COMMENT", "")
-                        test.comment.append(comment.strip())
-                    elif line.upper().startswith("USE"):
-                        use = line.replace("USE", "")
-                        test.use.append(use.strip())
-                element = PtuWorkBook.Element()
-                data_type_stack = [""]
-                for element_line_num in range(service_line_num.ELEMENT_START[counter],
-                                              service_line_num.ELEMENT_END[counter]):
-                    extract_element_data(element_line_num, element, data_type_stack)
-                test.element = element
-                test.conditions = check_for_conditions(service_line_num.TEST_START[counter],
-                                                       service_line_num.TEST_END[counter])
-                test.extend_use()
-                service.test_list.append(test)
-            service.extend_use()
-            workbook.services.append(service)
+            workbook.services.append(extract_service_data(lines, line_numbers, service_line_num, lazy_values))
 
+    workbook.condition_sets = line_numbers.condition_sets  # All of conditions of data are found by line_numbers
     extract_preface_data()
     extract_include_data()
     extract_comment_data()
@@ -846,3 +1347,553 @@ def classify_data(workbook, lines, line_numbers):
     extract_initialization_data()
     extract_environments_data()
     extract_services_data()
+
+
+class LazyServiceList:
+    """
+    Services of a PTU file, which are extracted only when they are used (see lazy_services of open_ptu).
+    Line numbers of all of services are found by pre-processing, so number and names of services are known,
+    but data of a service is extracted when it is asked by its index (or by iterating over services).
+    Only a limited number of extracted services are kept, the least recently used one is removed first.
+    So a service which is asked again after a while may be extracted again, as a new object.
+    Objects of this class can be used instead of array of services:
+    len(services), services[num] and iterating over services are supported.
+    """
+
+    def __init__(self, lines, line_numbers, lazy_values=False, cache_size=const.LAZY_SERVICE_CACHE_SIZE):
+        """
+        :param lines: All lines of PTU file (array, or object of MappedLines class), must not be changed later
+        :param line_numbers: Object of LineNum class, found by pre-processing the lines
+        :param lazy_values: If True, very large values of test cases are not copied (see LazyValue class)
+        :param cache_size: Number of extracted services which are kept
+        """
+        self.lines = lines
+        self.line_numbers = line_numbers
+        self.lazy_values = lazy_values
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # Index of service -> Service, the least recently used one is the first one
+        self.decoder = None  # If given (object of ValueDecoder class), extracted services are decoded by it
+
+    def __len__(self):
+        return len(self.line_numbers.SERVICE_LIST)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("service index out of range")
+
+        service = self.cache.get(index)
+        if service is not None:
+            self.cache.move_to_end(index)
+            return service
+        service = extract_service_data(self.lines, self.line_numbers, self.line_numbers.SERVICE_LIST[index],
+                                       self.lazy_values)
+        if self.decoder is not None:
+            self.decoder.decode_service(service)
+        self.cache[index] = service
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return service
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def get_name(self, index):
+        """
+        :return: Name of the service, which is found without extracting the service.
+        """
+        service_name = self.lines[self.line_numbers.SERVICE_LIST[index].START].replace("SERVICE ", "").strip()
+        return self.decoder.decode(service_name) if self.decoder is not None else service_name
+
+    def find(self, name):
+        """
+        :param name: Name of service
+        :returns: The first Service with this name, or None if there is no service with this name.
+                  Only this service is extracted.
+        """
+        for index in range(len(self)):
+            if self.get_name(index) == name:
+                return self[index]
+        return None
+
+
+def iter_services(path, encoding=None, use_mmap=False, workbook=None):
+    """
+    Extracts services of PTU file one by one, while lines are being read (see PtuParser class).
+    Every service is given as soon as its END SERVICE is read and it is not kept,
+    so memory doesn't grow with number of services, and each service can be used while next ones are extracted.
+    If structure of PTU file is not as expected by PtuParser, the rest of services are extracted in two passes.
+    Services which are given before that are not given again, so they may be different from two-pass extraction
+    (e.g. two-pass extraction ignores IF-scopes which are never ended, which is only known at the end of file).
+    :param encoding: encoding of PTU file, None means default encoding of platform
+    :param use_mmap: If True, PTU file is mapped into memory instead of being read (see line_source)
+    :param workbook: If given (object of PtuWorkBook class), other data of PTU file is saved in it (not services).
+                     Data before the first service (e.g. includes, stub definitions, initialisation and environments)
+                     is saved before the first service is given, preface and comments are saved at the end of file.
+    :returns: generator of Service objects, in order of lines
+    """
+    if workbook is None:
+        workbook = PtuWorkBook()
+    service_count = 0
+    ptu_file = MappedLines(path, encoding) if use_mmap else open(path, "rt", encoding=encoding)
+    try:
+        for service in PtuParser(workbook, ptu_file).parse_services():
+            service_count += 1
+            yield service
+        return
+    except PtuStructureError:
+        pass  # Extracting data again in two passes
+    finally:
+        ptu_file.close()
+
+    ptu_workbook = open_ptu(path, "", encoding, use_mmap)
+    # Other data of PTU file is taken from two-pass extraction, services are given one by one instead
+    workbook.preface = ptu_workbook.preface
+    workbook.include = ptu_workbook.include
+    workbook.comment = ptu_workbook.comment
+    workbook.user_code = ptu_workbook.user_code
+    workbook.stub_definitions = ptu_workbook.stub_definitions
+    workbook.initialisation = ptu_workbook.initialisation
+    workbook.environments = ptu_workbook.environments
+    workbook.condition_sets = ptu_workbook.condition_sets
+    for service in ptu_workbook.services[service_count:]:
+        yield service
+
+
+class PtuStructureError(Exception):
+    """
+    Raised by PtuParser class when structure of PTU file is not as expected by single-pass parser,
+    e.g. nested or not ended scopes, or IF-scopes which never end.
+    In these cases, data is extracted by pre_process and classify_data functions instead (see open_ptu function).
+    """
+
+
+# Keywords which start or end scopes of PTU file, these scopes are never nested in single-pass parser
+SCOPE_KEYWORDS = (Keyword.SERVICE, Keyword.END_SERVICE, Keyword.TEST, Keyword.END_TEST, Keyword.ELEMENT,
+                  Keyword.END_ELEMENT, Keyword.ENVIRONMENT, Keyword.END_ENVIRONMENT, Keyword.DEFINE_STUB,
+                  Keyword.END_DEFINE, Keyword.INITIALISATION, Keyword.END_INITIALISATION)
+
+
+class PtuParser:
+    """
+    Single-pass parser of PTU files, which saves data in an object of PtuWorkBook class while lines are being read.
+    Services, tests, elements and other scopes are created when they start and saved when they end.
+    Conditions are taken from the stack of IF-scopes which are open, instead of IF_SCOPE_LIST of LineNum class.
+    Result is the same as pre_process and classify_data functions, but lines are not kept in memory.
+    Only a few lines are read ahead, for test cases which are continued in next lines (starting with '&').
+    Objects of this class give lines by their number and conditions by get_conditions method (same as LineNum),
+    so extract_test_case_data and extract_element_data functions are shared with classify_data.
+    """
+
+    def __init__(self, workbook, ptu_file, decoder=None):
+        """
+        :param workbook: Object of PtuWorkBook class, for saving all data
+        :param ptu_file: file handler of PTU file (or any iterable of its lines)
+        :param decoder: If given (object of ValueDecoder class), conditions of IF-scopes are decoded by it,
+                        other data must be decoded after parsing (see binary of open_ptu)
+        """
+        self.workbook = workbook
+        self.decoder = decoder
+        self.ptu_file = iter(ptu_file)
+        self.line_num = 0  # Number of the line which is being parsed
+        self.line = ""  # The line which is being parsed, without comment inside it
+        self.next_lines = deque()  # Lines which are read ahead of current line, see read_line method
+
+        self.if_conditions = []  # Conditions of IF-scopes which are open
+        self.conditions = NO_CONDITIONS  # ConditionSet of if_conditions, found again whenever they change
+        self.if_lines = []  # Start lines of IF-scopes which are open, needed for conditions of ELSE
+        self.open_ranges = {}  # Start line of a scope -> [conditions at start line, number of them still open]
+
+        self.scope = Keyword.NONE  # Scope which is open: NONE, SERVICE, TEST, ELEMENT, END_ELEMENT(after element)...
+        self.scope_start = 0  # Start line of ENVIRONMENT or DEFINE STUB scope
+        self.test_cases_started = False
+        self.initialisation_started = False
+        self.preface_lines = {}  # Keyword (PURPOSE, PROCESSOR, TOOL_CHAIN, HEADER) -> the last line with it
+        self.comment_lines = []  # Lines starting with "COMMENT " and their number, may be inside COMMENT scope
+        self.comment_start = 0
+        self.comment_end = 0
+
+        self.user_code = None  # The last user-code, next user-codes with the same conditions are merged into it
+        self.initialisation = None  # The last initialisation, next lines with the same conditions are merged into it
+        self.environment = None
+        self.define_stub = None
+        self.in_stub_scope = False  # If a stub definition has been started in several lines (until '}')
+        self.stub_scope_start = 0
+        self.stub_scope_line = ""
+        self.service = None
+        self.service_start = 0
+        self.ended_service = None  # Service which has just ended, until it is given by parse_services method
+        self.service_has_test = False
+        self.test = None
+        self.test_start = 0
+        self.element = None
+        self.data_type_stack = [""]
+
+    def __getitem__(self, line_num):
+        """
+        Lines are given by their number, same as array of lines. Only current line and next lines can be read.
+        """
+        if line_num == self.line_num:
+            return self.line
+        offset = line_num - self.line_num - 1
+        if offset < 0:
+            raise PtuStructureError("Line %d has already been parsed" % (line_num + 1))
+        while len(self.next_lines) <= offset:
+            next_line = self.read_line()
+            if next_line is None:
+                raise PtuStructureError("Test case at line %d is not ended" % (self.line_num + 1))
+            self.next_lines.append(next_line)
+        return self.next_lines[offset][0]
+
+    def read_line(self):
+        """
+        Reads the next line of PTU file.
+        :returns: The line without comment inside it and the stripped line (for finding keyword),
+                  or None at the end of file
+        """
+        line = next(self.ptu_file, None)
+        if line is None:
+            return None
+        stripped_line = line.strip()
+        comment_start = stripped_line.find("--")
+        if comment_start > 0:  # Removing comment inside the line, same as pre_process_lines function
+            line = stripped_line[:comment_start].strip()
+        return line, stripped_line
+
+    def get_conditions(self, start_line_num, end_line_num):
+        """
+        Same as get_conditions method of LineNum class. Scope must end at current line.
+        Conditions of a scope are conditions at its start line, which are still open at its end line.
+        """
+        if start_line_num == end_line_num:
+            return self.conditions
+        start_conditions, open_count = self.open_ranges.pop(start_line_num)
+        if open_count == len(start_conditions):
+            return start_conditions
+        return self.workbook.condition_sets.get(start_conditions[:open_count])
+
+    def decode_condition(self, condition):
+        return self.decoder.decode_condition(condition) if self.decoder is not None else condition
+
+    def open_range(self):
+        """
+        Saves conditions at current line, which is start of a scope (see get_conditions method).
+        """
+        self.open_ranges[self.line_num] = [self.conditions, len(self.conditions)]
+
+    def update_conditions(self):
+        """
+        Finds ConditionSet of IF-scopes which are open, must be called whenever an IF-scope starts or ends.
+        """
+        self.conditions = self.workbook.condition_sets.get(self.if_conditions)
+
+    def end_if_scope(self):
+        """
+        Removes the last IF-scope from stack of open IF-scopes.
+        :returns: Start line of the IF-scope
+        """
+        if not self.if_conditions:
+            raise PtuStructureError("ENDIF without IF at line %d" % (self.line_num + 1))
+        self.if_conditions.pop()
+        self.update_conditions()
+        if_count = len(self.if_conditions)
+        for open_range in self.open_ranges.values():
+            if open_range[1] > if_count:
+                open_range[1] = if_count
+        return self.if_lines.pop()
+
+    def parse(self):
+        """
+        Reads all of lines and saves data in workbook.
+        """
+        self.workbook.services.extend(self.parse_services())
+
+    def parse_services(self):
+        """
+        Reads all of lines and saves data in workbook, except services, which are given as soon as they end.
+        :returns: generator of Service objects, in order of lines
+        """
+        next(self.ptu_file, None)  # The first line is ignored, same as pre_process_lines function
+        while True:
+            if self.next_lines:
+                next_line = self.next_lines.popleft()
+            else:
+                next_line = self.read_line()
+                if next_line is None:
+                    break
+            self.line_num += 1
+            self.line, stripped_line = next_line
+            self.parse_line(classify_keyword(stripped_line))
+            if self.ended_service is not None:
+                yield self.ended_service
+                self.ended_service = None
+        self.finish()
+
+    def parse_line(self, keyword):
+        """
+        Saves data of current line, according to its keyword and the scope which is open.
+        """
+        line = self.line
+
+        if keyword != Keyword.NONE:  # Most of lines have no keyword, and are only parsed in their scope
+            # Same conditions as save_if_scope function
+            if keyword == Keyword.IF:
+                self.if_conditions.append(self.decode_condition(line.upper().strip().replace("IF", "").strip()))
+                self.if_lines.append(line)
+                self.update_conditions()
+                return
+            elif keyword == Keyword.END_IF:
+                self.end_if_scope()
+                return
+            elif keyword == Keyword.ELSE:
+                line = self.end_if_scope().upper().replace("IF", "IF NOT")
+                self.if_conditions.append(self.decode_condition(line.replace("IF NOT", "!").strip()))
+                self.if_lines.append(line)
+                self.update_conditions()
+                return
+
+            # Data which are saved wherever they are
+            if keyword == Keyword.INCLUDE:
+                self.workbook.include.append(line.replace("##include ", "").strip())
+            elif keyword == Keyword.PURPOSE or keyword == Keyword.PROCESSOR or keyword == Keyword.TOOL_CHAIN or \
+                    keyword == Keyword.HEADER:
+                self.preface_lines[keyword] = line
+            elif keyword == Keyword.COMMENT_START:
+                self.comment_start = self.line_num
+            elif keyword == Keyword.COMMENT_END:
+                self.comment_end = self.line_num
+            elif keyword == Keyword.TEST_CASES:
+                self.test_cases_started = True
+            elif keyword == Keyword.USER_CODE and not self.test_cases_started and self.scope != Keyword.DEFINE_STUB:
+                self.parse_user_code_line()
+        if line.startswith("COMMENT "):
+            self.comment_lines.append((self.line_num, line))
+
+        scope = self.scope
+        if scope == Keyword.NONE:
+            if keyword == Keyword.SERVICE:
+                self.start_service()
+            elif keyword == Keyword.ENVIRONMENT:
+                self.start_environment()
+            elif keyword == Keyword.DEFINE_STUB:
+                self.start_define_stub()
+            elif keyword == Keyword.INITIALISATION and not self.initialisation_started:
+                self.initialisation_started = True
+                self.scope = Keyword.INITIALISATION
+            elif keyword in SCOPE_KEYWORDS:
+                self.raise_structure_error()
+        elif keyword in SCOPE_KEYWORDS:
+            if scope == Keyword.SERVICE and keyword == Keyword.TEST:
+                self.start_test()
+            elif scope == Keyword.SERVICE and keyword == Keyword.END_SERVICE and self.service_has_test:
+                self.end_service()
+            elif scope == Keyword.TEST and keyword == Keyword.ELEMENT:
+                self.element = PtuWorkBook.Element()
+                self.data_type_stack = [""]
+                self.scope = Keyword.ELEMENT
+            elif scope == Keyword.ELEMENT and keyword == Keyword.END_ELEMENT:
+                self.scope = Keyword.END_ELEMENT
+            elif scope == Keyword.END_ELEMENT and keyword == Keyword.END_TEST:
+                self.end_test()
+            elif scope == Keyword.ENVIRONMENT and keyword == Keyword.END_ENVIRONMENT:
+                self.end_environment()
+            elif scope == Keyword.DEFINE_STUB and keyword == Keyword.END_DEFINE:
+                self.end_define_stub()
+            elif scope == Keyword.INITIALISATION and keyword == Keyword.END_INITIALISATION:
+                self.scope = Keyword.NONE
+            else:
+                self.raise_structure_error()
+        elif scope == Keyword.SERVICE:
+            if not self.service_has_test:
+                self.parse_service_line()
+        elif scope == Keyword.TEST:
+            self.parse_test_line()
+        elif scope == Keyword.ELEMENT:
+            extract_element_data(self, self, self.line_num, self.element, self.data_type_stack)
+        elif scope == Keyword.ENVIRONMENT:
+            stripped_line = line.strip().upper()
+            if stripped_line.startswith("VAR") or stripped_line.startswith("ARRAY") or stripped_line.startswith("STR"):
+                self.environment.test_case_list.append(extract_test_case_data(self, self, self.line_num))
+        elif scope == Keyword.DEFINE_STUB:
+            self.parse_define_stub_line()
+        elif scope == Keyword.INITIALISATION:
+            self.parse_initialisation_line()
+
+    def raise_structure_error(self):
+        raise PtuStructureError("Unexpected scope at line %d: %s" % (self.line_num + 1, self.line.strip()))
+
+    def parse_user_code_line(self):
+        """
+        Same as extract_user_code_data function in classify_data.
+        """
+        line = self.line.strip()
+        conditions = self.conditions
+        if self.user_code is not None and self.user_code.conditions is conditions:
+            self.user_code.code += "\n" + line[1:]
+        else:
+            self.user_code = PtuWorkBook.UserCode()
+            self.user_code.code = line[1:]  # Remove '#'
+            self.user_code.conditions = conditions
+            self.workbook.user_code.append(self.user_code)
+
+    def parse_initialisation_line(self):
+        """
+        Same as extract_initialization_data function in classify_data.
+        """
+        line = self.line.strip()
+        if not line.startswith("#"):
+            return
+        conditions = self.conditions
+        if self.initialisation is not None and self.initialisation.conditions is conditions:
+            self.initialisation.description += "\n" + line.replace("#", "").strip()
+        else:
+            self.initialisation = PtuWorkBook.Initialisation()
+            self.initialisation.description += line[1:]
+            self.initialisation.conditions = conditions
+            self.workbook.initialisation.append(self.initialisation)
+
+    def start_environment(self):
+        self.environment = PtuWorkBook.Environment()
+        self.environment.name = self.line.replace("ENVIRONMENT ", "").strip()
+        self.scope_start = self.line_num
+        self.open_range()
+        self.scope = Keyword.ENVIRONMENT
+
+    def end_environment(self):
+        self.environment.conditions = self.get_conditions(self.scope_start, self.line_num)
+        self.workbook.environments.append(self.environment)
+        self.scope = Keyword.NONE
+
+    def start_define_stub(self):
+        self.define_stub = PtuWorkBook.DefineStub()
+        self.define_stub.name = self.line.replace("DEFINE STUB ", "").strip()
+        self.in_stub_scope = False
+        self.stub_scope_line = ""
+        self.scope_start = self.line_num
+        self.open_range()
+        self.scope = Keyword.DEFINE_STUB
+
+    def parse_define_stub_line(self):
+        """
+        Same as extract_stub_definitions_data function in classify_data.
+        """
+        line = self.line.strip()
+        if not line.startswith("#"):
+            return
+        line = line.replace("#", "")
+        line = line.strip()
+        if line.endswith(";") and not self.in_stub_scope:
+            stub = PtuWorkBook.Stub()
+            stub.conditions = self.conditions
+            stub.stub_definition = line.replace(";", "")
+            self.define_stub.stub_list.append(stub)
+        elif self.in_stub_scope:
+            self.stub_scope_line += "\n" + line
+            if "}" in line:
+                self.in_stub_scope = False
+                stub = PtuWorkBook.Stub()
+                stub.stub_definition = self.stub_scope_line
+                stub.conditions = self.get_conditions(self.stub_scope_start, self.line_num)
+                self.define_stub.stub_list.append(stub)
+                self.stub_scope_line = ""
+        else:
+            self.stub_scope_line += line
+            self.stub_scope_start = self.line_num
+            self.open_range()
+            self.in_stub_scope = True
+
+    def end_define_stub(self):
+        if self.in_stub_scope:
+            del self.open_ranges[self.stub_scope_start]  # Stub definition which is not ended is ignored
+        self.define_stub.conditions = self.get_conditions(self.scope_start, self.line_num)
+        self.workbook.stub_definitions.append(self.define_stub)
+        self.scope = Keyword.NONE
+
+    def start_service(self):
+        self.service = PtuWorkBook.Service()
+        self.service.name = self.line.replace("SERVICE ", "").strip()
+        self.service_start = self.line_num
+        self.service_has_test = False
+        self.open_range()
+        self.scope = Keyword.SERVICE
+
+    def parse_service_line(self):
+        """
+        Same as extract_services_data function in classify_data, for lines before the first test.
+        """
+        line = self.line
+        if line.startswith("#"):
+            user_code = PtuWorkBook.UserCode()
+            user_code.code += line[1:].strip()
+            user_code.conditions = self.conditions
+            self.service.user_code.append(user_code)
+        elif line.startswith("--"):
+            line = line.replace("--", "/* ") + " */"
+            user_code = PtuWorkBook.UserCode()
+            user_code.code += line.strip()
+            user_code.conditions = self.conditions
+            self.service.user_code.append(user_code)
+        elif line.startswith("USE"):
+            line = line.replace("USE", "")
+            self.service.use.append(line.strip())
+
+    def end_service(self):
+        self.service.conditions = self.get_conditions(self.service_start, self.line_num)
+        self.service.extend_use()
+        self.ended_service = self.service
+        self.scope = Keyword.NONE
+
+    def start_test(self):
+        self.test = PtuWorkBook.Test()
+        self.test_start = self.line_num
+        self.open_range()
+        self.scope = Keyword.TEST
+        self.parse_test_line()
+
+    def parse_test_line(self):
+        """
+        Same as extract_services_data function in classify_data, for lines of a test before its element.
+        """
+        line = self.line.strip()
+        if line.upper().startswith("TEST"):
+            self.test.name = line
+        elif line.upper().startswith("FAMILY"):
+            family = line.replace("FAMILY", "")
+            self.test.family = family.strip()
+        elif line.upper().startswith("COMMENT"):
+            comment = line.replace("COMMENT", "")
+            self.test.comment.append(comment.strip())
+        elif line.upper().startswith("USE"):
+            use = line.replace("USE", "")
+            self.test.use.append(use.strip())
+
+    def end_test(self):
+        self.test.element = self.element
+        self.test.conditions = self.get_conditions(self.test_start, self.line_num)
+        self.test.extend_use()
+        self.service.test_list.append(self.test)
+        self.service_has_test = True
+        self.scope = Keyword.SERVICE
+
+    def finish(self):
+        """
+        Saves data which are known at the end of file.
+        """
+        if self.if_conditions:
+            raise PtuStructureError("IF is not ended at the end of file")
+        if self.scope != Keyword.NONE:
+            raise PtuStructureError("Scope is not ended at the end of file")
+
+        save_preface_data(self.workbook.preface, self.preface_lines.get(Keyword.PURPOSE, ""),
+                          self.preface_lines.get(Keyword.PROCESSOR, ""), self.preface_lines.get(Keyword.TOOL_CHAIN, ""),
+                          self.preface_lines.get(Keyword.HEADER, ""))
+
+        # Only the last COMMENT START and the last COMMENT END are used, same as extract_comment_data function
+        for line_num, line in self.comment_lines:
+            if self.comment_start < line_num < self.comment_end:
+                line = line.replace("COMMENT ", "")
+                self.workbook.comment.append(line.strip())
@@ -0,0 +1,113 @@
+"""
+    This file includes a shared classifier for keywords of ptu files, used in other modules
+"""
+
+
+class Keyword:
+    """
+    Keywords which start a line of ptu file, as integer constants.
+    NONE is used for lines which don't start with any of keywords.
+    """
+
+    NONE = 0
+    IF = 1
+    ELSE = 2
+    END_IF = 3
+    SERVICE = 4
+    END_SERVICE = 5
+    TEST = 6
+    END_TEST = 7
+    ELEMENT = 8
+    END_ELEMENT = 9
+    INITIALISATION = 10
+    END_INITIALISATION = 11
+    ENVIRONMENT = 12
+    END_ENVIRONMENT = 13
+    DEFINE_STUB = 14
+    END_DEFINE = 15
+    COMMENT_START = 16
+    COMMENT_END = 17
+    HEADER = 18
+    INCLUDE = 19
+    PURPOSE = 20
+    PROCESSOR = 21
+    TOOL_CHAIN = 22
+    TEST_CASES = 23
+    USER_CODE = 24
+
+
+""" Keywords which are checked case-insensitive. Order is important, the first one that matches is chosen. """
+
+UPPER_CASE_KEYWORDS = [
+    ("IF", Keyword.IF),
+    ("ELSE", Keyword.ELSE),
+    ("ENDIF", Keyword.END_IF),
+    ("END IF", Keyword.END_IF),
+    ("SERVICE ", Keyword.SERVICE),
+    ("END SERVICE", Keyword.END_SERVICE),
+    ("TEST", Keyword.TEST),
+    ("END TEST", Keyword.END_TEST),
+    ("ELEMENT", Keyword.ELEMENT),
+    ("END ELEMENT", Keyword.END_ELEMENT),
+    ("INITIALISATION", Keyword.INITIALISATION),
+    ("END INITIALISATION", Keyword.END_INITIALISATION),
+    ("ENVIRONMENT", Keyword.ENVIRONMENT),
+    ("END ENVIRONMENT", Keyword.END_ENVIRONMENT),
+    ("DEFINE STUB", Keyword.DEFINE_STUB),
+    ("END DEFINE", Keyword.END_DEFINE),
+    ("COMMENT START", Keyword.COMMENT_START),
+    ("COMMENT END", Keyword.COMMENT_END),
+    ("HEADER", Keyword.HEADER),
+]
+
+""" Keywords which are checked case-sensitive. All of them start with '#' or '-'. """
+
+CASE_SENSITIVE_KEYWORDS = [
+    ("##include", Keyword.INCLUDE),
+    ("-- Purpose", Keyword.PURPOSE),
+    ("-- Processor", Keyword.PROCESSOR),
+    ("-- Tool chain", Keyword.TOOL_CHAIN),
+    ("-- Test Cases", Keyword.TEST_CASES),
+    ("#", Keyword.USER_CODE),
+]
+
+# Keywords are grouped by their first character, so most of lines are classified by a single dictionary lookup
+_keywords_by_first_char = {}
+for _text, _keyword in UPPER_CASE_KEYWORDS:
+    _keywords_by_first_char.setdefault(_text[0], []).append((_text, _keyword, True))
+    _keywords_by_first_char.setdefault(_text[0].lower(), []).append((_text, _keyword, True))
+for _text, _keyword in CASE_SENSITIVE_KEYWORDS:
+    _keywords_by_first_char.setdefault(_text[0], []).append((_text, _keyword, False))
+
+# upper() never makes a string shorter, so upper-casing this many characters is enough for matching any keyword
+_upper_case_prefix_len = max(len(text) for text, keyword in UPPER_CASE_KEYWORDS) + 1
+
+
+def classify_keyword(line):
+    """
+    Finds the keyword which the line starts with.
+    Result is the same as checking line.upper().startswith(...) for UPPER_CASE_KEYWORDS
+    and then line.startswith(...) for CASE_SENSITIVE_KEYWORDS, in order.
+    :param line: A stripped line of ptu file
+    :returns: One of Keyword constants
+    """
+    first_char = line[:1]
+    candidates = _keywords_by_first_char.get(first_char)
+    if candidates is None:
+        if first_char.isascii():
+            return Keyword.NONE
+        # Some non-ascii characters become ascii letters in upper case (e.g. dotless i)
+        candidates = _keywords_by_first_char.get(first_char.upper()[:1])
+        if candidates is None:
+            return Keyword.NONE
+
+    upper_line = None
+    for text, keyword, is_upper_case in candidates:
+        if is_upper_case:
+            if upper_line is None:
+                upper_line = line[:_upper_case_prefix_len].upper()
+            if upper_line.startswith(text):
+                return keyword
+        elif line.startswith(text):
+            return keyword
+    return Keyword.NONE
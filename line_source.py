@@ -0,0 +1,91 @@
+"""
+    This file includes a memory-mapped source of lines for large ptu files, used in other modules
+"""
+from array import array
+from locale import getpreferredencoding
+from mmap import mmap, ACCESS_READ
+import re
+
+NON_ASCII_PATTERN = re.compile(rb"[^\x00-\x7f]")
+
+
+class MappedLines:
+    """
+    Lines of a file which is mapped into memory, instead of being read into an array of strings.
+    Only offset of start of every line is kept (8 bytes per line), so memory does not grow much with file size.
+    A line is decoded whenever it is asked by its number, so random access by line number is still cheap.
+    Objects of this class can be used instead of array of lines (e.g. result of readlines):
+    len(lines), lines[num], lines[num] = "..." and iterating over lines are supported.
+    Lines are read the same as text mode of files: "\\r\\n" at the end of line is read as "\\n".
+    Only "\\n" is a line break, unlike text mode a single "\\r" doesn't end the line.
+    Lines which are changed are kept in memory, the file itself is never changed.
+    """
+
+    def __init__(self, file_path, encoding=None, errors="strict"):
+        """
+        :param file_path: path of file to be mapped
+        :param encoding: encoding of file (must be ascii compatible), None means default encoding of platform
+        :param errors: how decoding errors are handled, same as decode method of bytes
+        """
+        self.encoding = encoding if encoding is not None else getpreferredencoding(False)
+        self.errors = errors
+        self.changed_lines = {}  # Line number -> changed line
+
+        with open(file_path, "rb") as file_handler:
+            file_handler.seek(0, 2)
+            file_size = file_handler.tell()
+            if file_size > 0:
+                self.content = mmap(file_handler.fileno(), 0, access=ACCESS_READ)
+            else:
+                self.content = b""  # Empty files can't be mapped
+
+        # Offsets of start of lines, and end of the last line at the end
+        self.offsets = array("Q", [0])
+        find = self.content.find
+        offset = find(b"\n")
+        while offset != -1:
+            self.offsets.append(offset + 1)
+            offset = find(b"\n", offset + 1)
+        if self.offsets[-1] != file_size:
+            self.offsets.append(file_size)  # Last line doesn't end with a new line
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, line_num):
+        if line_num < 0:
+            line_num += len(self.offsets) - 1
+        changed_line = self.changed_lines.get(line_num)
+        if changed_line is not None:
+            return changed_line
+        if not 0 <= line_num < len(self.offsets) - 1:
+            raise IndexError("line number out of range")
+
+        line = self.content[self.offsets[line_num]:self.offsets[line_num + 1]].decode(self.encoding, self.errors)
+        if line.endswith("\r\n"):
+            line = line[:-2] + "\n"
+        return line
+
+    def __setitem__(self, line_num, line):
+        if line_num < 0:
+            line_num += len(self.offsets) - 1
+        if not 0 <= line_num < len(self.offsets) - 1:
+            raise IndexError("line number out of range")
+        self.changed_lines[line_num] = line
+
+    def __iter__(self):
+        for line_num in range(len(self.offsets) - 1):
+            yield self[line_num]
+
+    def is_ascii(self):
+        """
+        :returns: True if all of bytes of the file are ascii (lines which are changed are not checked)
+        """
+        return NON_ASCII_PATTERN.search(self.content) is None
+
+    def close(self):
+        """
+        Unmaps the file. Lines can't be read after closing.
+        """
+        if not isinstance(self.content, bytes):
+            self.content.close()
@@ -0,0 +1,591 @@
+"""
+    This file includes a binary format of extracted ptu files (PtuWorkBook objects), its read-only views and an
+    on-disk cache of them, used in other modules
+"""
+from os import path, makedirs, listdir, stat, remove, replace, utime, rmdir
+from array import array
+from mmap import mmap, ACCESS_READ
+import gc
+import hashlib
+import struct
+import sys
+from tempfile import mkstemp
+from weakref import finalize
+import constants as const
+from ptu_workbook import PtuWorkBook, ConditionTable
+from columnar_store import StringTable
+
+# Magic bytes, version of extraction, number of strings, length of encoded strings, number of integers of condition
+# sets, number of integers of data and number of services
+_HEADER = struct.Struct("<4sIIIIII")
+
+
+def _little_endian(values):
+    """
+    Arrays are saved in little-endian byte order, whatever the byte order of the platform is.
+    """
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def dump_workbook(workbook):
+    """
+    Converts a workbook into a compact binary format, instead of pickling the nested objects.
+    Every distinct string is saved once (in a table of strings), and all of the workbook is saved as a flat array
+    of 32-bit integers (IDs of strings, IDs of condition sets and lengths of arrays) in a fixed order.
+    Offset of every service in the array is saved too, so a service can be read without reading the others
+    (see WorkBookReader class). Large values of test cases (LazyValue objects) are saved as strings.
+    :param workbook: Object of PtuWorkBook class (services must not be a LazyServiceList, otherwise all of them
+                     are extracted)
+    :returns: Content of the binary format (bytes), which is read by load_workbook function
+    """
+    strings = StringTable()
+    condition_sets = ConditionTable()
+    for condition_set in workbook.condition_sets.condition_sets:  # IDs of condition sets are kept
+        condition_sets.get(condition_set)
+    ints = array("i")
+    append = ints.append
+    add_string = strings.add
+
+    def write_conditions(conditions):
+        append(condition_sets.get(conditions).id)
+
+    def write_strings(values):
+        append(len(values))
+        for value in values:
+            append(add_string(value))
+
+    def write_user_code(user_code_list):
+        append(len(user_code_list))
+        for user_code in user_code_list:
+            write_conditions(user_code.conditions)
+            append(add_string(user_code.code))
+
+    def write_stubs(stubs):
+        append(len(stubs))
+        for stub in stubs:
+            write_conditions(stub.conditions)
+            append(add_string(stub.stub_definition))
+
+    def write_test_cases(test_cases):
+        append(len(test_cases))
+        for test_case in test_cases:
+            write_conditions(test_case.conditions)
+            append(add_string(test_case.param_type))
+            append(add_string(test_case.param_name))
+            append(add_string(str(test_case.init)))  # Value may be a LazyValue object
+            append(add_string(str(test_case.ev)))
+
+    # Arrays are read from their slots, so empty arrays are not allocated in the workbook (see LazyAttribute)
+    preface = workbook.preface
+    header = preface.header
+    write_strings([workbook.name, preface.purpose, preface.processor, preface.tool_chain, header.module_name,
+                   header.module_version, header.test_plan_version])
+    write_strings(workbook.include)
+    write_strings(workbook.comment)
+    write_user_code(workbook.user_code)
+
+    append(len(workbook.stub_definitions))
+    for define_stub in workbook.stub_definitions:
+        write_conditions(define_stub.conditions)
+        append(add_string(define_stub.name))
+        write_stubs(define_stub._stub_list or ())
+
+    append(len(workbook.initialisation))
+    for initialisation in workbook.initialisation:
+        write_conditions(initialisation.conditions)
+        append(add_string(initialisation.description))
+
+    append(len(workbook.environments))
+    for environment in workbook.environments:
+        write_conditions(environment.conditions)
+        append(add_string(environment.name))
+        write_test_cases(environment._test_case_list or ())
+
+    service_offsets = array("I")  # Index of start of every service in ints
+    for service in workbook.services:
+        service_offsets.append(len(ints))
+        write_conditions(service.conditions)
+        append(add_string(service.name))
+        write_user_code(service._user_code or ())
+        write_strings(service._use or ())
+        test_list = service._test_list or ()
+        append(len(test_list))
+        for test in test_list:
+            write_conditions(test.conditions)
+            append(add_string(test.name))
+            append(add_string(test.family))
+            write_strings(test._comment or ())
+            write_strings(test._use or ())
+            element = test.element
+            write_strings(element._own_use or ())  # USEs of test and service are shared again when it is loaded
+            write_test_cases(element._input_data or ())
+            write_test_cases(element._calibrations or ())
+            write_test_cases(element._output_data or ())
+            write_stubs(element._stub_calls or ())
+            write_user_code(element._user_code or ())
+
+    # Condition sets are saved before the data, as arrays of IDs of their conditions
+    condition_ints = array("i", [len(condition_sets)])
+    for condition_set in condition_sets.condition_sets:
+        condition_ints.append(len(condition_set))
+        condition_ints.extend(add_string(condition) for condition in condition_set)
+
+    text = "".join(strings.strings)
+    lengths = array("I", [len(string) for string in strings.strings])  # Lengths in characters
+    encoded_text = text.encode("utf-8", "surrogatepass")
+    padding = b"\0" * (-len(encoded_text) % 4)  # So arrays after text are aligned to 4 bytes
+    return b"".join([_HEADER.pack(const.PARSE_CACHE_MAGIC, const.EXTRACT_VERSION, len(lengths), len(encoded_text),
+                                  len(condition_ints), len(ints), len(service_offsets)),
+                     _little_endian(lengths).tobytes(), encoded_text, padding,
+                     _little_endian(condition_ints).tobytes(), _little_endian(ints).tobytes(),
+                     _little_endian(service_offsets).tobytes()])
+
+
+def load_workbook(content, condition_table=None):
+    """
+    Reads a workbook which is converted by dump_workbook function.
+    Garbage collector is paused while loading, because objects are only made (not freed) in the meantime.
+    :param content: Content of the binary format (bytes)
+    :param condition_table: If given (object of ConditionTable class), condition sets are added to this table
+                            (in order of their IDs) and used by the workbook, instead of a new table
+    :returns: Object of PtuWorkBook class, or None if content is not written by this version of extraction
+    """
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        reader = WorkBookReader(content, condition_table)
+        if not reader.is_valid:
+            return None
+        return reader.read_workbook()
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _make_record_readers(next_int, strings, condition_sets):
+    """
+    :param next_int: Function which gives the next integer of data
+    :param strings: Table of strings (ID -> string)
+    :param condition_sets: Table of condition sets (ID -> ConditionSet)
+    :returns: Tuple of functions which read arrays of strings, user-codes, stubs and test cases, and a service
+    """
+
+    def read_strings():
+        return [strings[next_int()] for _ in range(next_int())]
+
+    def read_user_code():
+        user_code_list = []
+        for _ in range(next_int()):
+            user_code = PtuWorkBook.UserCode()
+            user_code.conditions = condition_sets[next_int()]
+            user_code.code = strings[next_int()]
+            user_code_list.append(user_code)
+        return user_code_list or None
+
+    def read_stubs():
+        stubs = []
+        for _ in range(next_int()):
+            stub = PtuWorkBook.Stub()
+            stub.conditions = condition_sets[next_int()]
+            stub.stub_definition = strings[next_int()]
+            stubs.append(stub)
+        return stubs or None
+
+    def read_test_cases():
+        test_cases = []
+        new_test_case = PtuWorkBook.TestCase
+        for _ in range(next_int()):
+            test_case = new_test_case()
+            test_case.conditions = condition_sets[next_int()]
+            test_case.param_type = strings[next_int()]
+            test_case.param_name = strings[next_int()]
+            test_case.init = strings[next_int()]
+            test_case.ev = strings[next_int()]
+            test_cases.append(test_case)
+        return test_cases or None
+
+    def read_service():
+        service = PtuWorkBook.Service()
+        service.conditions = condition_sets[next_int()]
+        service.name = strings[next_int()]
+        service._user_code = read_user_code()
+        service._use = read_strings() or None
+        test_list = []
+        for _ in range(next_int()):
+            test = PtuWorkBook.Test()
+            test.conditions = condition_sets[next_int()]
+            test.name = strings[next_int()]
+            test.family = strings[next_int()]
+            test._comment = read_strings() or None
+            test._use = read_strings() or None
+            element = PtuWorkBook.Element()
+            element._own_use = read_strings() or None
+            element._input_data = read_test_cases()
+            element._calibrations = read_test_cases()
+            element._output_data = read_test_cases()
+            element._stub_calls = read_stubs()
+            element._user_code = read_user_code()
+            test.element = element
+            test.extend_use()
+            test_list.append(test)
+        service._test_list = test_list or None
+        service.extend_use()
+        return service
+
+    return read_strings, read_user_code, read_stubs, read_test_cases, read_service
+
+
+class WorkBookReader:
+    """
+    Reads a workbook from the binary format of dump_workbook function, part by part.
+    Arrays of integers are used in place (content is not copied, except on big-endian platforms),
+    so content may be a memory-mapped file, and a single service can be read without reading the others.
+    """
+
+    def __init__(self, content, condition_table=None):
+        """
+        :param content: Content of the binary format (bytes, mmap or any other object with buffer protocol)
+        :param condition_table: If given (object of ConditionTable class), condition sets are added to this table,
+                                otherwise to a new table
+        """
+        self.condition_table = condition_table if condition_table is not None else ConditionTable()
+        self.strings = []  # ID of string in content -> string
+        self.condition_sets = []  # ID of condition set in content -> ConditionSet
+        self.ints = None  # Integers of data, a memoryview of content
+        self.service_offsets = None  # Index of start of every service in ints
+        self.views = []  # Memoryviews of content, which must be released before content is closed
+
+        magic, version, string_count, text_size, condition_int_count, int_count, service_count = \
+            _HEADER.unpack_from(content)
+        self.is_valid = magic == const.PARSE_CACHE_MAGIC and version == const.EXTRACT_VERSION
+        if not self.is_valid:
+            return
+
+        offset = _HEADER.size
+        lengths = self.get_array(content, offset, "I", string_count)
+        offset += 4 * string_count
+        text = bytes(content[offset:offset + text_size]).decode("utf-8", "surrogatepass")
+        offset += text_size + (-text_size % 4)
+        condition_ints = self.get_array(content, offset, "i", condition_int_count)
+        offset += 4 * condition_int_count
+        self.ints = self.get_array(content, offset, "i", int_count)
+        offset += 4 * int_count
+        self.service_offsets = self.get_array(content, offset, "I", service_count)
+
+        start = 0
+        for length in lengths:
+            self.strings.append(text[start:start + length])
+            start += length
+
+        next_int = iter(condition_ints).__next__
+        for _ in range(next_int()):
+            condition_count = next_int()
+            self.condition_sets.append(self.condition_table.get(tuple([self.strings[next_int()]
+                                                                       for _ in range(condition_count)])))
+
+    def get_array(self, content, offset, typecode, count):
+        """
+        :returns: Array of integers in content, as a memoryview (or a copy of them on big-endian platforms)
+        """
+        if count == 0:
+            return array(typecode)
+        if sys.byteorder == "big":
+            values = array(typecode)
+            values.frombytes(content[offset:offset + 4 * count])
+            values.byteswap()
+            return values
+        view = memoryview(content)
+        self.views.append(view)
+        values = view[offset:offset + 4 * count].cast(typecode)
+        self.views.append(values)
+        return values
+
+    def get_service_count(self):
+        return len(self.service_offsets)
+
+    def read_workbook(self, with_services=True):
+        """
+        :param with_services: If False, services are not read
+        :returns: Object of PtuWorkBook class
+        """
+        workbook = PtuWorkBook()
+        workbook.condition_sets = self.condition_table
+        strings = self.strings
+        condition_sets = self.condition_sets
+        next_int = iter(self.ints).__next__
+        read_strings, read_user_code, read_stubs, read_test_cases, read_service = \
+            _make_record_readers(next_int, strings, condition_sets)
+
+        preface = workbook.preface
+        header = preface.header
+        (workbook.name, preface.purpose, preface.processor, preface.tool_chain, header.module_name,
+         header.module_version, header.test_plan_version) = read_strings()
+        workbook.include = read_strings()
+        workbook.comment = read_strings()
+        workbook.user_code = read_user_code() or []
+
+        for _ in range(next_int()):
+            define_stub = PtuWorkBook.DefineStub()
+            define_stub.conditions = condition_sets[next_int()]
+            define_stub.name = strings[next_int()]
+            define_stub._stub_list = read_stubs()
+            workbook.stub_definitions.append(define_stub)
+
+        for _ in range(next_int()):
+            initialisation = PtuWorkBook.Initialisation()
+            initialisation.conditions = condition_sets[next_int()]
+            initialisation.description = strings[next_int()]
+            workbook.initialisation.append(initialisation)
+
+        for _ in range(next_int()):
+            environment = PtuWorkBook.Environment()
+            environment.conditions = condition_sets[next_int()]
+            environment.name = strings[next_int()]
+            environment._test_case_list = read_test_cases()
+            workbook.environments.append(environment)
+
+        if with_services:
+            for _ in range(self.get_service_count()):  # Services are saved one after another
+                workbook.services.append(read_service())
+        return workbook
+
+    def read_service(self, index):
+        """
+        :param index: Index of service
+        :returns: Object of PtuWorkBook.Service class
+        """
+        next_int = iter(self.ints[self.service_offsets[index]:]).__next__
+        return _make_record_readers(next_int, self.strings, self.condition_sets)[-1]()
+
+    def release(self):
+        """
+        Releases memoryviews of content, so content can be closed. Data can't be read after releasing.
+        """
+        for view in reversed(self.views):
+            view.release()
+        self.views = []
+
+
+class ServiceViewList:
+    """
+    Services of a WorkBookView, every service is read from content whenever it is asked (it is a new object then).
+    Objects of this class can be used instead of array of services:
+    len(services), services[num] and iterating over services are supported.
+    """
+
+    def __init__(self, reader):
+        """
+        :param reader: Object of WorkBookReader class
+        """
+        self.reader = reader
+
+    def __len__(self):
+        return self.reader.get_service_count()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("service index out of range")
+        return self.reader.read_service(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def _close_view(reader, content, file_path, directory):
+    """
+    Unmaps the file of a WorkBookView, and removes the file and its directory (see close method of WorkBookView).
+    :param file_path: Path of the file to be removed, None if it must not be removed (or is already removed)
+    :param directory: Directory to be removed if it is empty, or None
+    """
+    reader.release()
+    content.close()
+    if file_path is not None:
+        remove(file_path)
+    if directory is not None:
+        try:
+            rmdir(directory)
+        except OSError:
+            pass  # Other files are still in the directory, it is removed when the last of them is closed
+
+
+class WorkBookView:
+    """
+    A read-only workbook, which is saved in a file in the binary format of dump_workbook function.
+    The file is mapped into memory, so it is neither copied nor unpickled. Data of the ptu file (e.g. preface,
+    includes and environments) is read when it is opened, and services are read when they are used (see
+    ServiceViewList class). Objects of this class can be used instead of PtuWorkBook objects for reading data.
+    Views should be closed when they are not used (or used in a with statement), otherwise they are closed
+    when they are garbage collected.
+    """
+
+    def __init__(self, file_path, remove_file=False, directory=None):
+        """
+        :param file_path: Path of the file
+        :param remove_file: If True, the file is removed as soon as possible (when it is mapped, or when it is closed
+                            on platforms which can't remove mapped files)
+        :param directory: If given, this directory (e.g. a temporary directory of the file) is removed when the view
+                          is closed, if it is empty then
+        """
+        self.file_path = file_path
+        with open(file_path, "rb") as file_handler:
+            self.content = mmap(file_handler.fileno(), 0, access=ACCESS_READ)
+        self.reader = WorkBookReader(self.content)
+        if remove_file:
+            try:
+                remove(file_path)
+                remove_file = False
+            except OSError:
+                pass  # Removed when it is closed
+        self.finalizer = finalize(self, _close_view, self.reader, self.content, file_path if remove_file else None,
+                                  directory)
+        if not self.reader.is_valid:
+            self.close()
+            raise ValueError("%s is not written by this version of extraction" % file_path)
+
+        workbook = self.reader.read_workbook(with_services=False)
+        self.name = workbook.name
+        self.preface = workbook.preface
+        self.include = workbook.include
+        self.comment = workbook.comment
+        self.user_code = workbook.user_code
+        self.stub_definitions = workbook.stub_definitions
+        self.initialisation = workbook.initialisation
+        self.environments = workbook.environments
+        self.services = ServiceViewList(self.reader)
+        self.condition_sets = workbook.condition_sets
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Unmaps the file (and removes it and its directory, if asked). Services can't be read after closing.
+        Closing a view more than once does nothing.
+        """
+        self.finalizer()
+
+
+class ParseCache:
+    """
+    Cache of extracted ptu files in a directory, so a ptu file which has not changed is not extracted again.
+    Every workbook is saved in a file (see dump_workbook function), named by hash of content of ptu file,
+    encoding and version of extraction. Total size of files is limited, the least recently used ones are removed.
+    Numbers of hits and misses are counted, so the cache can be checked (see get_stats method).
+    """
+
+    def __init__(self, directory, max_size=const.PARSE_CACHE_MAX_SIZE):
+        """
+        :param directory: Directory of files of cache, it is created if it doesn't exist
+        :param max_size: Maximum total size of files of cache in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if not path.exists(directory):
+            makedirs(directory)
+
+    def get_key(self, file_path, encoding=None, binary=False):
+        """
+        :param binary: True if ptu file is extracted without decoding its lines (see binary of open_ptu)
+        :returns: Key of the ptu file in cache, which changes whenever content of file or extraction changes
+        """
+        content_hash = hashlib.sha256()
+        content_hash.update(("%d %s%s\n" % (const.EXTRACT_VERSION, encoding, " binary" if binary else "")).encode())
+        with open(file_path, "rb") as file_handler:
+            for chunk in iter(lambda: file_handler.read(1 << 20), b""):
+                content_hash.update(chunk)
+        return content_hash.hexdigest()
+
+    def get_file_path(self, key):
+        """
+        :returns: Path of the file of this key, in directory of cache (where save writes it and evict finds it)
+        """
+        return path.join(self.directory, key + const.PARSE_CACHE_EXTENSION)
+
+    def load(self, key):
+        """
+        :returns: Object of PtuWorkBook class saved with this key, or None if it is not in cache
+        """
+        file_path = self.get_file_path(key)
+        try:
+            with open(file_path, "rb") as cache_file:
+                workbook = load_workbook(cache_file.read())
+        except (OSError, struct.error, StopIteration, IndexError, TypeError, ValueError):  # Missing or broken file
+            workbook = None
+        if workbook is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            utime(file_path)  # Modification time is used as time of last use, for removing the least recently used
+        except OSError:
+            pass
+        return workbook
+
+    def save(self, key, workbook):
+        """
+        Saves the workbook with this key, then removes the least recently used files if cache is too large.
+        Workbook is written into a temporary file first, so an interrupted run does not leave a broken file.
+        Temporary file has a unique name, because several processes may save the same ptu file at the same time.
+        """
+        file_path = self.get_file_path(key)
+        file_handler, temp_path = mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with open(file_handler, "wb") as cache_file:
+                cache_file.write(dump_workbook(workbook))
+            try:
+                replace(temp_path, file_path)
+            except PermissionError:
+                # File of this key is being read by another process (on Windows), it has the same content anyway
+                remove(temp_path)
+        except BaseException:
+            if path.exists(temp_path):
+                remove(temp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used files until total size of cache is not more than max_size.
+        Files which are removed by another process at the same time are skipped.
+        """
+        entries = []  # Tuples of (time of last use, size, file path)
+        for file_name in listdir(self.directory):
+            if file_name.endswith(const.PARSE_CACHE_EXTENSION):
+                file_path = path.join(self.directory, file_name)
+                try:
+                    file_stat = stat(file_path)
+                except FileNotFoundError:
+                    continue
+                entries.append((file_stat.st_mtime_ns, file_stat.st_size, file_path))
+        total_size = sum(size for last_use, size, file_path in entries)
+        entries.sort()
+        for last_use, size, file_path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                remove(file_path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def get_stats(self):
+        """
+        :returns: Dictionary of numbers of hits, misses and evictions, and hit rate (0 if cache has not been used)
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
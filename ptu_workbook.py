@@ -0,0 +1,398 @@
+"""
+    This file includes data classes of extracted ptu files (PtuWorkBook), used in extract_data and other modules
+"""
+
+
+class LazyAttribute:
+    """
+    An attribute of data classes (see PtuWorkBook), which is not allocated until it is used.
+    Objects have lots of empty lists (e.g. most of elements have no stubs), so they are not allocated for every object.
+    Value is kept in a slot with the same name starting with '_', which is None until the attribute is read or set.
+    """
+
+    def __init__(self, factory=list):
+        """
+        :param factory: Function which makes the initial value of attribute (an empty list by default)
+        """
+        self.factory = factory
+        self.slot = None
+
+    def __set_name__(self, owner, name):
+        self.slot = owner.__dict__["_" + name]
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = self.slot.__get__(instance, owner)
+        if value is None:
+            value = self.factory()
+            self.slot.__set__(instance, value)
+        return value
+
+    def __set__(self, instance, value):
+        self.slot.__set__(instance, value)
+
+
+class ConditionSet(tuple):
+    """
+    Conditions (of IF-scopes) of data in ptu file, as an immutable tuple of strings.
+    Condition sets are interned in a ConditionTable, so the same conditions are a single object in a workbook
+    and can be compared by their ID. Conditions joined by ',' are saved once in "joined" attribute.
+    """
+
+    def __new__(cls, conditions, set_id):
+        """
+        :param conditions: Array of conditions
+        :param set_id: ID of condition set in its ConditionTable
+        """
+        condition_set = tuple.__new__(cls, conditions)
+        condition_set.id = set_id
+        condition_set.joined = ",".join(condition_set)
+        return condition_set
+
+    def __getnewargs__(self):
+        return tuple(self), self.id
+
+
+NO_CONDITIONS = ConditionSet((), 0)  # Condition set of data which is not inside any IF-scope, the first one in every table
+
+
+class ConditionTable:
+    """
+    Table of all of condition sets in a workbook, every condition set is saved once and is given an integer ID.
+    """
+
+    def __init__(self):
+        self.condition_sets = [NO_CONDITIONS]  # ID -> ConditionSet
+        self.ids = {NO_CONDITIONS: NO_CONDITIONS}  # Conditions (tuple) -> ConditionSet
+
+    def __len__(self):
+        return len(self.condition_sets)
+
+    def __getitem__(self, set_id):
+        return self.condition_sets[set_id]
+
+    def get(self, conditions):
+        """
+        :param conditions: Array or tuple of conditions (e.g. a ConditionSet of another table)
+        :returns: The ConditionSet with these conditions, it is added to the table if it is not in the table
+        """
+        if not isinstance(conditions, tuple):
+            conditions = tuple(conditions)
+        condition_set = self.ids.get(conditions)
+        if condition_set is None:
+            condition_set = ConditionSet(conditions, len(self.condition_sets))
+            self.ids[condition_set] = condition_set
+            self.condition_sets.append(condition_set)
+        return condition_set
+
+    def find(self, conditions):
+        """
+        :param conditions: Array or tuple of conditions
+        :returns: The ConditionSet with these conditions, or None if it is not in the table
+        """
+        return self.ids.get(conditions if isinstance(conditions, tuple) else tuple(conditions))
+
+
+class PtuWorkBook:
+    """
+    This class contains all of data in a ptu file in form of subclasses
+    Attributes will be used to show in excel file, or convert to another format
+    Subclasses use __slots__ and LazyAttribute, because there may be millions of their objects (e.g. TestCase)
+    """
+
+    def __init__(self):
+        self.name = ""
+        self.preface = self.Preface()
+        self.include = []
+        self.comment = []
+        self.user_code = []  # Array of UserCode objects
+        self.stub_definitions = []  # Array of DefineStub objects
+        self.initialisation = []  # Array of Initialisation objects
+        self.environments = []  # Array of Environment objects
+        self.services = []  # Array of Service objects, or LazyServiceList (see open_ptu)
+        self.condition_sets = ConditionTable()  # Conditions of all of data in workbook
+
+    class Preface:
+        """
+        This subclass contains initial data about ptu file
+        """
+
+        __slots__ = ("purpose", "processor", "tool_chain", "header")
+
+        def __init__(self):
+            self.purpose = ""
+            self.processor = ""
+            self.tool_chain = ""
+            self.header = self.Header()
+
+        class Header:
+            """
+            This subclass contains important datarmation mentioned in header file.
+            This datarmation is used in Preface(superclass) as an attribute.
+            """
+
+            __slots__ = ("module_name", "module_version", "test_plan_version")
+
+            def __init__(self):
+                self.module_name = ""
+                self.module_version = ""
+                self.test_plan_version = ""
+
+    class UserCode:
+        """
+        UserCode can appear anywhere in ptu file
+        So this subclass is used in PtuWorkBook(superclass) , Service and Element class for better grouping
+        All UserCode lines start with '#'
+        """
+
+        __slots__ = ("conditions", "code")
+
+        def __init__(self):
+            self.conditions = NO_CONDITIONS
+            self.code = ""
+
+    class Stub:
+        """
+        STUB instruction describes all calls to a simulated function in a test script.
+        This class is used in ELEMENT and DefineStub classes.
+        """
+
+        __slots__ = ("conditions", "stub_definition")
+
+        def __init__(self):
+            self.conditions = NO_CONDITIONS
+            self.stub_definition = ""
+
+    class DefineStub:
+        """
+        DEFINE STUB instructions are optional and has a scope in format: "DEFINE STUB ... END DEFINE"
+        The DEFINE STUB and END DEFINE instructions delimit a simulation block
+        consisting of stub definition functions, methods, or procedure declarations.
+        """
+
+        __slots__ = ("name", "_stub_list", "conditions")
+        stub_list = LazyAttribute()  # Array of Stub objects
+
+        def __init__(self):
+            self.name = ""
+            self._stub_list = None
+            self.conditions = NO_CONDITIONS
+
+    class Initialisation:
+        """
+        Initialisation in ptu files is optional.
+        Initialisation has a scope in format: "INITIALISATION ... END INITIALISATION"
+        Content of initialisation is saved in "description" attribute.
+        """
+
+        __slots__ = ("conditions", "description")
+
+        def __init__(self):
+            self.conditions = NO_CONDITIONS
+            self.description = ""
+
+    class TestCase:
+        """
+        TestCases appear in ENVIRONMENT and ELEMENT classes.
+        In every test case, there is a parameter that is being tested.
+        This parameter has type, name, initial and expected value.
+        """
+
+        __slots__ = ("conditions", "param_type", "param_name", "init", "ev")
+
+        def __init__(self):
+            self.conditions = NO_CONDITIONS
+            self.param_type = ""
+            self.param_name = ""
+            self.init = ""
+            self.ev = ""
+
+    class Environment:
+        """
+        ENVIRONMENT instruction defines a test environment declaration in ptu files.
+        ENVIRONMENT has a scope in format: "ENVIRONMENT ... END ENVIRONMENT"
+        All of test cases are saved in an array of TestCase objects, named "test_case_list"
+        """
+
+        __slots__ = ("name", "_test_case_list", "conditions")
+        test_case_list = LazyAttribute()  # Array of TestCase objects
+
+        def __init__(self):
+            self.name = ""
+            self._test_case_list = None
+            self.conditions = NO_CONDITIONS
+
+    class Service:
+        """
+        Services are functions that are being tested.
+        Every Service consists of several tests and every test consist of an element.
+        These tests are saved in an array, named "test_list", in format of TEST objects.
+        Every service may use several environments, which are saved in "use" array.
+        """
+
+        __slots__ = ("name", "_test_list", "conditions", "_user_code", "_use")
+        test_list = LazyAttribute()  # Array of Test objects
+        user_code = LazyAttribute()  # Array of UserCode objects
+        use = LazyAttribute()  # Array of strings (USEs)
+
+        def __init__(self):
+            self.name = ""
+            self._test_list = None
+            self.conditions = NO_CONDITIONS
+            self._user_code = None
+            self._use = None
+
+        def has_user_code(self):
+            """
+            :return: True if Service has any user-code(itself or its tests), False if not
+            """
+            if self._user_code:
+                return True
+            for test in self.test_list:
+                if test.element._user_code:
+                    return True
+            return False
+
+        def extend_use(self):
+            """
+            Every USE in a service belongs to all of elements in its sub-tests.
+            This function shares USEs of service with all of the elements in its sub-tests.
+            USEs are not copied, every element only keeps a reference to the "use" array of service.
+            """
+            if not self._use:  # Empty lists of elements are not allocated for nothing
+                return
+            inherited_use = (self._use,)  # Shared by all of elements which don't inherit USEs of their test
+            for test in self.test_list:
+                element = test.element
+                if element.inherited_use:
+                    element.inherited_use += inherited_use
+                else:
+                    element.inherited_use = inherited_use
+
+        def get_all_user_code(self):
+            """
+            :return: All of the user-code of this service in form of one string.
+            """
+            all_user_code = [u.code for u in self.user_code]
+            return "\n".join(all_user_code)
+
+    class Element:
+        """
+        Every Test of every service, consists of one element.
+        All of parameters that are going to be tested in a particiular TEST, are in element in 3 formats:
+        Input-data, Output-data, Calibrations. All of these are objects of TestCase Class.
+        USEs of element itself are saved in "own_use" array, "use" gives all of USEs of element including USEs of
+        its test and service (see get_all_use method), which is read-only.
+        """
+
+        __slots__ = ("_own_use", "inherited_use", "_input_data", "_calibrations", "_output_data", "_stub_calls",
+                     "_user_code")
+        own_use = LazyAttribute()  # Array of strings (USEs of element itself)
+        input_data = LazyAttribute()  # Array of TestCase objects
+        calibrations = LazyAttribute()  # Array of TestCase objects
+        output_data = LazyAttribute()  # Array of TestCase objects
+        stub_calls = LazyAttribute()  # Array of Stub objects
+        user_code = LazyAttribute()  # Array of UserCode objects
+
+        def __init__(self):
+            self._own_use = None
+            self.inherited_use = ()  # Tuple of "use" arrays of test and service, which are shared with them
+            self._input_data = None
+            self._calibrations = None
+            self._output_data = None
+            self._stub_calls = None
+            self._user_code = None
+
+        def get_all_data(self):
+            """
+            :return: All of test-cases including input-data, output-data, and calibrations.
+            """
+            return (self._input_data or []) + (self._calibrations or []) + (self._output_data or [])
+
+        def get_all_use(self):
+            """
+            :return: All of USEs of element, including USEs of its test and service, as a read-only UseView.
+            """
+            if not self.inherited_use:
+                return UseView((self._own_use,) if self._own_use else ())
+            return UseView(((self._own_use,) if self._own_use else ()) + self.inherited_use)
+
+        @property
+        def use(self):
+            """
+            :return: All of USEs of element, the same as get_all_use method (USEs are added into own_use array).
+            """
+            return self.get_all_use()
+
+    class Test:
+        """
+        Every Service consists of several tests.
+        There is a single element in every test.
+        """
+
+        __slots__ = ("name", "family", "_comment", "_use", "_element", "conditions")
+        comment = LazyAttribute()
+        use = LazyAttribute()
+        element = LazyAttribute(lambda: PtuWorkBook.Element())
+
+        def __init__(self):
+            self.name = ""
+            self.family = ""
+            self._comment = None
+            self._use = None
+            self._element = None
+            self.conditions = NO_CONDITIONS
+
+        def extend_use(self):
+            """
+            Every USE in a test belongs to all of its sub-elements.
+            This function shares USEs of test with its element, the "use" array of test is not copied.
+            """
+            if self._use:
+                self.element.inherited_use += (self._use,)
+
+
+class UseView:
+    """
+    A read-only view of several arrays of USEs (of an element, its test and its service), one after another.
+    Arrays are not copied, so changes of them are seen in the view.
+    Objects of this class can be used instead of an array of USEs:
+    len(view), view[num], "..." in view and iterating over view are supported, list(view) gives a flat array.
+    """
+
+    __slots__ = ("use_lists",)
+
+    def __init__(self, use_lists):
+        """
+        :param use_lists: Tuple of arrays of strings (USEs), in order
+        """
+        self.use_lists = use_lists
+
+    def __len__(self):
+        return sum(len(use_list) for use_list in self.use_lists)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index >= 0:
+            for use_list in self.use_lists:
+                if index < len(use_list):
+                    return use_list[index]
+                index -= len(use_list)
+        raise IndexError("use index out of range")
+
+    def __iter__(self):
+        for use_list in self.use_lists:
+            yield from use_list
+
+    def __contains__(self, use):
+        return any(use in use_list for use_list in self.use_lists)
+
+    def __eq__(self, other):
+        if isinstance(other, UseView):
+            other = list(other)
+        return list(self) == other
+
+    def __repr__(self):
+        return "UseView(%r)" % list(self)
@@ -1,5 +1,15 @@
-from os import path, makedirs
+from os import path, makedirs, listdir, cpu_count, stat, remove, replace
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from array import array
+from bisect import bisect_left, bisect_right
+from time import perf_counter
+import argparse
+import hashlib
+import json
+import struct
 import constants as const
+from keywords import Keyword, classify_keyword
 
 
 class Line:
@@ -14,6 +24,103 @@ class Line:
         self.new_line_num = new_line_num
 
 
+class RefineResult:
+    """
+    Objects of this class contain result of refining a single ptu file:
+    name of file, status of refining (see constants), error message (if any) and time spent in seconds.
+    Errors in scopes which are repaired are saved in diagnostics (objects of ScopeDiagnostic class).
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.status = const.REFINE_OK
+        self.error = ""
+        self.time = 0.0
+        self.diagnostics = []
+        self.manifest_entry = None  # Saved in manifest of refined files, if hashes are asked in refine_file function
+
+
+class LineMap:
+    """
+    Objects of this class map number of every line in new file to number of the same line in ptu file.
+    Lines of new file are copied from ptu file in order, only some comments are omitted and some ENDIFs are added.
+    So the map is saved as runs of consecutive lines: new_starts[i] in new file is old_starts[i] in ptu file,
+    and the next lines of new file are the next lines of ptu file, until the next run starts.
+    Added ENDIFs get number of the line they are written before, so each of them is a run of its own.
+    """
+
+    def __init__(self):
+        self.new_starts = array("I")  # Number of first line of every run in new file
+        self.old_starts = array("I")  # Number of first line of every run in ptu file
+        self.line_count = 0  # Number of lines in new file
+
+    def add_line(self, old_line_num):
+        """
+        Adds the next line of new file to the map.
+        :param old_line_num: number of the line in ptu file
+        """
+        if not self.old_starts or old_line_num != self.old_starts[-1] + (self.line_count - self.new_starts[-1]):
+            self.new_starts.append(self.line_count)
+            self.old_starts.append(old_line_num)
+        self.line_count += 1
+
+    def insert_lines(self, inserted_lines):
+        """
+        Inserts lines into the map, which are added into new file after it is written (see insert_missing_endifs).
+        :param inserted_lines: Array of inserted lines (objects of Line class), in order of their new_line_num,
+                               which is number of the line in new file (without inserted lines) they are inserted before
+        """
+        runs = list(zip(self.new_starts, self.old_starts, self.new_starts[1:] + array("I", [self.line_count])))
+        self.new_starts = array("I")
+        self.old_starts = array("I")
+        self.line_count = 0
+        inserted = iter(inserted_lines)
+        inserted_line = next(inserted, None)
+        for new_start, old_start, new_end in runs:
+            for new_line_num in range(new_start, new_end):
+                while inserted_line is not None and inserted_line.new_line_num == new_line_num:
+                    self.add_line(inserted_line.old_line_num)
+                    inserted_line = next(inserted, None)
+                self.add_line(old_start + (new_line_num - new_start))
+
+    def get_old_line_num(self, new_line_num):
+        """
+        Finds number of a line of new file in ptu file, by binary search on runs.
+        :param new_line_num: number of the line in new file (starting from 0, same as Line class)
+        :returns: number of the line in ptu file (starting from 0)
+        """
+        if not 0 <= new_line_num < self.line_count:
+            raise IndexError("Line %d is not in new file with %d lines" % (new_line_num, self.line_count))
+        run = bisect_right(self.new_starts, new_line_num) - 1
+        return self.old_starts[run] + (new_line_num - self.new_starts[run])
+
+    def save(self, file_path):
+        """
+        Writes the map into a binary file: number of lines and number of runs, then new_starts and old_starts.
+        All of numbers are unsigned 32-bit little-endian integers.
+        """
+        with open(file_path, "wb") as map_file:
+            map_file.write(struct.pack("<II", self.line_count, len(self.new_starts)))
+            for starts in (self.new_starts, self.old_starts):
+                map_file.write(struct.pack("<%dI" % len(starts), *starts))
+
+
+def load_line_map(file_path):
+    """
+    Reads a map which is written by save method of LineMap class.
+    :returns: Object of LineMap class
+    """
+    with open(file_path, "rb") as map_file:
+        content = map_file.read()
+    line_count, run_count = struct.unpack_from("<II", content)
+    line_map = LineMap()
+    line_map.line_count = line_count
+    offset = struct.calcsize("<II")
+    line_map.new_starts = array("I", struct.unpack_from("<%dI" % run_count, content, offset))
+    line_map.old_starts = array("I", struct.unpack_from("<%dI" % run_count, content, offset + 4 * run_count))
+    return line_map
+
+
 class ErrorCatchStack:
     def __init__(self):
         """
@@ -51,73 +158,239 @@ class ErrorCatchStack:
         return len(self.element_stack)
 
 
-def error_handler(file_handler, stack, error_type):
+class IfErrorHandler:
+    """
+    This class handles IF ERROR while new file is being written, so ptu file is read only once.
+    Missing ENDIFs are added before the line which is written just before "##define const const" line.
+    Every IF that is open when reaching such a line and never ends, is ended there (only once).
+    IFs which are opened after the last "##define const const" line and never end, are ended at the end of file.
+    IFs which never end are only known at the end of file, so places of "##define const const" lines inside IFs
+    are recorded while writing, and ENDIFs which are missing before them are returned at the end (see close method).
+    """
+
+    def __init__(self, write_line, line_ending="\n"):
+        """
+        :param write_line: function which writes a single line (object of Line class) into new file
+        :param line_ending: characters which end added lines, same as lines of ptu file (see get_line_ending)
+        """
+        self.write_line = write_line
+        self.line_ending = line_ending
+        self.last_line = None  # Last line is written later, because missing ENDIFs may be added at the end after it
+        self.line_count = 0  # Number of lines which are written
+        # For every "##define const const" line inside IFs: number of the line before it in new file,
+        # and numbers of the line before it and the line itself in ptu file
+        self.anchors = []
+
+    def write(self, line, inside_if):
+        """
+        Writes the line into new file.
+        :param line: object of Line class that must be written
+        :param inside_if: True if any IF is open when reaching the line
+        """
+        if inside_if and line.context.startswith("##define const const") and self.last_line is not None:
+            self.anchors.append((self.line_count, self.last_line.old_line_num, line.old_line_num))
+        if self.last_line is not None:
+            self.write_line(self.last_line)
+            self.line_count += 1
+        self.last_line = line
+
+    def close(self, unclosed_ifs, end_lines=()):
+        """
+        Writes the last line at the end of file and ends IFs which are still open.
+        Added ENDIFs get line number of the last line in the old file.
+        :param unclosed_ifs: line numbers of IFs in ptu file which never end
+        :param end_lines: Lines which end other scopes that are still open, written after ENDIFs
+        :return: Array of ENDIFs which are missing before lines that are already written (objects of Line class),
+                 new_line_num of each of them is number of the line in new file which it must be inserted before
+                 (see insert_missing_endifs function)
+        """
+        unclosed_ifs = sorted(unclosed_ifs)
+        missing_endifs = []
+        ended_if_count = 0  # Number of IFs which never end and are already ended before an anchor
+        for new_line_num, old_line_num, anchor_line_num in self.anchors:
+            open_if_count = bisect_left(unclosed_ifs, anchor_line_num)
+            for _ in range(open_if_count - ended_if_count):
+                missing_endifs.append(Line("ENDIF" + self.line_ending, old_line_num, new_line_num))
+            ended_if_count = open_if_count
+
+        missing_endif_count = len(unclosed_ifs) - ended_if_count
+        last_line = self.last_line
+        if last_line is not None:
+            # Endings are written after the last line, so it must end with a new line
+            if (missing_endif_count > 0 or end_lines) and not get_line_ending(last_line.context):
+                last_line.context += self.line_ending
+            self.write_line(last_line)
+        self.last_line = None
+        for _ in range(missing_endif_count):
+            self.write_line(Line("ENDIF" + self.line_ending, last_line.old_line_num if last_line is not None else 0,
+                                 None))
+        for end_line in end_lines:
+            self.write_line(end_line)
+        return missing_endifs
+
+
+def get_line_ending(line):
+    """
+    :returns: characters which end the line ("\\r\\n", "\\n" or "\\r"), or empty string if it is the last line
+              and doesn't end with a new line. In text mode every line ends with "\\n" (see open_text_file function).
+    """
+    if line.endswith("\n"):
+        return "\r\n" if line.endswith("\r\n") else "\n"
+    return "\r" if line.endswith("\r") else ""
+
+
+def insert_missing_endifs(new_lines, missing_endifs):
+    """
+    Inserts ENDIFs which are found missing at the end of ptu file (see close method of IfErrorHandler class)
+    into lines of new file, which are already written.
+    :param new_lines: lines of new file (file handler or array), without missing ENDIFs
+    :param missing_endifs: Array of ENDIFs (objects of Line class), in order of their new_line_num
+    :return: Generator of lines of new file with missing ENDIFs
+    """
+    endifs = iter(missing_endifs)
+    endif = next(endifs, None)
+    for new_line_num, new_line in enumerate(new_lines):
+        while endif is not None and endif.new_line_num == new_line_num:
+            yield endif.context
+            endif = next(endifs, None)
+        yield new_line
+
+
+""" Name of scope and the line which ends it, for every type of error """
+
+scope_names = {
+    const.DEFINE_STUB_ERROR: "DEFINE STUB",
+    const.INITIALIZATION_ERROR: "INITIALISATION",
+    const.ENVIRONMENT_ERROR: "ENVIRONMENT",
+    const.SERVICE_ERROR: "SERVICE",
+    const.TEST_ERROR: "TEST",
+    const.ELEMENT_ERROR: "ELEMENT",
+    const.IF_ERROR: "IF",
+}
+
+scope_endings = {
+    const.DEFINE_STUB_ERROR: "END DEFINE",
+    const.INITIALIZATION_ERROR: "END INITIALISATION",
+    const.ENVIRONMENT_ERROR: "END ENVIRONMENT",
+    const.SERVICE_ERROR: "END SERVICE",
+    const.TEST_ERROR: "END TEST",
+    const.ELEMENT_ERROR: "END ELEMENT",
+    const.IF_ERROR: "ENDIF",
+}
+
+
+class ScopeDiagnostic:
+    """
+    Objects of this class describe an error in scopes of ptu file:
+    type of error (see constants), kind of problem (scope is not ended or ending has no start),
+    the line which starts the scope (or the ending without start) and its number in ptu file.
+    """
+
+    def __init__(self, error_type, kind, line):
+        self.error_type = error_type
+        self.kind = kind
+        self.context = line.context.strip()
+        self.old_line_num = line.old_line_num
+
+    def __str__(self):
+        return "%s ERROR: %s at line %d: %s" % (scope_names[self.error_type], self.kind,
+                                               self.old_line_num + 1, self.context)
+
+
+class PtuScopeError(Exception):
+    """
+    Raised when an error in scopes of ptu file is found and errors are not collected (see refine_lines function).
+    """
+
+    def __init__(self, diagnostic):
+        super().__init__(str(diagnostic))
+        self.diagnostic = diagnostic
+
+
+def error_handler(stack, error_type, diagnostics=None, line_ending="\n"):
     """
     This function handles any error that may happen, due to error_type
     In simple words, this function adds missing endings for scopes with error.
-    Implementation is not complete(handle by just raising exception)
-    """
-    if error_type == const.IF_ERROR:
-        file_handler.seek(0, 0)
-        all_lines = file_handler.readlines()
-        file_handler.seek(0, 0)
-        for i in range(len(all_lines) - 1):
-            if all_lines[i + 1].startswith("##define const const"):
-                for j in range(len(stack)):
-                    file_handler.write("ENDIF\n")
-            file_handler.write(all_lines[i])
-    if error_type == const.DEFINE_STUB_ERROR:
-        raise Exception("DEFINE STUB ERROR")
-    if error_type == const.INITIALIZATION_ERROR:
-        raise Exception("INITIALISATION ERROR")
-    if error_type == const.ELEMENT_ERROR:
-        raise Exception("ELEMENT ERROR")
-    if error_type == const.SERVICE_ERROR:
-        raise Exception("SERVICE ERROR")
-    if error_type == const.TEST_ERROR:
-        raise Exception("TEST ERROR")
-    if error_type == const.ELEMENT_ERROR:
-        raise Exception("ELEMENT ERROR")
-
-
-def handle_all_errors(error_stack, new_file):
+    IF ERROR is handled while writing new file (see IfErrorHandler class).
+    If diagnostics is not given, an exception is raised for scopes other than IF.
+    :param stack: stack of the scopes which are not ended
+    :param diagnostics: If given (array), errors are saved in it and endings of scopes are returned
+    :param line_ending: characters which end the returned lines, same as lines of ptu file (see get_line_ending)
+    :return: Array of Lines which end the scopes (object of Line class), in order of starting the scopes
+    """
+    end_lines = []
+    for line in stack:
+        diagnostic = ScopeDiagnostic(error_type, const.SCOPE_NOT_ENDED, line)
+        if diagnostics is None:
+            if error_type == const.IF_ERROR:
+                continue
+            raise PtuScopeError(diagnostic)
+        diagnostics.append(diagnostic)
+        if error_type != const.IF_ERROR:
+            indent = line.context[:len(line.context) - len(line.context.lstrip())]
+            end_lines.append(Line(indent + scope_endings[error_type] + line_ending, line.old_line_num, None))
+    return end_lines
+
+
+def handle_all_errors(error_stack, diagnostics=None, line_ending="\n"):
     """
     This function checks if an error has occurred by checking length of error stacks
     :param error_stack: obj of ErrorCatchStack class,
-    :param new_file: file handler of new file in which data must be written
-    :return: None
+    :param diagnostics: If given (array), errors are saved in it instead of raising an exception
+    :param line_ending: characters which end the returned lines, same as lines of ptu file (see get_line_ending)
+    :return: Array of Lines which end the scopes that are not ended, in reverse order of starting the scopes
     """
 
-    # Check for IF ERROR
-    if error_stack.get_if_stack_len() > 0:
-        error_handler(new_file, error_stack.if_stack, const.IF_ERROR)
+    # IF ERROR is already handled while writing new file (see IfErrorHandler class), it is only reported here
+    end_lines = error_handler(error_stack.if_stack, const.IF_ERROR, diagnostics, line_ending)
 
     # Check for DEFINE STUB ERROR
     if error_stack.get_define_stub_stack_len() > 0:
-        error_handler(new_file, error_stack.define_stub_stack, const.DEFINE_STUB_ERROR)
+        end_lines += error_handler(error_stack.define_stub_stack, const.DEFINE_STUB_ERROR, diagnostics, line_ending)
 
     # Check for INITIALIZATION ERROR
     if error_stack.get_initialization_stack_len() > 0:
-        error_handler(new_file, error_stack.initialization_stack, const.INITIALIZATION_ERROR)
+        end_lines += error_handler(error_stack.initialization_stack, const.INITIALIZATION_ERROR, diagnostics,
+                                   line_ending)
 
     # Check for ENVIRONMENT ERROR
     if error_stack.get_environment_stack_len() > 0:
-        error_handler(new_file, error_stack.environment_stack, const.ENVIRONMENT_ERROR)
+        end_lines += error_handler(error_stack.environment_stack, const.ENVIRONMENT_ERROR, diagnostics, line_ending)
 
     # Check for SERVICE ERROR
     if error_stack.get_service_stack_len() > 0:
-        error_handler(new_file, error_stack.service_stack, const.SERVICE_ERROR)
+        end_lines += error_handler(error_stack.service_stack, const.SERVICE_ERROR, diagnostics, line_ending)
 
     # Check for TEST ERROR
     if error_stack.get_test_stack_len() > 0:
-        error_handler(new_file, error_stack.test_stack, const.TEST_ERROR)
+        end_lines += error_handler(error_stack.test_stack, const.TEST_ERROR, diagnostics, line_ending)
 
     # Check for ELEMENT ERROR
     if error_stack.get_element_stack_len() > 0:
-        error_handler(new_file, error_stack.element_stack, const.ELEMENT_ERROR)
+        end_lines += error_handler(error_stack.element_stack, const.ELEMENT_ERROR, diagnostics, line_ending)
+
+    # The scope which is started last must be ended first
+    end_lines.sort(key=lambda end_line: end_line.old_line_num, reverse=True)
+    return end_lines
 
 
-def check_for_errors(error_stack, line):
+def end_scope(stack, line, error_type, diagnostics=None):
+    """
+    Pops starter of the scope which is ended by the line.
+    :param diagnostics: If given (array), an ending without start is saved in it instead of raising an exception
+    :return: False if the ending has no start, so it must not be written into new file
+    """
+    if stack:
+        stack.pop()
+        return True
+    diagnostic = ScopeDiagnostic(error_type, const.SCOPE_NOT_STARTED, line)
+    if diagnostics is None:
+        raise PtuScopeError(diagnostic)
+    diagnostics.append(diagnostic)
+    return False
+
+
+def check_for_errors(error_stack, line, diagnostics=None):
     """
     This function checks for any type of error that may happen.
     Errors happen when scope of sth has been started and there is no ending for it.
@@ -126,60 +399,61 @@ def check_for_errors(error_stack, line):
     If it was a starter of a scope, it is pushed to a stacked until finding it's ending.
     If it was an ending for a scope, starter of that scope is popped out from the stack.
     :param error_stack: obj of ErrorCatchStack class, containing a stack for any type of error.
+    :param diagnostics: If given (array), endings without start are saved in it instead of raising an exception
+    :return: False if the line is an ending without start, so it must not be written into new file
     """
 
-    line_context = line.context.strip().upper()
+    keyword = classify_keyword(line.context.strip())
 
     # Check if the line has started scope of an IF. If so, push it into stack
-    if line_context.startswith("IF"):
+    if keyword == Keyword.IF:
         error_stack.if_stack.append(line)
-        # print([x.context + str(x.old_line_num) for x in error_stack.if_stack])
     # Check if the line has ended scope of an IF. If so, pop the last element from stack
-    elif line_context.startswith("ENDIF") or line_context.startswith("END IF"):
-        error_stack.if_stack.pop()
-        # print([x.context + str(x.old_line_num) for x in error_stack.if_stack])
+    elif keyword == Keyword.END_IF:
+        return end_scope(error_stack.if_stack, line, const.IF_ERROR, diagnostics)
 
     # Check if the line has started scope of an ELEMENT. If so, push it into stack
-    elif line_context.startswith("ELEMENT"):
+    elif keyword == Keyword.ELEMENT:
         error_stack.element_stack.append(line)
     # Check if the line has ended scope of an ELEMENT. If so, pop the last element from stack
-    elif line_context.startswith("END ELEMENT"):
-        error_stack.element_stack.pop()
+    elif keyword == Keyword.END_ELEMENT:
+        return end_scope(error_stack.element_stack, line, const.ELEMENT_ERROR, diagnostics)
 
     # Check if the line has started scope of a TEST. If so, push it into stack
-    elif line_context.startswith("TEST"):
+    elif keyword == Keyword.TEST:
         error_stack.test_stack.append(line)
     # Check if the line has ended scope of a TEST. If so, pop the last element from stack
-    elif line_context.startswith("END TEST"):
-        error_stack.test_stack.pop()
+    elif keyword == Keyword.END_TEST:
+        return end_scope(error_stack.test_stack, line, const.TEST_ERROR, diagnostics)
 
     # Check if the line has started scope of a SERVICE. If so, push it into stack
-    elif line_context.startswith("SERVICE "):
+    elif keyword == Keyword.SERVICE:
         error_stack.service_stack.append(line)
     # Check if the line has ended scope of a SERVICE. If so, pop the last element from stack
-    elif line_context.startswith("END SERVICE"):
-        error_stack.service_stack.pop()
+    elif keyword == Keyword.END_SERVICE:
+        return end_scope(error_stack.service_stack, line, const.SERVICE_ERROR, diagnostics)
 
     # Check if the line has started scope of an ENVIRONMENT. If so, push it into stack
-    elif line_context.startswith("ENVIRONMENT"):
+    elif keyword == Keyword.ENVIRONMENT:
         error_stack.environment_stack.append(line)
     # Check if the line has ended scope of an ENVIRONMENT. If so, pop the last element from stack
-    elif line_context.startswith("END ENVIRONMENT"):
-        error_stack.environment_stack.pop()
+    elif keyword == Keyword.END_ENVIRONMENT:
+        return end_scope(error_stack.environment_stack, line, const.ENVIRONMENT_ERROR, diagnostics)
 
     # Check if the line has started scope of a STUB DEFINITION. If so, push it into stack
-    elif line_context.startswith("DEFINE STUB"):
+    elif keyword == Keyword.DEFINE_STUB:
         error_stack.define_stub_stack.append(line)
     # Check if the line has ended scope of a STUB DEFINITION. If so, pop the last element from stack
-    elif line_context.startswith("END DEFINE"):
-        error_stack.define_stub_stack.pop()
+    elif keyword == Keyword.END_DEFINE:
+        return end_scope(error_stack.define_stub_stack, line, const.DEFINE_STUB_ERROR, diagnostics)
 
     # Check if the line has started scope of INITIALISATION. If so, push it into stack
-    elif line_context.startswith("INITIALISATION"):
+    elif keyword == Keyword.INITIALISATION:
         error_stack.initialization_stack.append(line)
     # Check if the line has ended scope of INITIALISATION. If so, pop the last element from stack
-    elif line_context.startswith("END INITIALISATION"):
-        error_stack.initialization_stack.pop()
+    elif keyword == Keyword.END_INITIALISATION:
+        return end_scope(error_stack.initialization_stack, line, const.INITIALIZATION_ERROR, diagnostics)
+    return True
 
 
 def writable_comment(comment_line):
@@ -190,54 +464,85 @@ def writable_comment(comment_line):
      If comment includes just additional characters, it is useless to write it.
      Example : " --~T "
     """
-    if "--~" in comment_line and len(comment_line) == 5:
+    comment = comment_line.rstrip("\r\n")
+    # Length is checked the same as text mode, where any line ending is read as a single "\n" (see open_text_file)
+    if "--~" in comment and len(comment) + (comment != comment_line) == 5:
         return False
     return True
 
 
-def rewrite_ptu_file(file_name, old_path, new_path):
+def refine_lines(old_file, file_name, line_map=None, diagnostics=None, missing_endifs=None):
     """
-    This function opens ptu file and rewrite it into new file.
+    This function reads lines of ptu file one by one and yields lines of new file.
     New file is now easier and more simple to read.
     Also, if there is a scope in ptu file with no ending, it is handled in new file.
+    Memory does not grow with file size. ENDIFs which are missing before lines that are already yielded are only
+    found at the end of ptu file (see IfErrorHandler class): if missing_endifs is given, ptu file is read once
+    and they are saved in it, so they must be inserted into new file later (see insert_missing_endifs function).
+    Otherwise ptu file is read twice, first to find them.
+    :param old_file: file handler of ptu file (or array of its lines). It must be possible to read it twice
+                     (a file which can seek or an array) if missing_endifs is not given, otherwise TypeError is raised.
     :param file_name: name of ptu file
-    :param old_path: path of ptu file to be read
-    :param new_path: path of new file to be written into
-    :return: None
+    :param line_map: If given (object of LineMap class), line number in ptu file of every line of new file is saved in it
+    :param diagnostics: If given (array), errors in scopes are saved in it (objects of ScopeDiagnostic class)
+                        and repaired, instead of raising an exception. Endings without start are omitted and
+                        scopes which are not ended are ended at the end of file.
+    :param missing_endifs: If given (array), ENDIFs which are missing before lines that are already yielded are saved
+                           in it (objects of Line class, see close method of IfErrorHandler class)
+    :return: Generator of lines of new file
     """
+    if missing_endifs is not None:
+        return _refine_lines(old_file, file_name, line_map, diagnostics, missing_endifs)
+    if not (old_file.seekable() if hasattr(old_file, "seek") else iter(old_file) is not old_file):
+        raise TypeError("lines of ptu file can't be read twice, missing_endifs must be given")
+    return _refine_lines_twice(old_file, file_name, line_map, diagnostics)
 
-    """ Open old file for reading """
-
-    old_file = open(old_path + "\\" + file_name, "rt")
-    lines = old_file.readlines()  # Reading all lines and save in an array
-    old_file.close()
 
-    """ Open new file for writing """
+def _refine_lines_twice(old_file, file_name, line_map, diagnostics):
+    """
+    Reads ptu file twice: first to find ENDIFs which are missing, then to yield lines of new file with them.
+    """
+    missing_endifs = []
+    for _ in _refine_lines(old_file, file_name, None, [], missing_endifs):
+        pass
+    if hasattr(old_file, "seek"):
+        old_file.seek(0)
+    yield from insert_missing_endifs(_refine_lines(old_file, file_name, line_map, diagnostics, []), missing_endifs)
+    if line_map is not None:
+        line_map.insert_lines(missing_endifs)
 
-    if not path.exists(new_path):
-        makedirs(new_path)  # If folder doesn't exist, create it
 
-    new_file = open(new_path + "\\" + file_name, "w+t")
+def _refine_lines(old_file, file_name, line_map, diagnostics, missing_endifs):
+    """
+    Reads ptu file once and yields lines of new file, without ENDIFs which are missing before lines that are already
+    yielded. They are saved in missing_endifs instead (see refine_lines function).
+    """
     new_line_num = 0  # Counter for keeping number of line which is being written in new file
 
     error_stack = ErrorCatchStack()  # Stack for detecting start and end of scopes and handle if an error occurs
+    ready_lines = []  # Lines which are ready to be written into new file
+    if_error_handler = IfErrorHandler(ready_lines.append)  # Adds missing ENDIFs
 
     # Reading old file lines and write it in new file, just in case
-    for old_line_num in range(len(lines)):
+    for old_line_num, context in enumerate(old_file):
 
         # Create object of Line class for every line that is being read
-        line = Line(lines[old_line_num], old_line_num, new_line_num)
+        # Number of line in new file is set when it is written (ENDIFs may be added before it)
+        line = Line(context, old_line_num, None)
+        if old_line_num == 0:
+            if_error_handler.line_ending = get_line_ending(context) or if_error_handler.line_ending
 
         # If the line starts or ends scope of sth, it must be checked due to handling errors that may happen
-        check_for_errors(error_stack, line)
+        if not check_for_errors(error_stack, line, diagnostics):
+            continue  # Ending without start is not written into new file
 
         if line.context.startswith("--"):  # If line is comment
             if writable_comment(line.context):  # If the comment is ok to be written in the new file
                 if "--~+:" in line.context:  # Check comment for additional characters
                     line.context = line.context.replace("~+:", " ")  # Omitting additional characters
             else:
-                # If comment should not be written into new file, continue loop and do not increase
-                # new_line_num counter. So nothing will be written into new file
+                # If comment should not be written into new file, continue loop.
+                # So nothing will be written into new file
                 continue
 
         # Writing file name in new file and modify it in case it is not correct or is corrupted
@@ -245,11 +550,331 @@ def rewrite_ptu_file(file_name, old_path, new_path):
             line.context = line.context.replace(".ptu", "")  # Omitting extension
             line.context = line.context.replace("template", file_name.replace(".ptu", ""))
 
-        # After checking everything, write the line into new file and increase new_line_num counter
-        new_file.write(line.context)
-        new_line_num += 1
+        # After checking everything, write the line into new file
+        if_error_handler.write(line, bool(error_stack.if_stack))
+
+        # Lines that are ready are written into new file, increasing new_line_num counter
+        for ready_line in ready_lines:
+            ready_line.new_line_num = new_line_num
+            new_line_num += 1
+            if line_map is not None:
+                line_map.add_line(ready_line.old_line_num)
+            yield ready_line.context
+        ready_lines.clear()
 
     # Now that everything is checked, detect if an error has occurred and handle it
-    handle_all_errors(error_stack, new_file)
+    end_lines = handle_all_errors(error_stack, diagnostics, if_error_handler.line_ending)
+    unclosed_ifs = [if_line.old_line_num for if_line in error_stack.if_stack]
+    missing_endifs += if_error_handler.close(unclosed_ifs, end_lines)
+    for ready_line in ready_lines:
+        ready_line.new_line_num = new_line_num
+        new_line_num += 1
+        if line_map is not None:
+            line_map.add_line(ready_line.old_line_num)
+        yield ready_line.context
+
+
+def open_text_file(file_path, mode, encoding=None, binary=False):
+    """
+    Opens a file in text mode (mode is "rt" or "wt").
+    :param encoding: encoding of the file, None means default encoding of platform
+    :param binary: If True, encoding is ignored and every byte of file is a single character (see constants).
+                   So any file is read and written back without change, even its line endings.
+                   Keywords of ptu files are ascii, so they are found the same as other encodings.
+    :return: file handler
+    """
+    if binary:
+        return open(file_path, mode, encoding=const.BINARY_ENCODING, newline="")
+    return open(file_path, mode, encoding=encoding)
+
+
+def rewrite_ptu_file(file_name, old_path, new_path, write_line_map=False, diagnostics=None, encoding=None,
+                     binary=False):
+    """
+    This function opens ptu file and rewrite it into new file (see refine_lines function).
+    :param file_name: name of ptu file
+    :param old_path: path of ptu file to be read
+    :param new_path: path of new file to be written into
+    :param write_line_map: If True, map of line numbers (see LineMap class) is also written next to new file,
+                           otherwise map of an older new file is removed
+    :param diagnostics: If given (array), errors in scopes are saved in it and repaired (see refine_lines function)
+    :param encoding: encoding of ptu file and new file, None means default encoding of platform
+    :param binary: If True, bytes of ptu file are copied into new file without decoding (see open_text_file function)
+    :return: None
+    """
+
+    """ Open old file for reading, lines are read one by one so memory does not grow with file size """
+
+    with open_text_file(old_path + "\\" + file_name, "rt", encoding, binary) as old_file:
+
+        """ Open new file for writing """
+
+        if not path.exists(new_path):
+            makedirs(new_path)  # If folder doesn't exist, create it
+
+        # New file is written into a temporary file first, which replaces new file only if refining succeeds.
+        # So a ptu file which can't be refined does not leave a part of new file behind.
+        new_file_path = new_path + "\\" + file_name
+        line_map = LineMap() if write_line_map else None
+        missing_endifs = []
+        try:
+            with open_text_file(new_file_path + ".tmp", "wt", encoding, binary) as new_file:
+                for new_line in refine_lines(old_file, file_name, line_map, diagnostics, missing_endifs):
+                    new_file.write(new_line)
+
+            # ENDIFs which are missing before lines that are already written are inserted by copying the temporary
+            # file once more. It only happens for ptu files with IFs which never end, clean files are written once.
+            if missing_endifs:
+                with open_text_file(new_file_path + ".tmp", "rt", encoding, binary) as unpatched_file, \
+                        open_text_file(new_file_path + ".endif.tmp", "wt", encoding, binary) as new_file:
+                    for new_line in insert_missing_endifs(unpatched_file, missing_endifs):
+                        new_file.write(new_line)
+                replace(new_file_path + ".endif.tmp", new_file_path + ".tmp")
+                if line_map is not None:
+                    line_map.insert_lines(missing_endifs)
+        except BaseException:
+            for temp_path in (new_file_path + ".tmp", new_file_path + ".endif.tmp"):
+                if path.exists(temp_path):
+                    remove(temp_path)
+            raise
+    replace(new_file_path + ".tmp", new_file_path)
+
+    # Map of an older new file is removed, otherwise it would map lines of this new file incorrectly
+    map_path = new_file_path + const.LINE_MAP_EXTENSION
+    if line_map is not None:
+        line_map.save(map_path)
+    elif path.exists(map_path):
+        remove(map_path)
+
+
+def file_hash(file_path):
+    """
+    :returns: sha256 hash of content of the file in hex format
+    """
+    content_hash = hashlib.sha256()
+    with open(file_path, "rb") as file_handler:
+        for chunk in iter(lambda: file_handler.read(1 << 20), b""):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+def file_signature(file_path):
+    """
+    :returns: size and modification time of the file, used for checking whether the file may have changed or not
+    """
+    file_stat = stat(file_path)
+    return [file_stat.st_size, file_stat.st_mtime_ns]
+
+
+def create_manifest_entry(file_name, old_path, new_path, line_map=False, repaired=False, encoding=None, binary=False):
+    """
+    :param line_map: True if map of line numbers has been written next to new file
+    :param repaired: True if errors in scopes of ptu file have been repaired (see refine_lines function)
+    :param encoding: encoding which the files have been read and written with (see rewrite_ptu_file function)
+    :param binary: True if the files have been read and written without decoding
+    :returns: Manifest entry of a ptu file which has just been refined
+    """
+    old_file_path = old_path + "\\" + file_name
+    new_file_path = new_path + "\\" + file_name
+    return {
+        "version": const.REFINE_VERSION,
+        "line_map": line_map,
+        "repaired": repaired,
+        "encoding": encoding,
+        "binary": binary,
+        "input_hash": file_hash(old_file_path),
+        "input_signature": file_signature(old_file_path),
+        "output_hash": file_hash(new_file_path),
+        "output_signature": file_signature(new_file_path),
+    }
+
+
+class RefineManifest:
+    """
+    Manifest of refined files, saved in output directory of refine_directory function.
+    For every ptu file, hash of its content, hash of its new file and version of refine are saved.
+    Size and modification time of files are also saved, so files which have not been touched are not hashed again.
+    """
+
+    def __init__(self, new_path):
+        self.file_path = new_path + "\\" + const.REFINE_MANIFEST_NAME
+        self.files = {}  # File name -> manifest entry
+        if path.exists(self.file_path):
+            try:
+                with open(self.file_path, "rt") as manifest_file:
+                    content = json.load(manifest_file)
+            except (OSError, ValueError):
+                content = {}  # Broken manifest is ignored, so all of files are refined again
+            if isinstance(content, dict):
+                self.files = content.get("files", {})
+
+    def is_up_to_date(self, file_name, old_path, new_path, line_map=False, lenient=False, encoding=None,
+                      binary=False):
+        """
+        :param line_map: If True, map of line numbers must also exist next to new file
+        :param lenient: If False, new files whose errors in scopes have been repaired are not up to date,
+                        so the errors are raised again.
+        :param encoding: encoding of files in this run, new file must have been written with the same encoding
+        :param binary: If files are read and written without decoding in this run or not
+        :returns: True if the ptu file and its new file have not changed since last run with the same version of refine
+        """
+        entry = self.files.get(file_name)
+        if entry is None or entry["version"] != const.REFINE_VERSION or (entry.get("repaired") and not lenient):
+            return False
+        if entry.get("binary", False) != binary or (not binary and entry.get("encoding") != encoding):
+            return False
+        if line_map and not (entry.get("line_map") and
+                             path.exists(new_path + "\\" + file_name + const.LINE_MAP_EXTENSION)):
+            return False
+
+        old_file_path = old_path + "\\" + file_name
+        signature = file_signature(old_file_path)
+        if signature != entry["input_signature"]:
+            if file_hash(old_file_path) != entry["input_hash"]:
+                return False
+            entry["input_signature"] = signature  # File has been touched, but its content is the same
+
+        new_file_path = new_path + "\\" + file_name
+        if not path.exists(new_file_path):
+            return False
+        signature = file_signature(new_file_path)
+        if signature != entry["output_signature"]:
+            if file_hash(new_file_path) != entry["output_hash"]:
+                return False
+            entry["output_signature"] = signature
+        return True
+
+    def save(self):
+        """
+        Writes manifest into a temporary file first, so an interrupted run does not leave a broken manifest.
+        """
+        with open(self.file_path + ".tmp", "wt") as manifest_file:
+            json.dump({"version": const.REFINE_VERSION, "files": self.files}, manifest_file, indent=1, sort_keys=True)
+        replace(self.file_path + ".tmp", self.file_path)
 
-    new_file.close()
+
+def refine_file(file_name, old_path, new_path, save_hashes=False, write_line_map=False, lenient=False,
+                encoding=None, binary=False):
+    """
+    Calls rewrite_ptu_file function for a single ptu file and never raises an exception.
+    Any error is saved in the result, so one broken file does not stop refining other files.
+    :param save_hashes: If True, hashes of ptu file and new file are saved in the result, too.
+    :param write_line_map: If True, map of line numbers is written next to new file (see rewrite_ptu_file function)
+    :param lenient: If True, errors in scopes are repaired and saved in diagnostics of the result,
+                    instead of failing the file (see refine_lines function)
+    :param encoding: encoding of ptu file and new file (see rewrite_ptu_file function)
+    :param binary: If True, ptu file is refined without decoding (see rewrite_ptu_file function)
+    :return: Object of RefineResult class
+    """
+    result = RefineResult(file_name)
+    start_time = perf_counter()
+    try:
+        rewrite_ptu_file(file_name, old_path, new_path, write_line_map, result.diagnostics if lenient else None,
+                         encoding, binary)
+        if result.diagnostics:
+            result.status = const.REFINE_REPAIRED
+        if save_hashes:
+            result.manifest_entry = create_manifest_entry(file_name, old_path, new_path, write_line_map,
+                                                          bool(result.diagnostics), encoding, binary)
+    except Exception as error:
+        result.status = const.REFINE_ERROR
+        result.error = repr(error)
+    result.time = perf_counter() - start_time
+    return result
+
+
+def refine_directory(old_path, new_path, jobs=1, use_manifest=True, write_line_maps=False, lenient=False,
+                     encoding=None, binary=False):
+    """
+    This function refines all of ptu files in old_path and writes them into new_path.
+    Files are distributed between a pool of processes, each file is refined in a single process.
+    A manifest of refined files is kept in new_path, so files which have not changed since last run are skipped,
+    and new files whose ptu file has been deleted are removed.
+    :param old_path: path of ptu files to be read
+    :param new_path: path of new files to be written into
+    :param jobs: number of processes, None means number of CPUs. With 1 job files are refined in current process.
+    :param use_manifest: If False, all of files are refined and manifest is neither read nor written.
+    :param write_line_maps: If True, map of line numbers of every new file is written next to it (see LineMap class)
+    :param lenient: If True, errors in scopes are repaired and reported instead of failing the file
+    :param encoding: encoding of ptu files and new files, None means default encoding of platform
+    :param binary: If True, ptu files are refined without decoding, whatever their encoding is
+    :return: Array of RefineResult objects, in order of file names (removed files at the end)
+    """
+    file_names = sorted(name for name in listdir(old_path) if name.lower().endswith(".ptu"))
+
+    if not path.exists(new_path):
+        makedirs(new_path)  # Creating folder before starting processes, so they don't try to create it together
+
+    results = {}
+    manifest = None
+    if use_manifest:
+        manifest = RefineManifest(new_path)
+        for file_name in file_names:
+            if manifest.is_up_to_date(file_name, old_path, new_path, write_line_maps, lenient, encoding, binary):
+                results[file_name] = RefineResult(file_name)
+                results[file_name].status = const.REFINE_SKIPPED
+    changed_file_names = [file_name for file_name in file_names if file_name not in results]
+
+    if jobs is None:
+        jobs = cpu_count() or 1
+    if jobs <= 1 or len(changed_file_names) <= 1:
+        refined = [refine_file(file_name, old_path, new_path, use_manifest, write_line_maps, lenient, encoding, binary)
+                   for file_name in changed_file_names]
+    else:
+        # Sending files in chunks, so processes don't wait for each other for every single file
+        chunk_size = max(1, len(changed_file_names) // (jobs * 4))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            refined = list(executor.map(refine_file, changed_file_names, repeat(old_path), repeat(new_path),
+                                        repeat(use_manifest), repeat(write_line_maps), repeat(lenient),
+                                        repeat(encoding), repeat(binary), chunksize=chunk_size))
+    for result in refined:
+        results[result.file_name] = result
+
+    results = [results[file_name] for file_name in file_names]
+    if manifest is not None:
+        for result in results:
+            if result.manifest_entry is not None:
+                manifest.files[result.file_name] = result.manifest_entry
+            elif result.status == const.REFINE_ERROR:
+                manifest.files.pop(result.file_name, None)  # So it is refined again in next run
+
+        # Removing new files whose ptu file has been deleted
+        for file_name in sorted(set(manifest.files) - set(file_names)):
+            for removed_path in (new_path + "\\" + file_name, new_path + "\\" + file_name + const.LINE_MAP_EXTENSION):
+                if path.exists(removed_path):
+                    remove(removed_path)
+            del manifest.files[file_name]
+            result = RefineResult(file_name)
+            result.status = const.REFINE_REMOVED
+            results.append(result)
+        manifest.save()
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refine all of ptu files in a directory")
+    parser.add_argument("old_path", help="path of ptu files to be read")
+    parser.add_argument("new_path", help="path of new files to be written into")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of processes (default: number of CPUs)")
+    parser.add_argument("-f", "--force", action="store_true", help="refine all of files, without using manifest")
+    parser.add_argument("--line-map", action="store_true", help="write map of line numbers next to every new file")
+    parser.add_argument("--lenient", action="store_true", help="repair errors in scopes instead of failing the file")
+    parser.add_argument("-e", "--encoding", default=None, help="encoding of ptu files (default: platform encoding)")
+    parser.add_argument("-b", "--binary", action="store_true", help="refine ptu files without decoding them")
+    args = parser.parse_args()
+
+    start_time = perf_counter()
+    results = refine_directory(args.old_path, args.new_path, args.jobs, use_manifest=not args.force,
+                               write_line_maps=args.line_map, lenient=args.lenient, encoding=args.encoding,
+                               binary=args.binary)
+    for result in results:
+        print("%-8s %8.3fs  %s %s" % (result.status, result.time, result.file_name, result.error))
+        for diagnostic in result.diagnostics:
+            print("    %s" % diagnostic)
+    error_count = sum(result.status == const.REFINE_ERROR for result in results)
+    skipped_count = sum(result.status == const.REFINE_SKIPPED for result in results)
+    print("%d files, %d skipped, %d errors, %.3fs" % (len(results), skipped_count, error_count,
+                                                     perf_counter() - start_time))
+    if error_count:
+        raise SystemExit(1)
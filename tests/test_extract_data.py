@@ -0,0 +1,371 @@
+from os import path, makedirs
+from glob import glob
+from tempfile import TemporaryDirectory
+import random
+import unittest
+from benchmarks.generate_ptu import write_ptu
+import constants as const
+import extract_data
+import refine_data
+
+DATA_PATH = path.join(path.dirname(path.abspath(__file__)), "data")
+
+
+def read_test_case_lines(file_name):
+    """
+    :returns: Array of test case lines (VAR, ARRAY and STR) in a file in data folder of tests,
+              joined with the lines which continue them
+    """
+    with open(path.join(DATA_PATH, file_name), "rt") as ptu_file:
+        lines = ptu_file.readlines() + [""]
+    return [extract_data.join_test_case_lines(lines, line_num) for line_num in range(len(lines))
+            if lines[line_num].strip().upper().startswith(("VAR", "ARRAY", "STR"))]
+
+
+def extract_fields(line):
+    """
+    :returns: Tuple of (type, name, initial value, expected value) found by extract_test_case_fields function
+    """
+    test_case = extract_data.PtuWorkBook.TestCase()
+    extract_data.extract_test_case_fields(test_case, line)
+    return test_case.param_type, test_case.param_name, test_case.init, test_case.ev
+
+
+def describe_test_cases(test_cases):
+    return [(tuple(test_case.conditions), test_case.param_type, test_case.param_name, str(test_case.init),
+             str(test_case.ev)) for test_case in test_cases]
+
+
+def describe_user_code(user_code_list):
+    return [(tuple(user_code.conditions), user_code.code) for user_code in user_code_list]
+
+
+def describe_stubs(stubs):
+    return [(tuple(stub.conditions), stub.stub_definition) for stub in stubs]
+
+
+def describe_service(service):
+    """
+    :returns: All of data of a service as nested tuples, so services can be compared
+    """
+    tests = []
+    for test in service.test_list:
+        element = test.element
+        tests.append((test.name, test.family, tuple(test.conditions), list(test.comment), list(test.use),
+                      list(element.get_all_use()), describe_test_cases(element.input_data),
+                      describe_test_cases(element.calibrations), describe_test_cases(element.output_data),
+                      describe_stubs(element.stub_calls), describe_user_code(element.user_code)))
+    return (service.name, tuple(service.conditions), describe_user_code(service.user_code), list(service.use),
+            tests)
+
+
+def describe_workbook(workbook):
+    """
+    :returns: All of data of a workbook as nested tuples, so workbooks can be compared
+    """
+    preface = workbook.preface
+    return (workbook.name, preface.purpose, preface.processor, preface.tool_chain, preface.header.module_name,
+            preface.header.module_version, preface.header.test_plan_version, list(workbook.include),
+            list(workbook.comment), describe_user_code(workbook.user_code),
+            [(stub.name, tuple(stub.conditions), describe_stubs(stub.stub_list)) for stub in workbook.stub_definitions],
+            [(tuple(initialisation.conditions), initialisation.description)
+             for initialisation in workbook.initialisation],
+            [(environment.name, tuple(environment.conditions), describe_test_cases(environment.test_case_list))
+             for environment in workbook.environments],
+            [describe_service(service) for service in workbook.services])
+
+
+class TokenizeTestCaseTest(unittest.TestCase):
+
+    def assert_same_as_fields(self, line):
+        """
+        Checks that a line which is tokenized gives the same result as extract_test_case_fields function.
+        :returns: True if the line is tokenized
+        """
+        tokens = extract_data.tokenize_test_case(line)
+        if tokens is not None:
+            self.assertEqual(tokens, extract_fields(line), repr(line))
+        return tokens is not None
+
+    def test_common_lines(self):
+        lines = [
+            "VAR x, init = 1, ev = init",
+            "var x2, INIT = 1, EV = init",
+            "VAR y,init=0,ev=2",
+            "VAR w3, ev = 5",
+            "VAR w4, init = 7",
+            "ARRAY t, init = {1,2, 3}, ev = init",
+            "ARRAY t, init = { 1 ,\t2 }, ev = { 3, 4 }",
+            "STR s, init = \"x\", ev = \"y\"",
+            "VAR p->q, init = a.b[2], ev = -1.5e3",
+            "VAR w, init = 0, ev = MIN 1, MAX 3",
+        ]
+        for line in lines:
+            self.assertTrue(self.assert_same_as_fields(line), repr(line))
+
+    def test_lines_which_are_not_tokenized(self):
+        lines = [
+            "VAR z, init = 0, ev = 2, delta = 0.1",
+            "VAR w2, int, init = 0, ev = 5",
+            "VAR v, init = init_value, ev = 0",
+            "VAR VARx, init = 0, ev = 0",
+            "VAR ı, init = 0, ev = 0",
+            "VAR x",
+        ]
+        for line in lines:
+            self.assertFalse(self.assert_same_as_fields(line), repr(line))
+
+    def test_sample_file(self):
+        lines = read_test_case_lines("sample.ptu")
+        tokenized_count = sum(self.assert_same_as_fields(line) for line in lines)
+        self.assertGreater(tokenized_count, len(lines) // 2)
+
+    def test_random_lines(self):
+        rnd = random.Random(0)
+        words = ["VAR", "var", "ARRAY", "STR", "x", "VARx", "y1", "init", "INIT", "Init", "ev", "EV", "Ev", "eV", "=",
+                 "==", ",", ", ", " ,", "  ", " ", "\t", "\x1c", "\x0b", "{1", "2}", "MIN", "MAX", "delta", "DELTA",
+                 "0.1", "level", "every", "INITIAL", "int", "\"s\"", "ı", "İ", "é", "&", "-", "a b", "±"]
+        values = ["0", "1", " 2 ", "{1, 2,3}", "init", "MIN 0, MAX 10", "\"s\"", "0x1F", "-1.5e3", "a.b[2]",
+                  "{ 1,\t2 }", "level", "EVENT"]
+        for _ in range(20000):
+            if rnd.random() < 0.5:
+                # Lines in the form that is tokenized, with some of their parts changed
+                parts = [rnd.choice(["VAR", "ARRAY", "STR", "var"]) + rnd.choice([" ", "  ", "\t"]) +
+                         rnd.choice(["x", "y1", "tab[0]", "VARx", "a b", "x "])]
+                if rnd.random() < 0.9:
+                    parts.append(rnd.choice(["init", "INIT", "Init"]) + rnd.choice(["", " "]) +
+                                 rnd.choice(["=", "==", ""]) + rnd.choice(["", " "]) + rnd.choice(values))
+                if rnd.random() < 0.9:
+                    parts.append(rnd.choice(["ev", "EV", "Ev"]) + rnd.choice(["", " "]) +
+                                 rnd.choice(["=", "==", ""]) + rnd.choice(["", " "]) + rnd.choice(values))
+                if rnd.random() < 0.2:
+                    parts.append(rnd.choice(["delta = 1", "DELTA=0.1", "MAX 2", "ev = 1"]))
+                line = rnd.choice([",", ", ", " , "]).join(parts)
+            else:
+                line = "".join(rnd.choice(words) for _ in range(rnd.randint(1, 12)))
+            line = line.strip()
+            try:
+                extract_fields(line)
+            except (IndexError, ValueError):
+                # Line is not a test case at all, so it must not be tokenized either
+                self.assertIsNone(extract_data.tokenize_test_case(line), repr(line))
+                continue
+            self.assert_same_as_fields(line)
+
+
+class BinaryModeTest(unittest.TestCase):
+
+    # Non-ascii characters in values, names, conditions (in lower case) and keywords of the sample file
+    replacements = [("TARGET_A", "target_à"), ("#int local;", "#int locàl; // é"),
+                    ("\"x\", ev = \"y\"", "\"voilà\", ev = \"ü\""), ("COMMENT test one", "COMMENT test ôné"),
+                    ("USE env2", "USE env_é"), ("FAMILY robust", "FAMILY robusté"), ("SERVICE serv2", "SERVICE sérv2"),
+                    ("HEADER modx", "HEADER modé"), ("module X", "module É"), ("\"a.h\"", "\"à.h\""),
+                    ("VAR q2, init = 1", "VAR q2, init = à"), ("f2(2)2", "f2(é)2"), ("#x = 1;", "#x = 'é';"),
+                    ("VAR cal, init = 1, ev = 1", "VAR cal, init = 1, ev = ç")]
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        with open(path.join(DATA_PATH, "sample.ptu"), "rt") as ptu_file:
+            self.content = ptu_file.read()
+        for old, new in self.replacements:
+            self.assertIn(old, self.content)
+            self.content = self.content.replace(old, new)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_ptu_file(self, file_name, encoding, newline):
+        file_path = path.join(self.temp_dir.name, file_name)
+        with open(file_path, "wt", encoding=encoding, newline=newline) as ptu_file:
+            ptu_file.write(self.content)
+        return file_path
+
+    def test_same_as_decoding_lines(self):
+        for encoding, newline in (("utf-8", "\n"), ("utf-8", "\r\n"), ("latin-1", "\r\n")):
+            file_path = self.write_ptu_file("sample.ptu", encoding, newline)
+            expected = describe_workbook(extract_data.open_ptu(file_path, "sample.ptu", encoding))
+            self.assertIn("target_à".upper(), str(expected))
+            for options in ({}, {"use_mmap": True}, {"single_pass": True}, {"use_mmap": True, "single_pass": True},
+                            {"lazy_services": True}, {"use_mmap": True, "lazy_values": True}, {"jobs": 2}):
+                workbook = extract_data.open_ptu(file_path, "sample.ptu", encoding, binary=True, **options)
+                self.assertEqual(describe_workbook(workbook), expected, (encoding, newline, options))
+                if options.get("lazy_services"):
+                    self.assertEqual(workbook.services.get_name(1), "sérv2")
+
+    def test_refine_and_open_ptu(self):
+        makedirs(path.join(self.temp_dir.name, "old"))
+        old_path = path.join(self.temp_dir.name, "old")
+        new_path = path.join(self.temp_dir.name, "new")
+        # Files are joined to their folder the same as refine_data module does
+        with open(old_path + "\\sample.ptu", "wt", encoding="utf-8", newline="\r\n") as ptu_file:
+            ptu_file.write(self.content)
+        expected = describe_workbook(extract_data.refine_and_open_ptu("sample.ptu", old_path, new_path,
+                                                                      encoding="utf-8"))
+        with open(new_path + "\\sample.ptu", "rb") as new_file:
+            expected_content = new_file.read().replace(b"\n", b"\r\n")
+        workbook = extract_data.refine_and_open_ptu("sample.ptu", old_path, new_path, encoding="utf-8", binary=True)
+        self.assertEqual(describe_workbook(workbook), expected)
+        with open(new_path + "\\sample.ptu", "rb") as new_file:
+            self.assertEqual(new_file.read(), expected_content)
+
+    def test_ascii_file(self):
+        file_path = path.join(DATA_PATH, "sample.ptu")
+        expected = describe_workbook(extract_data.open_ptu(file_path, "sample.ptu"))
+        for options in ({}, {"use_mmap": True}, {"single_pass": True}):
+            workbook = extract_data.open_ptu(file_path, "sample.ptu", binary=True, **options)
+            self.assertEqual(describe_workbook(workbook), expected, options)
+
+
+class EquivalenceTest(unittest.TestCase):
+    """
+    Every way of extracting a ptu file must give the same data as two-pass extraction (open_ptu with no options),
+    checked on files of data folder of tests and a generated file.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = TemporaryDirectory()
+        generated_path = path.join(cls.temp_dir.name, "generated.ptu")
+        write_ptu(generated_path, 7)
+        cls.ptu_paths = sorted(glob(path.join(DATA_PATH, "*.ptu"))) + [generated_path]
+        cls.expected = {ptu_path: describe_workbook(extract_data.open_ptu(ptu_path, path.basename(ptu_path)))
+                        for ptu_path in cls.ptu_paths}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+
+    def test_open_ptu_options(self):
+        for ptu_path in self.ptu_paths:
+            for options in ({"single_pass": True}, {"use_mmap": True}, {"use_mmap": True, "lazy_values": True},
+                            {"use_mmap": True, "single_pass": True}, {"lazy_services": True},
+                            {"use_mmap": True, "lazy_values": True, "lazy_services": True}, {"jobs": 2}):
+                workbook = extract_data.open_ptu(ptu_path, path.basename(ptu_path), **options)
+                self.assertEqual(describe_workbook(workbook), self.expected[ptu_path], (ptu_path, options))
+
+    def test_iter_services(self):
+        for ptu_path in self.ptu_paths:
+            for use_mmap in (False, True):
+                workbook = extract_data.PtuWorkBook()
+                workbook.name += path.basename(ptu_path).replace(".ptu", "")
+                workbook.services = list(extract_data.iter_services(ptu_path, use_mmap=use_mmap, workbook=workbook))
+                self.assertEqual(describe_workbook(workbook), self.expected[ptu_path], (ptu_path, use_mmap))
+
+    def test_open_ptu_many(self):
+        for jobs in (1, 2):
+            workbooks = extract_data.open_ptu_many(self.ptu_paths, jobs=jobs)
+            try:
+                self.assertEqual([describe_workbook(workbook) for workbook in workbooks],
+                                 [self.expected[ptu_path] for ptu_path in self.ptu_paths])
+            finally:
+                for workbook in workbooks:
+                    workbook.close()
+
+
+class IterServicesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def assert_same_as_open_ptu(self, file_path):
+        expected = extract_data.open_ptu(file_path, "")
+        for use_mmap in (False, True):
+            workbook = extract_data.PtuWorkBook()
+            services = list(extract_data.iter_services(file_path, use_mmap=use_mmap, workbook=workbook))
+            self.assertEqual([describe_service(service) for service in services],
+                             [describe_service(service) for service in expected.services])
+            workbook.services = services
+            self.assertEqual(describe_workbook(workbook), describe_workbook(expected))
+
+    def test_streamed_services(self):
+        file_path = path.join(DATA_PATH, "sample.ptu")
+        with open(file_path, "rt") as ptu_file:
+            extract_data.PtuParser(extract_data.PtuWorkBook(), ptu_file).parse()
+        self.assertEqual(len(extract_data.open_ptu(file_path, "").services), 2)
+        self.assert_same_as_open_ptu(file_path)
+
+    def test_services_after_structure_error(self):
+        with open(path.join(DATA_PATH, "sample.ptu"), "rt") as ptu_file:
+            content = ptu_file.read()
+        # INITIALISATION after the first service is not expected by PtuParser, the second service is extracted again
+        end_of_first_service = content.index("END SERVICE\n") + len("END SERVICE\n")
+        content = content[:end_of_first_service] + "INITIALISATION\n#q = 1;\nEND INITIALISATION\n" + \
+            content[end_of_first_service:]
+        file_path = path.join(self.temp_dir.name, "late_initialisation.ptu")
+        with open(file_path, "wt") as ptu_file:
+            ptu_file.write(content)
+        with self.assertRaises(extract_data.PtuStructureError):
+            extract_data.PtuParser(extract_data.PtuWorkBook(), iter(content.splitlines(keepends=True))).parse()
+        self.assert_same_as_open_ptu(file_path)
+
+
+class ElementUseTest(unittest.TestCase):
+
+    def test_use_includes_uses_of_test_and_service(self):
+        for options in ({}, {"single_pass": True}):
+            workbook = extract_data.open_ptu(path.join(DATA_PATH, "sample.ptu"), "sample.ptu", **options)
+            element = workbook.services[0].test_list[0].element
+            self.assertEqual(list(element.use), ["env2", "env1"])
+            element.own_use.append("env3")
+            self.assertEqual(list(element.use), ["env3", "env2", "env1"])
+            self.assertEqual(element.own_use, ["env3"])
+            with self.assertRaises(AttributeError):
+                element.use = []
+
+
+class RefineAndOpenPtuTest(unittest.TestCase):
+    """
+    Files are joined to their folder the same as refine_data module does.
+    """
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.old_path = path.join(self.temp_dir.name, "old")
+        self.new_path = path.join(self.temp_dir.name, "new")
+        makedirs(self.old_path)
+        makedirs(self.new_path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_file(self, file_path, content):
+        with open(file_path, "wt") as ptu_file:
+            ptu_file.write(content)
+
+    def read_file(self, file_path):
+        with open(file_path, "rt") as ptu_file:
+            return ptu_file.read()
+
+    def test_broken_file_is_not_written(self):
+        self.write_file(self.old_path + "\\broken.ptu", "SERVICE s\n#x\nEND IF\nEND SERVICE\n")
+        self.write_file(self.new_path + "\\broken.ptu", "older new file\n")
+        for binary in (False, True):
+            with self.assertRaises(refine_data.PtuScopeError):
+                extract_data.refine_and_open_ptu("broken.ptu", self.old_path, self.new_path, binary=binary)
+            self.assertEqual(self.read_file(self.new_path + "\\broken.ptu"), "older new file\n")
+            self.assertFalse(path.exists(self.new_path + "\\broken.ptu.tmp"))
+
+    def test_same_as_rewrite_ptu_file(self):
+        content = self.read_file(path.join(DATA_PATH, "sample.ptu")) + "IF OPEN_A\n#a\n##define const const\n#b\n"
+        self.write_file(self.old_path + "\\sample.ptu", content)
+        refine_data.rewrite_ptu_file("sample.ptu", self.old_path, self.new_path, write_line_map=True, diagnostics=[])
+        new_content = self.read_file(self.new_path + "\\sample.ptu")
+        expected_map = refine_data.load_line_map(self.new_path + "\\sample.ptu" + const.LINE_MAP_EXTENSION)
+        expected = describe_workbook(extract_data.open_ptu(self.new_path + "\\sample.ptu", "sample.ptu"))
+
+        refined_path = path.join(self.temp_dir.name, "refined")
+        line_map = refine_data.LineMap()
+        workbook = extract_data.refine_and_open_ptu("sample.ptu", self.old_path, refined_path, line_map, [])
+        self.assertEqual(self.read_file(refined_path + "\\sample.ptu"), new_content)
+        self.assertIn("IF OPEN_A\nENDIF\n#a\n", new_content)
+        self.assertFalse(path.exists(refined_path + "\\sample.ptu.tmp"))
+        self.assertEqual([line_map.get_old_line_num(line_num) for line_num in range(line_map.line_count)],
+                         [expected_map.get_old_line_num(line_num) for line_num in range(expected_map.line_count)])
+        self.assertEqual(describe_workbook(workbook), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,202 @@
+from os import path
+import random
+import unittest
+from keywords import Keyword, classify_keyword
+
+DATA_PATH = path.join(path.dirname(path.abspath(__file__)), "data")
+
+""" Keywords which start or end a scope, checked by check_for_errors function in refine_data """
+
+REFINE_KEYWORDS = {Keyword.IF, Keyword.END_IF, Keyword.ELEMENT, Keyword.END_ELEMENT, Keyword.TEST, Keyword.END_TEST,
+                   Keyword.SERVICE, Keyword.END_SERVICE, Keyword.ENVIRONMENT, Keyword.END_ENVIRONMENT,
+                   Keyword.DEFINE_STUB, Keyword.END_DEFINE, Keyword.INITIALISATION, Keyword.END_INITIALISATION}
+
+
+def legacy_check_for_errors(line):
+    """
+    Keyword of the line, found the same as check_for_errors function in refine_data did before classify_keyword.
+    :param line: A line of ptu file
+    :returns: One of REFINE_KEYWORDS, or Keyword.NONE
+    """
+    line_context = line.strip().upper()
+    if line_context.startswith("IF"):
+        return Keyword.IF
+    elif line_context.startswith("ENDIF") or line_context.startswith("END IF"):
+        return Keyword.END_IF
+    elif line_context.startswith("ELEMENT"):
+        return Keyword.ELEMENT
+    elif line_context.startswith("END ELEMENT"):
+        return Keyword.END_ELEMENT
+    elif line_context.startswith("TEST"):
+        return Keyword.TEST
+    elif line_context.startswith("END TEST"):
+        return Keyword.END_TEST
+    elif line_context.startswith("SERVICE "):
+        return Keyword.SERVICE
+    elif line_context.startswith("END SERVICE"):
+        return Keyword.END_SERVICE
+    elif line_context.startswith("ENVIRONMENT"):
+        return Keyword.ENVIRONMENT
+    elif line_context.startswith("END ENVIRONMENT"):
+        return Keyword.END_ENVIRONMENT
+    elif line_context.startswith("DEFINE STUB"):
+        return Keyword.DEFINE_STUB
+    elif line_context.startswith("END DEFINE"):
+        return Keyword.END_DEFINE
+    elif line_context.startswith("INITIALISATION"):
+        return Keyword.INITIALISATION
+    elif line_context.startswith("END INITIALISATION"):
+        return Keyword.END_INITIALISATION
+    return Keyword.NONE
+
+
+def legacy_save_line_num_by_type(line):
+    """
+    Keyword of the line, found the same as save_line_num_by_type function in extract_data did before classify_keyword.
+    :param line: A stripped line of ptu file
+    :returns: One of Keyword constants
+    """
+    if line.upper().startswith("SERVICE "):
+        return Keyword.SERVICE
+    elif line.upper().startswith("END SERVICE"):
+        return Keyword.END_SERVICE
+    elif line.upper().startswith("TEST"):
+        return Keyword.TEST
+    elif line.upper().startswith("END TEST"):
+        return Keyword.END_TEST
+    elif line.upper().startswith("ELEMENT"):
+        return Keyword.ELEMENT
+    elif line.upper().startswith("END ELEMENT"):
+        return Keyword.END_ELEMENT
+    elif line.upper().startswith("INITIALISATION"):
+        return Keyword.INITIALISATION
+    elif line.upper().startswith("END INITIALISATION"):
+        return Keyword.END_INITIALISATION
+    elif line.upper().startswith("ENVIRONMENT"):
+        return Keyword.ENVIRONMENT
+    elif line.upper().startswith("END ENVIRONMENT"):
+        return Keyword.END_ENVIRONMENT
+    elif line.upper().startswith("DEFINE STUB"):
+        return Keyword.DEFINE_STUB
+    elif line.upper().startswith("END DEFINE"):
+        return Keyword.END_DEFINE
+    elif line.upper().startswith("COMMENT START"):
+        return Keyword.COMMENT_START
+    elif line.upper().startswith("COMMENT END"):
+        return Keyword.COMMENT_END
+    elif line.upper().startswith("HEADER"):
+        return Keyword.HEADER
+    elif line.startswith("##include"):
+        return Keyword.INCLUDE
+    elif line.startswith("-- Purpose"):
+        return Keyword.PURPOSE
+    elif line.startswith("-- Processor"):
+        return Keyword.PROCESSOR
+    elif line.startswith("-- Tool chain"):
+        return Keyword.TOOL_CHAIN
+    elif line.startswith("-- Test Cases"):
+        return Keyword.TEST_CASES
+    elif line.startswith("#"):
+        return Keyword.USER_CODE
+    return Keyword.NONE
+
+
+def legacy_pre_process(line):
+    """
+    Keyword of the line, found the same as pre_process function in extract_data did before classify_keyword:
+    IF, ELSE and ENDIF lines are saved by save_if_scope function, other lines by save_line_num_by_type function.
+    :param line: A line of ptu file
+    :returns: One of Keyword constants
+    """
+    line = line.strip()
+    if line.upper().startswith("IF") or line.upper().startswith("ELSE") or \
+            line.upper().startswith("ENDIF") or line.upper().startswith("END IF"):
+        if line.upper().startswith("IF"):
+            return Keyword.IF
+        elif line.upper().startswith("ENDIF") or line.upper().startswith("END IF"):
+            return Keyword.END_IF
+        return Keyword.ELSE
+    return legacy_save_line_num_by_type(line)
+
+
+def refine_keyword(line):
+    """
+    Keyword of the line, found by classify_keyword the same as check_for_errors function in refine_data does now.
+    """
+    keyword = classify_keyword(line.strip())
+    return keyword if keyword in REFINE_KEYWORDS else Keyword.NONE
+
+
+class ClassifyKeywordTest(unittest.TestCase):
+
+    def assert_same_as_legacy(self, line):
+        self.assertEqual(classify_keyword(line.strip()), legacy_pre_process(line), repr(line))
+        self.assertEqual(refine_keyword(line), legacy_check_for_errors(line), repr(line))
+
+    def test_keywords(self):
+        expected_keywords = [
+            ("IF A", Keyword.IF),
+            ("ELSE", Keyword.ELSE),
+            ("ENDIF", Keyword.END_IF),
+            ("END IF", Keyword.END_IF),
+            ("SERVICE s1", Keyword.SERVICE),
+            ("SERVICE", Keyword.NONE),  # SERVICE is only a keyword with a space after it
+            ("SERVICES", Keyword.NONE),
+            ("END SERVICE", Keyword.END_SERVICE),
+            ("TEST 1", Keyword.TEST),
+            ("TESTING", Keyword.TEST),
+            ("END TEST", Keyword.END_TEST),
+            ("ELEMENT", Keyword.ELEMENT),
+            ("END ELEMENT", Keyword.END_ELEMENT),
+            ("INITIALISATION", Keyword.INITIALISATION),
+            ("END INITIALISATION", Keyword.END_INITIALISATION),
+            ("ENVIRONMENT env", Keyword.ENVIRONMENT),
+            ("END ENVIRONMENT", Keyword.END_ENVIRONMENT),
+            ("DEFINE STUB stubs", Keyword.DEFINE_STUB),
+            ("END DEFINE", Keyword.END_DEFINE),
+            ("COMMENT START", Keyword.COMMENT_START),
+            ("COMMENT END", Keyword.COMMENT_END),
+            ("COMMENT test", Keyword.NONE),
+            ("HEADER m, 1, 2", Keyword.HEADER),
+            ("##include \"a.h\"", Keyword.INCLUDE),
+            ("##INCLUDE \"a.h\"", Keyword.USER_CODE),  # ##include is case-sensitive
+            ("#int a;", Keyword.USER_CODE),
+            ("-- Purpose: x", Keyword.PURPOSE),
+            ("-- purpose: x", Keyword.NONE),
+            ("-- Processor: x", Keyword.PROCESSOR),
+            ("-- Tool chain: x", Keyword.TOOL_CHAIN),
+            ("-- Test Cases", Keyword.TEST_CASES),
+            ("-- comment", Keyword.NONE),
+            ("if a", Keyword.IF),
+            ("End If", Keyword.END_IF),
+            ("end test", Keyword.END_TEST),
+            ("Service s", Keyword.SERVICE),
+            ("ıf a", Keyword.IF),  # Dotless i is I in upper case
+            ("İF a", Keyword.NONE),
+            ("ßX", Keyword.NONE),
+            ("", Keyword.NONE),
+            ("VAR a, init = 0, ev = 0", Keyword.NONE),
+        ]
+        for line, keyword in expected_keywords:
+            self.assertEqual(classify_keyword(line), keyword, repr(line))
+            self.assert_same_as_legacy(line)
+
+    def test_sample_file(self):
+        with open(path.join(DATA_PATH, "sample.ptu"), "rt") as ptu_file:
+            for line in ptu_file:
+                self.assert_same_as_legacy(line)
+
+    def test_random_lines(self):
+        words = ["IF", "if", "ELSE", "ENDIF", "END IF", "end if", "END", "SERVICE ", "SERVICE", "END SERVICE", "TEST",
+                 "test", "END TEST", "ELEMENT", "END ELEMENT", "INITIALISATION", "END INITIALISATION", "ENVIRONMENT",
+                 "END ENVIRONMENT", "DEFINE STUB", "END DEFINE", "COMMENT START", "COMMENT END", "HEADER",
+                 "##include", "##INCLUDE", "-- Purpose", "-- purpose", "-- Processor", "-- Tool chain",
+                 "-- Test Cases", "#", "--", "-", " ", "\t", "x", "S", "E", "N", "D", "I", "F",
+                 "ı", "İ", "ß", "ﬀ", "ŉ"]
+        rnd = random.Random(0)
+        for _ in range(20000):
+            self.assert_same_as_legacy("".join(rnd.choice(words) for _ in range(rnd.randint(0, 4))))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+from os import path, listdir, utime
+from shutil import rmtree
+from tempfile import TemporaryDirectory, mkdtemp
+import gc
+from unittest import mock
+import unittest
+import constants as const
+import extract_data
+import parse_cache
+
+DATA_PATH = path.join(path.dirname(path.abspath(__file__)), "data")
+
+
+class ParseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.cache = parse_cache.ParseCache(path.join(self.temp_dir.name, "cache"))
+        self.ptu_path = path.join(DATA_PATH, "sample.ptu")
+        self.workbook = extract_data.open_ptu(self.ptu_path, "sample.ptu")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_save_and_load(self):
+        key = self.cache.get_key(self.ptu_path)
+        self.assertIsNone(self.cache.load(key))
+        self.cache.save(key, self.workbook)
+        self.cache.save(key, self.workbook)  # Another process may save the same file again
+        self.assertFalse([file_name for file_name in listdir(self.cache.directory) if file_name.endswith(".tmp")])
+
+        workbook = self.cache.load(key)
+        self.assertEqual([service.name for service in workbook.services],
+                         [service.name for service in self.workbook.services])
+        self.assertEqual(self.cache.get_stats()["hits"], 1)
+
+    def test_least_recently_used_file_is_evicted(self):
+        old_key, new_key = "a" * 64, "b" * 64
+        self.cache.save(old_key, self.workbook)
+        old_path = path.join(self.cache.directory, old_key + const.PARSE_CACHE_EXTENSION)
+        self.assertTrue(path.exists(old_path))
+        file_size = path.getsize(old_path)
+        utime(old_path, ns=(0, 0))
+        self.cache.max_size = file_size * 3 // 2
+        self.cache.save(new_key, self.workbook)
+        self.assertEqual(listdir(self.cache.directory), [new_key + const.PARSE_CACHE_EXTENSION])
+        self.assertEqual(self.cache.get_stats()["evictions"], 1)
+
+    def test_evict_skips_removed_files(self):
+        keys = ["a" * 64, "b" * 64]
+        for key in keys:
+            self.cache.save(key, self.workbook)
+        self.cache.max_size = 0
+        file_names = [key + const.PARSE_CACHE_EXTENSION for key in keys]
+        # Files are removed by another process, while this process is evicting them
+        with mock.patch.object(parse_cache, "listdir", return_value=file_names), \
+                mock.patch.object(parse_cache, "remove", side_effect=FileNotFoundError):
+            self.cache.evict()
+        file_names.append("c" * 64 + const.PARSE_CACHE_EXTENSION)  # Removed before it is found in directory
+        with mock.patch.object(parse_cache, "listdir", return_value=file_names):
+            self.cache.evict()
+        self.assertFalse(any(path.exists(self.cache.get_file_path(key)) for key in keys))
+
+
+class WorkBookViewTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ptu_path = path.join(DATA_PATH, "sample.ptu")
+        self.directory = mkdtemp(prefix="ptu_")
+        self.file_path = extract_data.extract_to_file(self.ptu_path, "sample.ptu", self.directory)
+
+    def tearDown(self):
+        rmtree(self.directory, ignore_errors=True)
+
+    def test_with_statement(self):
+        with parse_cache.WorkBookView(self.file_path, remove_file=True, directory=self.directory) as workbook:
+            self.assertEqual(workbook.name, "sample")
+            self.assertTrue(len(workbook.services) > 0)
+        self.assertFalse(workbook.finalizer.alive)
+        workbook.close()  # Closing again does nothing
+        self.assertFalse(path.exists(self.directory))
+
+    def test_mapped_file_is_removed_when_collected(self):
+        # Platforms which can't remove mapped files (e.g. Windows)
+        with mock.patch.object(parse_cache, "remove", side_effect=PermissionError):
+            workbook = parse_cache.WorkBookView(self.file_path, remove_file=True, directory=self.directory)
+        self.assertTrue(path.exists(self.file_path))
+        del workbook
+        gc.collect()
+        self.assertFalse(path.exists(self.directory))
+
+    def test_open_ptu_many_closes_views_on_error(self):
+        views = []
+        directories = []
+
+        def open_view(file_path, **kwargs):
+            if views:
+                raise KeyboardInterrupt
+            with mock.patch.object(parse_cache, "remove", side_effect=PermissionError):
+                views.append(WorkBookView(file_path, **kwargs))
+            return views[-1]
+
+        def make_directory(**kwargs):
+            directories.append(mkdtemp(**kwargs))
+            return directories[-1]
+
+        WorkBookView = parse_cache.WorkBookView
+        with mock.patch.object(parse_cache, "WorkBookView", side_effect=open_view), \
+                mock.patch.object(extract_data, "mkdtemp", side_effect=make_directory):
+            with self.assertRaises(KeyboardInterrupt):
+                extract_data.open_ptu_many([self.ptu_path, self.ptu_path], jobs=1)
+        self.assertFalse(views[0].finalizer.alive)
+        self.assertFalse(path.exists(directories[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+from os import path, makedirs
+from tempfile import TemporaryDirectory
+import unittest
+import constants as const
+import refine_data
+
+DATA_PATH = path.join(path.dirname(path.abspath(__file__)), "data")
+
+
+def read_data_file(file_name):
+    """
+    :returns: content of a file in data folder of tests
+    """
+    with open(path.join(DATA_PATH, file_name), "rt") as data_file:
+        return data_file.read()
+
+
+class CountedLines:
+    """
+    Lines of a file which count how many times they are iterated over, and how many of them are read in the last time.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.read_count = 0
+        self.iter_count = 0
+
+    def __iter__(self):
+        self.read_count = 0
+        self.iter_count += 1
+        for line in self.lines:
+            self.read_count += 1
+            yield line
+
+
+class RefineTestCase(unittest.TestCase):
+    """
+    Base class of tests which refine files in a temporary folder.
+    Files are joined to their folder the same as refine_data module does.
+    """
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.old_path = path.join(self.temp_dir.name, "old")
+        self.new_path = path.join(self.temp_dir.name, "new")
+        makedirs(self.old_path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_ptu_file(self, file_name, content, newline=None):
+        with open(self.old_path + "\\" + file_name, "wt", newline=newline) as ptu_file:
+            ptu_file.write(content)
+
+    def read_new_file(self, file_name):
+        with open(self.new_path + "\\" + file_name, "rt") as new_file:
+            return new_file.read()
+
+
+class RewritePtuFileTest(RefineTestCase):
+
+    def test_output_is_same_as_before_streaming(self):
+        # sample_refined.ptu is written by rewrite_ptu_file before lines were streamed (reading all of lines at once)
+        self.write_ptu_file("sample.ptu", read_data_file("sample.ptu"))
+        refine_data.rewrite_ptu_file("sample.ptu", self.old_path, self.new_path)
+        self.assertEqual(self.read_new_file("sample.ptu"), read_data_file("sample_refined.ptu"))
+
+    def test_lines_are_streamed(self):
+        ptu_lines = CountedLines(read_data_file("sample.ptu").splitlines(keepends=True))
+        missing_endifs = []
+        new_lines = refine_data.refine_lines(ptu_lines, "sample.ptu", missing_endifs=missing_endifs)
+        self.assertEqual(next(new_lines), "-- Filename : sample\n")
+        # Every line is written after reading the next one (see IfErrorHandler class)
+        self.assertEqual(ptu_lines.read_count, 2)
+        self.assertEqual("".join(new_lines), read_data_file("sample_refined.ptu").split("\n", 1)[1])
+        self.assertEqual(ptu_lines.iter_count, 1)
+        self.assertEqual(missing_endifs, [])
+
+    def test_broken_file_is_not_written(self):
+        self.write_ptu_file("broken.ptu", "SERVICE s\n#x\n")
+        with self.assertRaises(refine_data.PtuScopeError):
+            refine_data.rewrite_ptu_file("broken.ptu", self.old_path, self.new_path)
+        self.assertFalse(path.exists(self.new_path + "\\broken.ptu"))
+        self.assertFalse(path.exists(self.new_path + "\\broken.ptu.tmp"))
+
+        result = refine_data.refine_file("broken.ptu", self.old_path, self.new_path)
+        self.assertEqual(result.status, const.REFINE_ERROR)
+        self.assertFalse(path.exists(self.new_path + "\\broken.ptu"))
+
+    def test_old_line_map_is_removed(self):
+        self.write_ptu_file("sample.ptu", read_data_file("sample.ptu"))
+        refine_data.rewrite_ptu_file("sample.ptu", self.old_path, self.new_path, write_line_map=True)
+        map_path = self.new_path + "\\sample.ptu" + const.LINE_MAP_EXTENSION
+        line_map = refine_data.load_line_map(map_path)
+        self.assertEqual(line_map.line_count, 100)
+        self.assertEqual(line_map.get_old_line_num(4), 5)  # "--~T" at line 4 is omitted
+
+        refine_data.rewrite_ptu_file("sample.ptu", self.old_path, self.new_path)
+        self.assertFalse(path.exists(map_path))
+
+    def test_binary_mode_is_same_as_text_mode(self):
+        content = read_data_file("sample.ptu") + "IF OPEN_A\n#a\n--~T\n#b\n##define const const\nSERVICE s\n#c"
+        self.write_ptu_file("crlf.ptu", content, newline="\r\n")
+        text_diagnostics, binary_diagnostics = [], []
+        refine_data.rewrite_ptu_file("crlf.ptu", self.old_path, self.new_path, diagnostics=text_diagnostics)
+        text_content = self.read_new_file("crlf.ptu")
+        refine_data.rewrite_ptu_file("crlf.ptu", self.old_path, self.new_path, diagnostics=binary_diagnostics,
+                                     binary=True)
+        with open(self.new_path + "\\crlf.ptu", "rb") as new_file:
+            self.assertEqual(new_file.read(), text_content.replace("\n", "\r\n").encode())
+        self.assertTrue(text_content.endswith("#a\nENDIF\n#b\n##define const const\nSERVICE s\n#c\nEND SERVICE\n"))
+        self.assertEqual([str(diagnostic) for diagnostic in binary_diagnostics],
+                         [str(diagnostic) for diagnostic in text_diagnostics])
+
+
+class RefineManifestTest(RefineTestCase):
+
+    def test_broken_manifest_is_ignored(self):
+        makedirs(self.new_path)
+        for content in ('{"version": 1, "files": {"a.ptu": {', "[]"):
+            with open(self.new_path + "\\" + const.REFINE_MANIFEST_NAME, "wt") as manifest_file:
+                manifest_file.write(content)
+            manifest = refine_data.RefineManifest(self.new_path)
+            self.assertEqual(manifest.files, {})
+            self.assertFalse(manifest.is_up_to_date("a.ptu", self.old_path, self.new_path))
+
+
+class IfErrorTest(unittest.TestCase):
+
+    def test_missing_endifs_are_added(self):
+        ptu_lines = ["IF OPEN_A\n", "IF CLOSED\n", "#a\n", "ENDIF\n", "#b\n", "##define const const\n",
+                     "IF OPEN_B\n", "#c"]
+        line_map = refine_data.LineMap()
+        new_lines = list(refine_data.refine_lines(ptu_lines, "test.ptu", line_map))
+        self.assertEqual(new_lines, ["IF OPEN_A\n", "IF CLOSED\n", "#a\n", "ENDIF\n", "ENDIF\n", "#b\n",
+                                     "##define const const\n", "IF OPEN_B\n", "#c\n", "ENDIF\n"])
+        self.assertEqual([line_map.get_old_line_num(line_num) for line_num in range(len(new_lines))],
+                         [0, 1, 2, 3, 4, 4, 5, 6, 7, 7])
+
+    def test_iterator_is_not_read_twice(self):
+        ptu_lines = ["IF OPEN_A\n", "#a\n", "##define const const\n", "#b\n"]
+        with self.assertRaises(TypeError):
+            refine_data.refine_lines(iter(ptu_lines), "test.ptu")
+        missing_endifs = []
+        new_lines = list(refine_data.refine_lines(iter(ptu_lines), "test.ptu", missing_endifs=missing_endifs))
+        # ENDIF of OPEN_A must be inserted before "#a", but it is only found at the end
+        self.assertEqual(new_lines, ["IF OPEN_A\n", "#a\n", "##define const const\n", "#b\n"])
+        self.assertEqual([(endif.context, endif.old_line_num, endif.new_line_num) for endif in missing_endifs],
+                         [("ENDIF\n", 1, 1)])
+        self.assertEqual(list(refine_data.insert_missing_endifs(new_lines, missing_endifs)),
+                         list(refine_data.refine_lines(ptu_lines, "test.ptu")))
+
+
+class RewriteIfErrorTest(RefineTestCase):
+
+    def test_missing_endifs_are_inserted_into_new_file(self):
+        ptu_lines = ["IF OPEN_A\n", "IF CLOSED\n", "#a\n", "ENDIF\n", "#b\n", "##define const const\n",
+                     "IF OPEN_B\n", "IF OPEN_C\n", "#c\n", "##define const const\n", "#d\n", "IF OPEN_D\n", "#e"]
+        self.write_ptu_file("test.ptu", "".join(ptu_lines))
+        diagnostics = []
+        refine_data.rewrite_ptu_file("test.ptu", self.old_path, self.new_path, write_line_map=True,
+                                     diagnostics=diagnostics)
+        line_map = refine_data.LineMap()
+        new_lines = list(refine_data.refine_lines(ptu_lines, "test.ptu", line_map))
+        self.assertEqual(self.read_new_file("test.ptu"), "".join(new_lines))
+        self.assertEqual(new_lines.count("ENDIF\n"), 5)
+        self.assertEqual(len(diagnostics), 4)
+        self.assertFalse(path.exists(self.new_path + "\\test.ptu.tmp"))
+        self.assertFalse(path.exists(self.new_path + "\\test.ptu.endif.tmp"))
+
+        saved_line_map = refine_data.load_line_map(self.new_path + "\\test.ptu" + const.LINE_MAP_EXTENSION)
+        self.assertEqual(saved_line_map.line_count, len(new_lines))
+        self.assertEqual([saved_line_map.get_old_line_num(line_num) for line_num in range(len(new_lines))],
+                         [line_map.get_old_line_num(line_num) for line_num in range(len(new_lines))])
+
+if __name__ == "__main__":
+    unittest.main()